@@ -0,0 +1,209 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from mikesgradingtool.utils.config_json import get_app_config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Used when gradingTool.json doesn't have canvas/download/attachment_store_dir
+DEFAULT_ATTACHMENT_STORE_DIR = "~/.gradingtool/attachments"
+
+# Files that haven't been downloaded or re-used in this many days are deleted from the store
+# (gradingTool.json can change this with canvas/download/attachment_store_max_age_days; 0 keeps everything forever)
+DEFAULT_MAX_AGE_DAYS = 120
+
+# The store is checked for expired files at most this often (in seconds)
+PRUNE_INTERVAL = 24 * 60 * 60
+
+# Linux's ioctl for making a copy-on-write clone of a file (btrfs, XFS, etc)
+FICLONE = 0x40049409
+
+
+# A content-addressed store for everything we download from Canvas.
+#
+# Layout (under the store's root directory):
+#   blobs/ab/abcdef...      The file's contents, named by its SHA-256.  Each unique file is stored once
+#   ids/12345-6789          Canvas attachment id 12345 (which is 6789 bytes long).  Contains the SHA-256
+#                           of the attachment, so we know which blob it is without downloading it again
+#   tmp/12345-6789.part     A download in progress.  Left behind if the download is interrupted,
+#                           so the next attempt can pick up where this one left off
+#
+# Files are then copied into the student folders, so the same attachment showing up in several attempts,
+# revision assignments, or sections is only downloaded once.  Every student folder gets its own copy
+# (a copy-on-write clone, where the file system can do that), since the files get edited while grading.
+#
+# Each blob's modification time is updated whenever it's used, and blobs that haven't been used for
+# canvas/download/attachment_store_max_age_days are deleted (checked at most once a day)
+class CanvasAttachmentStore:
+
+    def __init__(self, fp_root: str = None):
+        if fp_root is None:
+            fp_root = get_app_config().getKey("canvas/download/attachment_store_dir", DEFAULT_ATTACHMENT_STORE_DIR)
+        self.fp_root = os.path.normcase(os.path.expanduser(fp_root))
+        self.fp_blobs = os.path.join(self.fp_root, "blobs")
+        self.fp_ids = os.path.join(self.fp_root, "ids")
+        self.fp_tmp = os.path.join(self.fp_root, "tmp")
+        for fp_dir in (self.fp_blobs, self.fp_ids, self.fp_tmp):
+            os.makedirs(fp_dir, exist_ok=True)
+
+        self.max_age_days = float(get_app_config().getKey("canvas/download/attachment_store_max_age_days",
+                                                          DEFAULT_MAX_AGE_DAYS))
+        self._prune_if_due()
+
+        # Two students in the same group hand in the same attachment, so make sure that only
+        # one thread works on a given attachment at a time
+        self._locks_lock = threading.Lock()
+        self._locks = dict()
+
+    @staticmethod
+    def attachment_key(attach: dict) -> str:
+        return f"{attach['id']}-{attach.get('size', 'unknown')}"
+
+    def lock_for(self, key: str) -> threading.Lock:
+        with self._locks_lock:
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.fp_blobs, sha256[:2], sha256)
+
+    # Returns (fp_blob, sha256) if we've already got this attachment, otherwise (None, None)
+    def lookup(self, key: str, expected_size: int = None):
+        fp_id = os.path.join(self.fp_ids, key)
+        try:
+            with open(fp_id, mode='r', encoding="utf-8") as inp:
+                sha256 = inp.read().strip()
+        except FileNotFoundError:
+            return None, None
+
+        fp_blob = self._blob_path(sha256)
+        try:
+            size = os.path.getsize(fp_blob)
+        except OSError:
+            return None, None
+
+        # A blob that's the wrong size was cut short (or changed somehow), so it isn't what Canvas has
+        if expected_size is not None and size != expected_size:
+            try:
+                os.remove(fp_blob)  # so that add() puts the re-downloaded file in its place
+            except OSError:
+                pass
+            return None, None
+
+        self._touch(fp_blob)
+        return fp_blob, sha256
+
+    # Where a (possibly interrupted) download of this attachment goes.  Only one thread at a time
+    # should use this (see lock_for)
+    def partial_path(self, key: str) -> str:
+        return os.path.join(self.fp_tmp, f"{key}.part")
+
+    # A fresh, unique name in the store's tmp dir
+    def new_temp_path(self, key: str) -> str:
+        return os.path.join(self.fp_tmp, f"{key}.{uuid.uuid4().hex}.tmp")
+
+    # Move a finished download (with the given SHA-256) into the store, and remember which attachment it was.
+    # If we've already got a file with that content then the new copy is thrown away
+    def add(self, key: str, fp_downloaded: str, sha256: str) -> str:
+        fp_blob = self._blob_path(sha256)
+        os.makedirs(os.path.dirname(fp_blob), exist_ok=True)
+        if os.path.exists(fp_blob):
+            os.remove(fp_downloaded)
+            self._touch(fp_blob)
+        else:
+            os.replace(fp_downloaded, fp_blob)
+
+        fp_id_tmp = self.new_temp_path(key)
+        with open(fp_id_tmp, mode='w', encoding="utf-8") as out:
+            out.write(sha256)
+        os.replace(fp_id_tmp, os.path.join(self.fp_ids, key))
+        return fp_blob
+
+    # Put a copy of the blob at fp_dest (replacing whatever is there)
+    # The copy is a clone when the file system can do that (so it's instant, and doesn't take up more space
+    # until it's edited), otherwise it's an ordinary copy
+    @staticmethod
+    def place(fp_blob: str, fp_dest: str):
+        fp_dest_tmp = f"{fp_dest}.{uuid.uuid4().hex}.tmp"
+        try:
+            if not _clone_file(fp_blob, fp_dest_tmp):
+                shutil.copyfile(fp_blob, fp_dest_tmp)
+            os.replace(fp_dest_tmp, fp_dest)
+        finally:
+            if os.path.exists(fp_dest_tmp):
+                os.remove(fp_dest_tmp)
+
+    # Mark the file as just used (so that it doesn't expire)
+    @staticmethod
+    def _touch(fp: str):
+        try:
+            os.utime(fp)
+        except OSError:
+            pass
+
+    def _prune_if_due(self):
+        if self.max_age_days <= 0:
+            return
+        fp_last_pruned = os.path.join(self.fp_root, "last_pruned")
+        try:
+            if time.time() - os.path.getmtime(fp_last_pruned) < PRUNE_INTERVAL:
+                return
+        except OSError:
+            pass  # never pruned
+
+        with open(fp_last_pruned, mode='w', encoding="utf-8") as out:
+            out.write(time.strftime("%Y-%m-%d %H:%M:%S"))
+        self.prune()
+
+    # Delete the blobs (and unfinished downloads) that haven't been used in max_age_days,
+    # and the attachment ids that pointed to them.  Returns how many files were deleted
+    def prune(self, max_age_days: float = None) -> int:
+        if max_age_days is None:
+            max_age_days = self.max_age_days
+        cutoff = time.time() - max_age_days * 24 * 60 * 60
+
+        removed = 0
+        for fp_dir in (self.fp_blobs, self.fp_tmp):
+            for fp_parent, dirs, files in os.walk(fp_dir):
+                for fn in files:
+                    fp = os.path.join(fp_parent, fn)
+                    try:
+                        if os.path.getmtime(fp) < cutoff:
+                            os.remove(fp)
+                            removed += 1
+                    except OSError:
+                        pass  # someone else got to it first
+
+        for fn in os.listdir(self.fp_ids):
+            fp_id = os.path.join(self.fp_ids, fn)
+            try:
+                with open(fp_id, mode='r', encoding="utf-8") as inp:
+                    sha256 = inp.read().strip()
+                if not os.path.exists(self._blob_path(sha256)):
+                    os.remove(fp_id)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+# Copy-on-write clone of fp_src (Linux only, and only on file systems that support it).
+# Returns False if it couldn't be cloned
+def _clone_file(fp_src: str, fp_dest: str) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        with open(fp_src, "rb") as src, open(fp_dest, "wb") as dest:
+            fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        if os.path.exists(fp_dest):
+            os.remove(fp_dest)
+        return False
@@ -0,0 +1,164 @@
+import os
+import time
+from collections import namedtuple
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from mikesgradingtool.Canvas.CanvasAttachmentStore import CanvasAttachmentStore
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.misc_utils import print_threadsafe, sha256_of_file
+from mikesgradingtool.utils.ordered_executor import OrderedExecutor, max_workers_from_config
+from mikesgradingtool.utils.print_utils import printError
+
+# Used when neither the command line nor gradingTool.json (canvas/download/max_concurrent_downloads)
+# say how many files to download at once
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 16
+
+# Attachments are streamed to disk in 1MB pieces (instead of the old 1KB reads)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# (connect, read) timeouts, in seconds
+DOWNLOAD_TIMEOUT = (30, 300)
+
+# Used when gradingTool.json doesn't have canvas/download/max_tries.
+# Each retry continues the download from where the previous try stopped
+DEFAULT_MAX_TRIES = 4
+
+# seconds to wait before retrying (multiplied by the number of tries so far)
+RETRY_DELAY = 2
+
+# What a finished download's future returns
+download_result = namedtuple('download_result', 'fp_dest size sha256')
+
+
+# A single, course-wide download engine:
+#   * Every student's attachments go into one work queue, so the whole assignment
+#       downloads in one pipelined pass (instead of spinning up a new thread pool per student)
+#   * All the worker threads share one requests.Session, so connections to Canvas' file
+#       servers are kept alive and re-used (instead of a new TLS handshake per file)
+#   * The number of simultaneous downloads is capped
+#   * Downloads go into a temp file that's checked against the size Canvas reports before it's used.
+#       Interrupted downloads are resumed (instead of restarted, or left half-written in a student's folder)
+#   * Attachments are downloaded into a CanvasAttachmentStore and then copied into place, so anything
+#       we've downloaded before (earlier attempts, revisions, other sections) isn't downloaded again
+#
+# The concurrent, multithreaded download code was originally copied from:
+# https://rednafi.github.io/digressions/python/2020/04/21/python-concurrent-futures.html#download--save-files-from-urls-with-multi-threading
+# Code was then reworked into this class
+class CanvasDownloader:
+
+    def __init__(self, max_workers: int = None, verbose: bool = False):
+        self.max_workers = max_workers_from_config(max_workers, "canvas/download/max_concurrent_downloads",
+                                                   DEFAULT_MAX_CONCURRENT_DOWNLOADS)
+        self.verbose = verbose
+        self.max_tries = max(1, int(get_app_config().getKey("canvas/download/max_tries", DEFAULT_MAX_TRIES)))
+        self.store = CanvasAttachmentStore()
+
+        self._session = requests.Session()
+        # pool_maxsize is per-host, so each worker can keep its own connection open
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._work = OrderedExecutor(self.max_workers, "canvas_download")
+
+    # (closing also closes the connections to Canvas' file servers)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Queue up a Canvas attachment to download.  Returns immediately; the download happens on a worker thread
+    # If given, on_complete(download_result) is called (on the worker thread) once the file is on disk
+    def submit(self, attach: dict, fp_dest: str, version_num: int, on_complete: Callable = None):
+        return self._work.submit(self._download_one, attach, fp_dest, version_num, on_complete, tag=fp_dest)
+
+    def _download_one(self, attach: dict, fp_dest: str, version_num: int, on_complete: Callable = None):
+        key = self.store.attachment_key(attach)
+
+        with self.store.lock_for(key):
+            fp_blob, sha256 = self.store.lookup(key, attach.get('size'))
+            already_had_it = fp_blob is not None
+
+            if not already_had_it:
+                fp_blob, sha256 = self._download_to_store(key, attach['url'], attach.get('size'))
+
+            self.store.place(fp_blob, fp_dest)
+
+        if self.verbose:
+            print_threadsafe(f"\t\tVer #{version_num}\t{os.path.basename(fp_dest)}"
+                             + ("\t(already downloaded)" if already_had_it else ""))
+
+        result = download_result(fp_dest, os.path.getsize(fp_dest), sha256)
+        if on_complete is not None:
+            on_complete(result)
+        return result
+
+    # Returns (fp_blob, sha256)
+    # Network hiccups are retried, picking up where the last try left off (using an HTTP Range request)
+    def _download_to_store(self, key: str, url: str, expected_size: int = None):
+        fp_part = self.store.partial_path(key)
+
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                self._download_to_partial_file(url, fp_part)
+                break
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == self.max_tries:
+                    raise
+                if self.verbose:
+                    print_threadsafe(f"\t\tDownload of {key} was interrupted ({e}); retrying")
+                time.sleep(RETRY_DELAY * attempt)
+
+        # Don't let a truncated (or otherwise wrong) file into the store
+        actual_size = os.path.getsize(fp_part)
+        if expected_size is not None and actual_size != expected_size:
+            os.remove(fp_part)
+            raise IOError(f"Downloaded {actual_size} bytes but Canvas says the file is {expected_size} bytes")
+
+        sha256 = sha256_of_file(fp_part)
+        return self.store.add(key, fp_part, sha256), sha256
+
+    # Download url into fp_part, continuing from wherever a previous try stopped
+    def _download_to_partial_file(self, url: str, fp_part: str):
+        already_have = os.path.getsize(fp_part) if os.path.exists(fp_part) else 0
+        headers = {"Range": f"bytes={already_have}-"} if already_have > 0 else None
+
+        with self._session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, headers=headers) as response:
+            if response.status_code == 416:
+                # We asked for bytes past the end of the file, i.e., we already have all of it
+                return
+
+            response.raise_for_status()
+
+            # 206 means the server is sending the rest of the file.
+            # Anything else (200) means that it ignored the Range, and is sending the whole thing again
+            resuming = already_have > 0 and response.status_code == 206
+            if resuming and self.verbose:
+                print_threadsafe(f"\t\tResuming {os.path.basename(fp_part)} after {already_have:,} bytes")
+
+            with open(fp_part, "ab" if resuming else "wb") as handle:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    handle.write(chunk)
+
+    # Wait for everything that's been queued up so far to finish
+    # Returns a list of (fp_dest, exception) for the downloads that failed
+    def wait(self):
+        failures = []
+        for fp_dest, future in self._work.drain():
+            if future.exception() is not None:
+                failures.append((fp_dest, future.exception()))
+
+        for fp_dest, e in failures:
+            printError(f"Unable to download {os.path.basename(fp_dest)}: {e}")
+
+        return failures
+
+    def close(self):
+        self._work.close()
+        self._session.close()
@@ -0,0 +1,123 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from canvasapi.progress import Progress
+from canvasapi.util import combine_kwargs
+
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.misc_utils import print_threadsafe
+from mikesgradingtool.utils.print_utils import GradingToolError, printError
+
+# Used when neither the command line nor gradingTool.json (canvas/due_dates/max_concurrent_updates)
+# say how many assignments to update at once (when the bulk update can't be used)
+DEFAULT_MAX_CONCURRENT_UPDATES = 8
+
+# How often (in seconds) to ask Canvas how the bulk update is going, and how long to wait for it before giving up
+# (gradingTool.json can change the second one with canvas/due_dates/bulk_update_timeout)
+BULK_UPDATE_POLL_INTERVAL = 1.0
+DEFAULT_BULK_UPDATE_TIMEOUT = 300
+
+# The dates we want one assignment to have.  Each date is a datetime, or '' to remove it
+due_date_change = namedtuple('due_date_change', 'assign due_at lock_at unlock_at')
+
+
+# Does Canvas' current value (a datetime, or None if it isn't set) need to be changed to wanted (a datetime, or '')?
+def _date_differs(current, wanted) -> bool:
+    if wanted == '':
+        return current is not None
+    return current is None or current != wanted
+
+
+# Only the assignments whose due/lock/unlock dates are actually different from what's in Canvas need updating
+def needs_update(change: due_date_change) -> bool:
+    return _date_differs(getattr(change.assign, 'due_at_date', None), change.due_at) \
+        or _date_differs(getattr(change.assign, 'lock_at_date', None), change.lock_at) \
+        or _date_differs(getattr(change.assign, 'unlock_at_date', None), change.unlock_at)
+
+
+# Sends all the due date changes for a course to Canvas.
+#
+# First this tries Canvas' bulk update (one PUT for every assignment, which Canvas then works on in the background,
+# and which we check on until it's done).  If that isn't available (or Canvas says it failed) then each assignment
+# is updated on its own, several at a time.  Either way the requests go through the shared CanvasRequestScheduler.
+#
+# If we give up waiting for the bulk update then nothing else is done, since Canvas may still be working on it
+# (and updating the assignments one at a time as well would race with it).
+#
+# Returns a list of (change, error) for the changes that couldn't be made (empty if everything worked)
+def update_due_dates(course, changes: list, max_workers: int = None, verbose: bool = False) -> list:
+    if not changes:
+        return []
+
+    try:
+        progress = _bulk_update(course, changes, verbose)
+        if progress.workflow_state == "completed":
+            return []
+        if progress.workflow_state != "failed":
+            error = GradingToolError(f"Canvas' bulk update is still {progress.workflow_state} "
+                                     f"({getattr(progress, 'completion', 0) or 0:.0f}% done) - check on it at "
+                                     f"{getattr(progress, 'url', None) or f'progress/{progress.id}'} before trying again")
+            return [(change, error) for change in changes]
+    except Exception as e:
+        if verbose:
+            print_threadsafe(f"\t{course.name}: Canvas' bulk update didn't work ({type(e).__name__}: {e})")
+
+    print_threadsafe(f"\t{course.name}: Updating the assignments one at a time instead")
+    if max_workers is None:
+        max_workers = get_app_config().getKey("canvas/due_dates/max_concurrent_updates", DEFAULT_MAX_CONCURRENT_UPDATES)
+    with ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="due_date_update") as pool:
+        errors = list(pool.map(_edit_one, changes))
+    return [(change, error) for change, error in zip(changes, errors) if error is not None]
+
+
+# Returns the bulk update's Progress once it's 'completed' or 'failed', or as it was when we gave up waiting
+# (or couldn't check on it any more).  Raises an exception if Canvas doesn't accept the bulk update at all
+def _bulk_update(course, changes: list, verbose: bool) -> Progress:
+    timeout = float(get_app_config().getKey("canvas/due_dates/bulk_update_timeout", DEFAULT_BULK_UPDATE_TIMEOUT))
+
+    # The endpoint wants a list of {id, all_dates}, which canvasapi sends as Rails-style nested form fields
+    # (the assignment's own dates are the 'base' dates; section/student overrides aren't touched)
+    body = [{'id': change.assign.id,
+             'all_dates': [{'base': True,
+                            'due_at': change.due_at,
+                            'lock_at': change.lock_at,
+                            'unlock_at': change.unlock_at}]}
+            for change in changes]
+    response = course._requester.request("PUT", f"courses/{course.id}/assignments/bulk_update",
+                                         _kwargs=combine_kwargs(_json=body))
+    progress = Progress(course._requester, response.json())
+
+    start = time.perf_counter()
+    while progress.workflow_state not in ("completed", "failed"):
+        if time.perf_counter() - start > timeout:
+            printError(f"{course.name}: Gave up waiting for Canvas' bulk update after {timeout:.0f} seconds")
+            return progress
+        time.sleep(BULK_UPDATE_POLL_INTERVAL)
+        try:
+            progress = progress.query()
+        except Exception as e:
+            # Canvas took the update, so it may well still be working on it
+            printError(f"{course.name}: Couldn't check on Canvas' bulk update ({type(e).__name__}: {e})")
+            return progress
+        if verbose:
+            print_threadsafe(f"\t{course.name}: Bulk update {progress.workflow_state} ({getattr(progress, 'completion', 0) or 0:.0f}%)")
+
+    if progress.workflow_state == "failed":
+        printError(f"{course.name}: Canvas' bulk update failed: {getattr(progress, 'message', None) or 'no reason given'}")
+    return progress
+
+
+# Returns None if it worked, otherwise the exception
+def _edit_one(change: due_date_change):
+    try:
+        change.assign.edit(assignment={'due_at': change.due_at,
+                                       'lock_at': change.lock_at,
+                                       'unlock_at': change.unlock_at})
+        return None
+    except Exception as e:
+        return e
+    finally:
+        # edit() copies everything Canvas sent back onto the assignment, including the (un-normalized) name
+        if hasattr(change.assign, 'name_normalized'):
+            change.assign.name = change.assign.name_normalized
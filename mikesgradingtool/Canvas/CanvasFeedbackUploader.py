@@ -0,0 +1,182 @@
+import datetime
+import os
+import time
+from collections import namedtuple
+
+from canvasapi.submission import Submission
+from canvasapi.upload import Uploader
+from rich import box
+from rich.markup import escape
+from rich.table import Table
+
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.diskcache_utils import APP_CACHE_EXPIRATION, get_app_cache
+from mikesgradingtool.utils.misc_utils import print_threadsafe, sha256_of_file
+from mikesgradingtool.utils.ordered_executor import OrderedExecutor, max_workers_from_config
+
+# Used when neither the command line nor gradingTool.json (canvas/upload/max_concurrent_uploads)
+# say how many feedback files to upload at once
+DEFAULT_MAX_CONCURRENT_UPLOADS = 8
+
+# Used when gradingTool.json doesn't have canvas/upload/max_tries
+DEFAULT_MAX_TRIES = 3
+
+# seconds to wait before retrying an upload (multiplied by the number of tries so far)
+RETRY_DELAY = 2
+
+# What happened to one feedback file
+upload_outcome = namedtuple('upload_outcome', 'sub student_dir fp_feedback succeeded tries seconds error file_id')
+
+
+# Uploads feedback files as submission comments, several at a time.
+#
+# Each upload is Canvas' three-step file upload (ask Canvas where to put the file, send the file there,
+# then attach it to a new comment), so most of the time is spent waiting on the network.
+# If attaching the file fails then only that step is retried (with the file that's already been uploaded),
+# so that a retry doesn't leave extra copies of the file in Canvas.
+# The Canvas API parts go through the shared CanvasRequestScheduler, so Canvas' rate limit is respected
+# no matter how many uploads are running.
+class CanvasFeedbackUploader:
+
+    def __init__(self, max_workers: int = None, verbose: bool = False):
+        self.max_workers = max_workers_from_config(max_workers, "canvas/upload/max_concurrent_uploads",
+                                                   DEFAULT_MAX_CONCURRENT_UPLOADS)
+        self.max_tries = max(1, int(get_app_config().getKey("canvas/upload/max_tries", DEFAULT_MAX_TRIES)))
+        self.verbose = verbose
+
+        self._work = OrderedExecutor(self.max_workers, "canvas_upload")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Queue up fp_feedback to be uploaded as a comment on sub.  Returns immediately
+    def submit(self, sub: Submission, student_dir: str, fp_feedback: str):
+        return self._work.submit(self._upload_one, sub, student_dir, fp_feedback)
+
+    def _upload_one(self, sub: Submission, student_dir: str, fp_feedback: str) -> upload_outcome:
+        start = time.perf_counter()
+        error = None
+        file_id = None
+
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                if file_id is None:
+                    file_id = self._upload_file(sub, fp_feedback)
+                # (this is what Submission.upload_comment does once the file is uploaded)
+                sub.edit(comment={'file_ids': [file_id]})
+                succeeded = True
+                error = None
+            except Exception as e:
+                succeeded = False
+                error = str(e)
+
+            if succeeded:
+                break
+
+            if attempt < self.max_tries:
+                if self.verbose:
+                    print_threadsafe(f"\t\tUpload of {os.path.basename(fp_feedback)} failed ({error}); retrying")
+                time.sleep(RETRY_DELAY * attempt)
+
+        if self.verbose and succeeded:
+            print_threadsafe(f"\t\tUploaded {os.path.basename(fp_feedback)}")
+
+        return upload_outcome(sub, student_dir, fp_feedback, succeeded, attempt, time.perf_counter() - start, error,
+                              file_id if succeeded else None)
+
+    # Sends the file to Canvas (without attaching it to anything yet).  Returns the uploaded file's id
+    @staticmethod
+    def _upload_file(sub: Submission, fp_feedback: str):
+        uploaded, response = Uploader(sub._requester,
+                                      f"courses/{sub.course_id}/assignments/{sub.assignment_id}/submissions/{sub.user_id}/comments/files",
+                                      fp_feedback).start()
+        if not uploaded or response.get('id') is None:
+            raise IOError("Canvas didn't accept the file")
+        return response['id']
+
+    # Wait for everything that's been queued up so far to finish.
+    # Returns a list of upload_outcome, in the same order that the uploads were submitted
+    # (so the summary lists the students in the same order as the folders were gone through)
+    def wait(self) -> list:
+        return [future.result() for _, future in self._work.drain()]
+
+    def close(self):
+        self._work.close()
+
+
+# Remembers (in the app's diskcache) which feedback file was uploaded for each student,
+# so that re-running upload_feedback only uploads the feedback files that have changed since then
+class FeedbackUploadLedger:
+
+    def __init__(self, verbose: bool = False):
+        self._cache = get_app_cache(verbose)
+
+    @staticmethod
+    def _key(course_id, assignment_id, user_id) -> str:
+        return f"{course_id}:{assignment_id}:{user_id}:uploaded_feedback"
+
+    # True if fp_feedback is exactly what we last uploaded for this student.
+    # The size & modification time are checked first, so the file is only read when
+    # it's been touched (e.g., re-saved without any changes)
+    def is_unchanged(self, course_id, assignment_id, user_id, fp_feedback: str) -> bool:
+        key = self._key(course_id, assignment_id, user_id)
+        entry = self._cache.get(key)
+        if entry is None or entry['file_name'] != os.path.basename(fp_feedback):
+            return False
+
+        stat = os.stat(fp_feedback)
+        if stat.st_size != entry['size']:
+            return False
+        if stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+
+        if sha256_of_file(fp_feedback) != entry['sha256']:
+            return False
+
+        # Same contents, so remember the new time (and skip reading the file next time)
+        entry['mtime_ns'] = stat.st_mtime_ns
+        self._cache.set(key, entry, expire=APP_CACHE_EXPIRATION)
+        return True
+
+    def record(self, outcome: upload_outcome):
+        sub = outcome.sub
+        stat = os.stat(outcome.fp_feedback)
+
+        # The comment that the file was attached to (if Canvas told us about it)
+        comment_id = None
+        for comment in getattr(sub, 'submission_comments', None) or []:
+            if any(attach.get('id') == outcome.file_id for attach in comment.get('attachments', [])):
+                comment_id = comment.get('id')
+
+        self._cache.set(self._key(sub.course_id, sub.assignment_id, sub.user_id),
+                        {'file_name': os.path.basename(outcome.fp_feedback),
+                         'size': stat.st_size,
+                         'mtime_ns': stat.st_mtime_ns,
+                         'sha256': sha256_of_file(outcome.fp_feedback),
+                         'file_id': outcome.file_id,
+                         'comment_id': comment_id,
+                         'uploaded_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')},
+                        expire=APP_CACHE_EXPIRATION)
+
+
+def build_upload_results_table(outcomes: list, base_dir: str) -> Table:
+    table = Table(box=box.SIMPLE_HEAVY, collapse_padding=True)
+
+    table.add_column("Student", justify="left")
+    table.add_column("Feedback file", justify="left")
+    table.add_column("Result", justify="center")
+    table.add_column("Tries", justify="right", style="grey35")
+    table.add_column("Seconds", justify="right", style="grey35")
+
+    for outcome in sorted(outcomes, key=lambda o: o.student_dir.casefold()):
+        result = "[green]uploaded[/green]" if outcome.succeeded else f"[red]FAILED[/red] {escape(outcome.error)}"
+        table.add_row(escape(os.path.relpath(outcome.student_dir, base_dir)),
+                      escape(os.path.basename(outcome.fp_feedback)),
+                      result,
+                      str(outcome.tries),
+                      f"{outcome.seconds:.1f}")
+    return table
@@ -7,22 +7,22 @@
 #       Organize submissions into dirs
 #
 import calendar
-import csv
 from dataclasses import dataclass
 import datetime
 import functools
 import os
 import pprint
 import pytz
+import queue
 import re
 import shutil
 import string
 import sys
+import threading
+import time
 import urllib.parse
-import urllib.request
-import zipfile
 from collections import namedtuple
-from concurrent.futures import as_completed, ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from typing import Callable
 
 import canvasapi as canvasapi
@@ -37,16 +37,25 @@ from rich import box
 from rich.console import Console
 from rich.table import Table
 
-from mikesgradingtool.utils.diskcache_utils import get_app_cache
+from mikesgradingtool.Canvas.CanvasDownloader import CanvasDownloader
+from mikesgradingtool.Canvas.CanvasDueDateUpdater import due_date_change, needs_update, update_due_dates
+from mikesgradingtool.Canvas.CanvasFeedbackUploader import CanvasFeedbackUploader, FeedbackUploadLedger, \
+    build_upload_results_table
+from mikesgradingtool.Canvas.CanvasManifest import MANIFEST_FILE_NAME, CanvasManifest
+from mikesgradingtool.Canvas.CourseCalendar import CourseCalendar
+from mikesgradingtool.Canvas.DueDateResolver import DueDateResolver
+from mikesgradingtool.Canvas import ScheduleExport
+from mikesgradingtool.Canvas.CanvasRequestScheduler import get_canvas_request_scheduler
+from mikesgradingtool.utils.diskcache_utils import APP_CACHE_EXPIRATION, get_app_cache
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot
 from mikesgradingtool.utils.misc_utils import grade_list_collector
 from mikesgradingtool.MiscFiles import MiscFilesHelper
 from mikesgradingtool.utils.config_json import get_app_config, lookupHWInfoFromAlias
-from mikesgradingtool.utils.misc_utils import cd, format_filename, is_file_locked, lock_file, print_threadsafe
+from mikesgradingtool.utils.misc_utils import cd, format_filename, get_lock_status, lock_file
 from mikesgradingtool.utils.my_logging import get_logger
+from mikesgradingtool.utils.naming_rules import get_naming_rules
 from mikesgradingtool.utils.print_utils import GradingToolError, print_list, printError
-
-# cache expiration in seconds - 11 weeks
-APP_CACHE_EXPIRATION = 60*60*24*7*11
+from mikesgradingtool.utils.zip_utils import ParallelZipWriter
 
 #console = Console(color_system="truecolor", tab_size=4)
 console = Console(color_system="auto", tab_size=4)
@@ -58,43 +67,28 @@ logger = get_logger(__name__)
 
 
 def _ignore_file_file(fp_file):
-    config = get_app_config()
-    new_feedbacks_dir, zip_to_reupload = config.verify_keys([
-        "canvas/NewDirForMissingFeedbackFiles",
-        "canvas/ZipFileToUploadToCanvas",
-    ])
-
-    if new_feedbacks_dir in fp_file \
-        or zip_to_reupload in fp_file:
-        return True
-    else:
-        return False
+    return get_naming_rules().is_canvas_upload_file(fp_file)
 
 
 def _getSubmissionFolders(fp_dir):
-    config = get_app_config()
-    student_submission_dir_suffix = config.verify_keys([
-        "canvas/StudentSubFolderMarker"
-    ])
+    student_submission_dir_suffix = get_naming_rules().submission_dir_suffix
+
+    the_listing = get_dir_snapshot().listing(fp_dir)
+    if the_listing is None:
+        raise FileNotFoundError(fp_dir)
 
-    student_subs = {_filename_to_student_key(f[:-len(student_submission_dir_suffix)]):f for f in os.listdir(fp_dir)
-                    if student_submission_dir_suffix in f
-                    and f.endswith(student_submission_dir_suffix)
-                    and os.path.isdir(os.path.join(fp_dir, f))
-                    and not MiscFilesHelper.ignore_this_file(os.path.join(fp_dir, f))
-                    and not _ignore_file_file(os.path.join(fp_dir, f))}
+    student_subs = {_filename_to_student_key(d.name[:-len(student_submission_dir_suffix)]):d.name for d in the_listing.dirs
+                    if d.name.endswith(student_submission_dir_suffix)
+                    and not MiscFilesHelper.ignore_this_file(d.path)
+                    and not _ignore_file_file(d.path)}
     return student_subs
 
 
 def _filename_to_student_key(file):
-    config = get_app_config()
-    sz_re_studentname_key, sz_late_marker = config.verify_keys([
-        "canvas/StudentName",
-        "canvas/LateMarker"
-    ])
-    re_studentname_key = re.compile("^" + sz_re_studentname_key)
+    rules = get_naming_rules()
+    sz_late_marker = rules.late_marker
 
-    keys = re_studentname_key.findall(file)
+    keys = rules.re_student_name_key.findall(file)
 
     if len(keys) == 0:  # item does not match
         printError(f"Given file/dir to match, but it doesn't: {file}")
@@ -118,11 +112,8 @@ def _extract_student_name_from_file(file):
 
 
 def _extract_name_and_sid_from_file(file):
-    config = get_app_config()
-    sz_late_marker, sz_missing_name = config.verify_keys([
-        "canvas/LateMarker",
-        "canvas/MissingNameSubstituteForFileNames"
-    ])
+    rules = get_naming_rules()
+    sz_late_marker, sz_missing_name = rules.late_marker, rules.missing_name
 
     parts = file.split('_')
     retval = parts[0] + "_"
@@ -148,34 +139,21 @@ def _extract_name_and_sid_from_file(file):
 # "All feedbacks" examples:
 #   Ezgin_Mirac_INSTRUCTORFEEDBACK.docx // this one was created by gt
 #   (All the same ones listed in _getFeedbackFileRegex())
+#
+# (The regexes are built & compiled once, by NamingRules)
 def _getFeedbackFileRegex(canvas_only=False):
-    config = get_app_config()
-    sz_re_studentName, \
-        sz_re_studentname_id_filenum, \
-        sz_re_feedback_file, \
-        sz_re_sub_num, \
-        sz_re_file_ext = config.verify_keys([
-        "canvas/StudentName",
-        "canvas/StudentNameIDFileNum",
-        "canvas/InstructorFeedbackFileNameRegex",
-        "canvas/OptionalFileSubmissionNumber",
-        "canvas/FileExtension"
-    ])
-
-    sz_re_student = sz_re_studentname_id_filenum if canvas_only else sz_re_studentName + ".*"
-
-    sz_re = sz_re_student + sz_re_feedback_file + sz_re_sub_num + sz_re_file_ext
-    re_obj = re.compile(sz_re , re.IGNORECASE)
-    return re_obj
+    rules = get_naming_rules()
+    return rules.re_canvas_feedback_file if canvas_only else rules.re_feedback_file
 
 def _getStudentFeedbackFiles(rootDir, only_canvas=True):
     submissions = dict()
 
     re_search_for = _getFeedbackFileRegex(canvas_only=only_canvas)
 
-    for root, dirs, files in os.walk(rootDir):
-        # ignore 'junk' files in the backup dir:
+    for root, dirs, files in get_dir_snapshot().walk(rootDir):
+        # ignore 'junk' files in the backup dir (and don't bother looking in anything inside it, either):
         if MiscFilesHelper.ignore_this_file(root) or _ignore_file_file(root):
+            dirs.clear()
             continue
 
         files = sorted(files)
@@ -199,6 +177,25 @@ def _getStudentFeedbackFiles(rootDir, only_canvas=True):
                 submissions[key] = fp_new_real_item
     return submissions
 
+# Returns the folder that fp_item is in, directly inside of fp_hw_dir
+# (i.e., the student's (or group's) folder), or None if fp_item isn't inside of fp_hw_dir
+def _student_dir_key(fp_hw_dir, fp_item):
+    rel_path = os.path.relpath(os.path.normcase(fp_item), os.path.normcase(fp_hw_dir))
+    top_dir = rel_path.split(os.sep)[0]
+    if top_dir in (os.curdir, os.pardir):
+        return None
+    return top_dir
+
+# Group the feedback files by the student folder that they're in, so that each
+# student's feedback can be looked up directly (instead of searching through all of them)
+def _index_feedback_files_by_student_dir(fp_hw_dir, feedback_files):
+    index = dict()
+    for fp_feedback in feedback_files:
+        key = _student_dir_key(fp_hw_dir, fp_feedback)
+        if key is not None:
+            index.setdefault(key, list()).append(fp_feedback)
+    return index
+
 def fn_canvas_autograde(args):
     raise GradingToolError("This feature hasn't been updated, and thus won't work reliably")
 
@@ -678,7 +675,7 @@ def fn_canvas_copy_template(args):
     dictFeedbacks = _getStudentFeedbackFiles(fp_CopyTemplateToHere, only_canvas=True)
     if len(dictFeedbacks) > 0:
         print("The following students included feedback files in their Canvas submissions\n\tReplacing them with the grading template/rubric\n")
-        c_student_included, c_copied_included = MiscFilesHelper.copy_template_to_path_list(fpTemplate, list(dictFeedbacks.values()))
+        c_student_included, c_copied_included = MiscFilesHelper.copy_template_to_path_list(fpTemplate, list(dictFeedbacks.values()), getattr(args, 'JOBS', None))
     else:
         print(Fore.YELLOW + "None of the students included feedback files in their Canvas submissions" + Style.RESET_ALL)
         c_student_included, c_copied_included = 0, 0
@@ -703,7 +700,7 @@ def fn_canvas_copy_template(args):
     if len(new_feedbacks) > 0:
         print("The following students " + Fore.YELLOW + "DID NOT" + Fore.RESET +
               f" include feedback files in their Canvas submissions\n\tPlacing rubrics into each student's submission folder\n" + Style.RESET_ALL)
-        c_student_missing, c_copied_missing = MiscFilesHelper.copy_template_to_path_list(fpTemplate, new_feedbacks)
+        c_student_missing, c_copied_missing = MiscFilesHelper.copy_template_to_path_list(fpTemplate, new_feedbacks, getattr(args, 'JOBS', None))
     else:
         print("All of the students included feedback files in their Canvas submissions" + Style.RESET_ALL)
         c_student_missing, c_copied_missing = 0, 0
@@ -783,6 +780,8 @@ def fn_canvas_copy_feedback_to_revision(args):
     missing_original = dict()  # new submissions that don't have a matching original dir
     no_revision_submitted = originals.copy()  # original submissions that don't have a matching new dir
 
+    already_locked = get_lock_status(new_subs_feedback_files.values())
+
     print("\nCopying original feedbacks over revision files for the following students:")
     for new_sub in sorted(new_subs_feedback_files):
         logger.debug("NEW SUBMISSION from: " + new_sub)
@@ -798,7 +797,7 @@ def fn_canvas_copy_feedback_to_revision(args):
         newFeedback = new_subs_feedback_files[new_sub]
 
         try:
-            if is_file_locked(newFeedback):
+            if already_locked[newFeedback]:
                 print(("* {0:<55}Feedback NOT copied (it was previously copied and we're not overwriting it)".format(
                     new_sub) + Style.RESET_ALL))
                 continue
@@ -862,7 +861,10 @@ def fn_canvas_package_feedback_for_upload(args):
         # https://docs.python.org/3/library/zipfile.html#module-zipfile
         new_zip_file = os.path.join(fp_dir_to_package, zip_file_name)
 
-        with zipfile.ZipFile(new_zip_file, mode='w', compression=zipfile.ZIP_DEFLATED) as canvas_reupload:
+        # (files are compressed in the background, several at once, while we go through the list;
+        #   files that haven't changed since the last time we packaged this folder are copied from the old .ZIP)
+        with ParallelZipWriter(new_zip_file, getattr(args, 'JOBS', None),
+                               incremental=not getattr(args, 'FULL', False)) as canvas_reupload:
 
             for student, feedback_file in dictFeedbacks.items():
                 # if it looks like a canvas file then add to zip
@@ -871,7 +873,7 @@ def fn_canvas_package_feedback_for_upload(args):
                 if re_canvas_feedback_file.search(filename):
                     print(f"Student: {student}")
                     print(f"\tAdding to .ZIP file for bulk re-upload")
-                    canvas_reupload.write(feedback_file, arcname=filename)
+                    canvas_reupload.add(feedback_file, arcname=filename)
                 else:
                     # if it does NOT look like a canvas file then add to _NEW
                     print(Fore.YELLOW +f"Student: {student}" + Style.RESET_ALL)
@@ -883,6 +885,9 @@ def fn_canvas_package_feedback_for_upload(args):
 
                 print(f"\t{feedback_file}\n")
 
+        if canvas_reupload.stats.files > 0:
+            print(f"Zipped: {canvas_reupload.stats}")
+
         if len(students_who_didnt_upload_feedback_files_directly_to_canvas) > 0:
             print(Fore.RED + f"\nDon't forget to manually upload the {len(students_who_didnt_upload_feedback_files_directly_to_canvas)} brand-new feedback files:" + Style.RESET_ALL)
             for student in students_who_didnt_upload_feedback_files_directly_to_canvas:
@@ -931,6 +936,11 @@ def fn_canvas_upload_feedback_via_CAPI(args):
     with cd(dest_dir):
 
         dictFeedbacks = _getStudentFeedbackFiles(dest_dir, only_canvas=False)
+        feedbacks_by_student_dir = _index_feedback_files_by_student_dir(dest_dir, dictFeedbacks.values())
+        fp_hw_dir = dest_dir
+
+        ledger = FeedbackUploadLedger(verbose)
+        force_upload = getattr(args, 'FORCE', False)
 
         def upload_feedback(sub: Submission, user: User, assign: Assignment,
                               dest_dir:str, results_lists: grade_list_collector):
@@ -941,7 +951,7 @@ def fn_canvas_upload_feedback_via_CAPI(args):
                 # skipping non-target student
                 return
 
-            the_feedback = list(filter(lambda fp_feedback: fp_feedback.startswith(dest_dir), dictFeedbacks.values()))
+            the_feedback = feedbacks_by_student_dir.get(_student_dir_key(fp_hw_dir, dest_dir), [])
 
             # No feedback for this student:
             if len(the_feedback) == 0:
@@ -954,11 +964,15 @@ def fn_canvas_upload_feedback_via_CAPI(args):
                 return
 
             fp_feedback_to_upload = the_feedback[0]
-            result = sub.upload_comment(fp_feedback_to_upload)
-            if result[0] == True: # upload succeeded
-                results_lists.graded.append(fp_feedback_to_upload)
-            else:
-                results_lists.new_student_work_since_grading.append(fp_feedback_to_upload)
+
+            # Don't upload (another copy of) feedback that's already in Canvas
+            if not force_upload \
+                    and ledger.is_unchanged(assign.course_id, assign.id, user.id, fp_feedback_to_upload):
+                results_lists.already_uploaded.append(fp_feedback_to_upload)
+                return
+
+            # Queue it up (this returns immediately); the results are collected once everyone's been queued
+            uploader.submit(sub, dest_dir, fp_feedback_to_upload)
 
         if dest_dir is  None:
             dest_dir = config.getKey(f"courses/{course}/assignments/{hw_name}/dest_dir")
@@ -973,12 +987,26 @@ def fn_canvas_upload_feedback_via_CAPI(args):
         results_lists.verbose = verbose
 
         quarter = None
-        do_fnx_per_matching_submission(course, quarter, hw_name, dest_dir, results_lists, upload_feedback, \
-                                       "Uploading student feedbacks to Canvas")
+        with CanvasFeedbackUploader(getattr(args, 'JOBS', None), verbose) as uploader:
+            do_fnx_per_matching_submission(course, quarter, hw_name, dest_dir, results_lists, upload_feedback, \
+                                           "Uploading student feedbacks to Canvas")
+
+            upload_outcomes = uploader.wait()
+
+        # Go through the results in the order the uploads were queued up (not the order they finished in)
+        for outcome in upload_outcomes:
+            if outcome.succeeded:
+                results_lists.graded.append(outcome.fp_feedback)
+                ledger.record(outcome)
+            else:
+                results_lists.new_student_work_since_grading.append(outcome.fp_feedback)
 
         if verbose:
             print("\n\n" + "=" * 20 + "\n")
 
+        if len(upload_outcomes) > 0:
+            console.print(build_upload_results_table(upload_outcomes, dest_dir))
+
         print_list(dest_dir, sorted(list(set(results_lists.no_submission)), key=str.casefold), \
                Fore.RED, "The following students did not have feedback to upload", \
                verbose=verbose)
@@ -987,6 +1015,10 @@ def fn_canvas_upload_feedback_via_CAPI(args):
                Fore.CYAN,"The following students have more than 1 feedback file - please figure out which one(s) to upload", \
                verbose=verbose)
 
+        print_list(dest_dir, sorted(list(set(results_lists.already_uploaded)), key=str.casefold), \
+               Fore.CYAN,"The following students' feedback was already uploaded, and hasn't changed since (use --FORCE to upload it again)", \
+               verbose=verbose)
+
         print_list(dest_dir, sorted(list(set(results_lists.graded)), key=str.casefold), \
                Fore.GREEN,"Successfully uploaded feedback for the following students", \
                verbose=verbose)
@@ -1059,55 +1091,28 @@ def name_to_last_first( shortname: str):
     return lastname + "_" + firstname
 
 
-# The concurrent, multithreaded download code was copied from:
-# https://rednafi.github.io/digressions/python/2020/04/21/python-concurrent-futures.html#download--save-files-from-urls-with-multi-threading
-# Code was then tweaked
-def download_one(info, verbose):
-    # ""
-    # Downloads the specified URL and saves it to disk
-    # ""
-    url, fp_dest, version_num = info
-    req = urllib.request.urlopen(url)
-    # fullpath = Path(url)
-    # fname = fullpath.name
-    # ext = fullpath.suffix
-
-    # if not ext:
-    #     raise RuntimeError("URL does not contain an extension")
-
-    with open(fp_dest, "wb") as handle:
-        while True:
-            chunk = req.read(1024)
-            if not chunk:
-                break
-            handle.write(chunk)
-
-    msg = f"\t\tVer #{version_num}\t{os.path.basename(fp_dest)}"
-    if verbose:
-        print_threadsafe( msg )
-    return msg
-
-
-def download_all(urls, verbose):
-    # ""
-    # Create a thread pool and download specified urls
-    # ""
-
-    futures_list = []
-    results = []
 
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        for url in urls:
-            futures = executor.submit(download_one, url, verbose)
-            futures_list.append(futures)
-
-        for x in as_completed(futures_list):
-#            print(x.result())
-            results.append(x)
+# One connection to Canvas (and one look-up of who we are) for the whole run,
+# shared by every course (and every thread) that needs it
+@functools.lru_cache(1)
+def get_canvas_session():
+    config = get_app_config()
+    api_url, api_key = config.verify_keys([
+        "canvas/api/url",
+        "canvas/api/key"
+    ])
 
-    return results
-#End of copied code
+    # Initialize a new Canvas object
+    canvas = canvasapi.Canvas(api_url, api_key)
+    # All the requests (from any thread) go through the shared, rate-limit aware scheduler
+    get_canvas_request_scheduler().install(canvas._Canvas__requester)
+    try:
+        curuser = canvasapi.current_user.CurrentUser(canvas._Canvas__requester)
+    except:
+        printError("Unable to connect to the Canvas server - are we offline?")
+        sys.exit(-1)
 
+    return canvas, curuser
 
 # The goal of this had been to specify something like "BIT 115" and then
 # figure out which of the many matches were for the current quarter's class.
@@ -1116,19 +1121,11 @@ def download_all(urls, verbose):
 # and this will return the one match for the course
 def get_canvas_course(course_name: str, verbose, sz_re_quarter: str = ".*"):
     config = get_app_config()
-    api_url, api_key, sz_re_course = config.verify_keys([
-        "canvas/api/url",
-        "canvas/api/key",
+    sz_re_course = config.verify_keys([
         f"courses/{course_name}/canvas_api/sz_re_course"
     ])
 
-    # Initialize a new Canvas object
-    canvas = canvasapi.Canvas(api_url, api_key)
-    try:
-        curuser = canvasapi.current_user.CurrentUser(canvas._Canvas__requester)
-    except:
-        printError("Unable to connect to the Canvas server - are we offline?")
-        sys.exit(-1)
+    canvas, curuser = get_canvas_session()
 
     matching_course = None
     persistent_app_cache = get_app_cache(verbose)
@@ -1176,12 +1173,120 @@ def get_canvas_course(course_name: str, verbose, sz_re_quarter: str = ".*"):
 
     return matching_course, canvas
 
+# Canvas will send back up to 100 items per page (the default is 10)
+CANVAS_PAGE_SIZE = 100
+
+# How many already-fetched items prefetch_paginated_list will hold onto before
+# the background thread waits for us to catch up
+DEFAULT_PREFETCH_BUFFER = 200
+
+# Marks the end of the listing in prefetch_paginated_list's queue
+_END_OF_LISTING = object()
+
+# Canvas hands back lists (users, assignments, submissions) one page at a time,
+# and each page is a separate request to the server.
+# This walks the pages on a background thread and feeds each item into a bounded queue,
+# so that we can work on the items that have already arrived while the next page is being fetched.
+# When the queue is full the background thread waits for us to catch up (backpressure).
+# Any exception from Canvas is re-raised here, in the caller's thread
+def prefetch_paginated_list(paginated_list, max_buffered: int = None):
+    if max_buffered is None:
+        max_buffered = get_app_config().getKey("canvas/prefetch_buffer_size", DEFAULT_PREFETCH_BUFFER)
+
+    buffer = queue.Queue(maxsize=max(1, int(max_buffered)))
+    stop = threading.Event()
+
+    # Returns False if the consumer has gone away (so the producer should quit)
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.25)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in paginated_list:
+                if not put((item, None)):
+                    return
+            put((_END_OF_LISTING, None))
+        except Exception as e:
+            put((_END_OF_LISTING, e))
+
+    # Start fetching right away (not when the caller first asks for an item)
+    threading.Thread(target=producer, name="canvas_prefetch", daemon=True).start()
+
+    return _drain_prefetch_queue(buffer, stop)
+
+
+def _drain_prefetch_queue(buffer: queue.Queue, stop: threading.Event):
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _END_OF_LISTING:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # If the caller stopped early (break, exception) then let the producer know it can stop
+        stop.set()
+
+
+# Re-checking submissions that we've already seen is harmless (the version info will show that
+# they're unchanged), so the watermark is backed up a bit to allow for clock differences with Canvas
+SYNC_WATERMARK_MARGIN = datetime.timedelta(minutes=5)
+
+# cache_key:  where the watermark lives in the app cache
+# previous:   ISO timestamp of the last complete download (None means 'look at everything')
+# started_at: ISO timestamp to save as the new watermark, once this download is complete
+SyncWatermark = namedtuple('SyncWatermark', 'cache_key previous started_at')
+
+def get_sync_watermark(course, assign, dest_dir: str, verbose, full_sync: bool = False) -> SyncWatermark:
+    persistent_app_cache = get_app_cache(verbose)
+    cache_key = f"{course.id}:{assign.id}:submitted_since:{dest_dir}"
+
+    started_at = (datetime.datetime.now(datetime.timezone.utc) - SYNC_WATERMARK_MARGIN).replace(microsecond=0)
+
+    previous = None if full_sync else persistent_app_cache.get(cache_key)
+
+    # Only the newly handed in work is listed when there's a watermark, so anything that we downloaded before
+    # and that's been deleted since (the homework folder, a student's folder, or just some of their files)
+    # would never come back.  In that case everyone is looked at again (and the missing files re-downloaded)
+    if previous is not None and _has_missing_downloads(dest_dir):
+        print("\tSome of the previously downloaded files are missing, so looking at all the submissions again")
+        previous = None
+
+    return SyncWatermark(cache_key, previous, started_at.isoformat())
+
+# Is anything that the manifest says we downloaded into dest_dir not there any more?
+# (without a manifest we can't tell what's been downloaded, so that counts as missing)
+def _has_missing_downloads(dest_dir) -> bool:
+    if dest_dir is None or not os.path.isfile(os.path.join(dest_dir, MANIFEST_FILE_NAME)):
+        return True
+    with CanvasManifest(dest_dir) as manifest:
+        return len(manifest.missing_files()) > 0
+
+def save_sync_watermarks(sync_watermarks, verbose):
+    persistent_app_cache = get_app_cache(verbose)
+    for watermark in sync_watermarks:
+        persistent_app_cache.set(watermark.cache_key, watermark.started_at, expire=APP_CACHE_EXPIRATION)
+
+
 foundMatchingAssignment = False
 
+# If sync_watermarks is a list then only the submissions that were handed in since the last
+# complete download are listed (and fnx is only called for those), unless full_sync is True.
+# Either way the new watermarks are appended to the list; the caller saves them
+# (with save_sync_watermarks) once everything has been downloaded successfully
 def do_fnx_per_matching_submission(course_name, sz_re_quarter, hw_name, dest_dir_from_cmd_line:str,
                                    results_lists: grade_list_collector,
                                    fnx: Callable[[Submission, User, Assignment, str, grade_list_collector],None],
-                                   msg_to_display = "Downloading student submissions from Canvas"):
+                                   msg_to_display = "Downloading student submissions from Canvas",
+                                   sync_watermarks: list = None,
+                                   full_sync: bool = False):
 
     if sz_re_quarter is None:
         sz_re_quarter = ".*"
@@ -1197,8 +1302,11 @@ def do_fnx_per_matching_submission(course_name, sz_re_quarter, hw_name, dest_dir
     if results_lists.verbose:
         print(f"\tGetting Users for \"{course.name}\"")
 
+    # Start fetching both lists now, so the assignments download while we go through the users
+    users = prefetch_paginated_list(course.get_users(enrollment_type=['student'], per_page=CANVAS_PAGE_SIZE))
+    assignments = prefetch_paginated_list(course.get_assignments(per_page=CANVAS_PAGE_SIZE))
+
     users_lookup = dict()
-    users = course.get_users(enrollment_type=['student'])
     for user in users:
         users_lookup[user.id] = user
 
@@ -1208,7 +1316,6 @@ def do_fnx_per_matching_submission(course_name, sz_re_quarter, hw_name, dest_dir
         print(f"\tGetting Assignments for \"{course.name}\"")
 
     # Get all assignments:
-    assignments = course.get_assignments()
     assign_lookup = dict()
 
     for assign in assignments:
@@ -1263,7 +1370,24 @@ def do_fnx_per_matching_submission(course_name, sz_re_quarter, hw_name, dest_dir
                 printError(f"*** This assignment is a group assignment, but the group-set that was used can't be found (was it deleted after students handed in work?)***")
 
         # https://canvasapi.readthedocs.io/en/latest/assignment-ref.html#canvasapi.assignment.Assignment.get_submissions
-        submissions = assign.get_submissions(include=["submission_history"])
+        sync_watermark = None
+        if sync_watermarks is not None:
+            sync_watermark = get_sync_watermark(course, assign, dest_dir, results_lists.verbose, full_sync)
+            sync_watermarks.append(sync_watermark)
+
+        # The pages of submissions are fetched in the background while fnx works on the ones we already have
+        if sync_watermark is not None and sync_watermark.previous is not None:
+            print(f"\tOnly looking at work submitted since the last download ({sync_watermark.previous})")
+
+            # https://canvas.instructure.com/doc/api/submissions.html#method.submissions_api.for_students
+            submissions = prefetch_paginated_list(course.get_multiple_submissions(assignment_ids=[assign.id],
+                                                                                  student_ids=['all'],
+                                                                                  submitted_since=sync_watermark.previous,
+                                                                                  include=["submission_history"],
+                                                                                  per_page=CANVAS_PAGE_SIZE))
+        else:
+            submissions = prefetch_paginated_list(assign.get_submissions(include=["submission_history"],
+                                                                         per_page=CANVAS_PAGE_SIZE))
 
         stop_early = 2
 
@@ -1389,21 +1513,13 @@ def fn_canvas_download_homework(args):
     def download_homework(sub: Submission, user: User, assign: Assignment,
                           dest_dir:str, results_lists: grade_list_collector, canvas = None):
 
-        sz_re_feedback_file = config.verify_keys([
-            "canvas/InstructorFeedbackFileNameRegex"])
-        re_FEEDBACK = re.compile(sz_re_feedback_file, re.IGNORECASE)
+        re_FEEDBACK = get_naming_rules().re_feedback_file_name
 
         attached_file_info = namedtuple('attached_file_info', 'attempt_num sub fp_dest modified_at')
 
-        fp_versions_file = os.path.join(dest_dir, "CANVAS_FILE_VERSIONS.csv")
-
-        # If there's a dir for the homework already AND it contains
-        # a versions.csv file then read through it for version info
-        files_original = dict()
-        if os.path.isfile(fp_versions_file):
-            with open(fp_versions_file, mode='r', encoding="utf-8") as inp:
-                reader = csv.reader(inp)
-                files_original = {rows[1]: attached_file_info(int(rows[0]), None, rows[2], rows[3]) for rows in reader}
+        # What we've already downloaded for this student (from the assignment-wide manifest)
+        manifest = get_manifest(os.path.dirname(dest_dir))
+        files_original = manifest.files_for_student(dest_dir, user.id)
 
         files = dict()
         for prev_sub in sub.submission_history:
@@ -1458,10 +1574,14 @@ def fn_canvas_download_homework(args):
 
         # Remove any files that aren't actually present
         # (e.g., they got downloaded but then deleted)
-        missing_files = [key for key, info in unchanged_files.items()
-                        if not os.path.exists(info.fp_dest)]
-        for fn in missing_files:
-            del unchanged_files[fn]
+        # (one directory listing per student, instead of checking each file separately)
+        if len(unchanged_files) > 0:
+            dest_dir_listing = get_dir_snapshot().listing(dest_dir)
+            files_on_disk = dest_dir_listing.names if dest_dir_listing is not None else set()
+            missing_files = [key for key, info in unchanged_files.items()
+                             if os.path.basename(files_original[key].fp_dest) not in files_on_disk]
+            for fn in missing_files:
+                del unchanged_files[fn]
 
         # Take out the files that haven't changed, leaving only those files we'll need to download new copies of
         files = dict( filter( lambda file: file[0] not in unchanged_files, files.items()))
@@ -1472,38 +1592,28 @@ def fn_canvas_download_homework(args):
 
             os.makedirs(dest_dir, exist_ok=True)
 
-            with open(fp_versions_file, 'w', newline='', encoding="utf-8") as file:
-                writer = csv.writer(file)
-
-                if len(unchanged_files) > 0:
-                    for file_name, file_info in unchanged_files.items():
-                        writer.writerow([str(file_info.attempt_num), file_name, file_info.fp_dest, file_info.modified_at])
-
-                # Set up list of stuff to download in parallel:
-                download_info = []
-
-                for file_name, file_info in files.items():
-                    # we don't want to overwrite INSTRUCTORFEEDBACK files when updating
-                    # a folder of graded work
-                    if is_file_locked(file_info.fp_dest):
-                        if verbose:
-                            print("\t\tFile was already locked for grading; NOT downloading despite finding newer version in Canvas:\n\t\t\t" + os.path.basename(file_info.fp_dest))
-                        if file_name in files_original:
-                            orig_file_info = files_original[file_name]
-                        else:
-                            # If we lost the file info then use the most current as a placeholder, I guess
-                            orig_file_info = files[file_name]
-                        writer.writerow(
-                            [str(orig_file_info.attempt_num), file_name, orig_file_info.fp_dest, orig_file_info.modified_at])
-                        unchanged_files[file_name] = orig_file_info
-                    else:
-                        # print(f"\t\tVer #{str(file_info.attempt_num).ljust(4)}{file_name}")
-                        writer.writerow([str(file_info.attempt_num), file_name, file_info.fp_dest, file_info[1]['modified_at']])
-                        download_info.append( (file_info.sub['url'], file_info.fp_dest, file_info.attempt_num))
+            already_locked = get_lock_status(file_info.fp_dest for file_info in files.values())
+
+            for file_name, file_info in files.items():
+                # we don't want to overwrite INSTRUCTORFEEDBACK files when updating
+                # a folder of graded work
+                if already_locked[file_info.fp_dest]:
+                    if verbose:
+                        print("\t\tFile was already locked for grading; NOT downloading despite finding newer version in Canvas:\n\t\t\t" + os.path.basename(file_info.fp_dest))
+                    if file_name not in files_original:
+                        # If we lost the file info then use the most current as a placeholder, I guess
+                        manifest.record(user.id, file_info.sub, file_name, file_info.attempt_num, file_info.fp_dest)
+                    unchanged_files[file_name] = file_info
+                else:
+                    # print(f"\t\tVer #{str(file_info.attempt_num).ljust(4)}{file_name}")
+                    # Queue it up with the course-wide downloader (this returns immediately).
+                    # The file goes into the manifest once it's actually on disk
+                    def record_download(result, file_name=file_name, file_info=file_info):
+                        manifest.record(user.id, file_info.sub, file_name, file_info.attempt_num,
+                                        result.fp_dest, result.size, result.sha256)
 
-                results = download_all(download_info, results_lists.verbose)
-                # for result in results:
-                #     print(f"\t{result.result()}")
+                    downloader.submit(file_info.sub, file_info.fp_dest, file_info.attempt_num,
+                                      on_complete=record_download)
 
             if len(unchanged_files) > 0 and verbose:
                 print("\t\tThe following files were previously downloaded (or locked), and are unchanged:")
@@ -1547,7 +1657,34 @@ def fn_canvas_download_homework(args):
     results_lists = grade_list_collector()
     results_lists.verbose = verbose
 
-    do_fnx_per_matching_submission(course, quarter, hw_name, dest_dir, results_lists, download_homework)
+    # Unless told otherwise (--FULL), only look at the work that's been handed in since the last complete download
+    sync_watermarks = list()
+
+    # One manifest per assignment folder, opened the first time a student in that folder is seen
+    manifests = dict()
+
+    def get_manifest(fp_assignment_dir: str) -> CanvasManifest:
+        if fp_assignment_dir not in manifests:
+            manifests[fp_assignment_dir] = CanvasManifest(fp_assignment_dir)
+        return manifests[fp_assignment_dir]
+
+    # Every student's attachments go into this one downloader, so the whole assignment downloads in one pass
+    try:
+        with CanvasDownloader(getattr(args, 'JOBS', None), verbose) as downloader:
+            do_fnx_per_matching_submission(course, quarter, hw_name, dest_dir, results_lists, download_homework,
+                                           sync_watermarks=sync_watermarks, full_sync=getattr(args, 'FULL', False))
+
+            failed_downloads = downloader.wait()
+    finally:
+        # the downloader is done (so nothing else will be recorded), so save everything
+        for manifest in manifests.values():
+            manifest.close()
+
+    # Only move the watermark forwards if everything made it to disk (so the next run will retry any failures)
+    if len(failed_downloads) == 0:
+        save_sync_watermarks(sync_watermarks, verbose)
+
+    only_new_work_checked = any(watermark.previous is not None for watermark in sync_watermarks)
 
     if hw_name == 'all':
         dest_dir = '' # force output to list complete paths
@@ -1558,7 +1695,11 @@ def fn_canvas_download_homework(args):
         return
 
     if foundSubmissions == False:
-        printError(f"There are no submissions in Canvas for {hw_name}")
+        if only_new_work_checked:
+            print(Fore.GREEN + "\nNothing new has been handed in since the last download" + Style.RESET_ALL)
+            print("\t(use --FULL to re-check every student's submission)")
+        else:
+            printError(f"There are no submissions in Canvas for {hw_name}")
         return;
 
     if verbose:
@@ -1584,6 +1725,15 @@ def fn_canvas_download_homework(args):
                "There were no brand new (to us) student submissions", \
                verbose=verbose)
 
+    if len(failed_downloads) > 0:
+        printError(f"{len(failed_downloads)} file(s) could not be downloaded (listed above)")
+
+    if only_new_work_checked:
+        print("Students who haven't handed in anything since the last download were skipped (use --FULL to re-check everyone)")
+
+    if verbose:
+        print(f"\t{get_canvas_request_scheduler().stats}")
+
     if hw_name != 'all':
         if len(dest_dir) > 1 \
             and dest_dir[-1:] != os.sep \
@@ -1711,6 +1861,10 @@ def fn_canvas_calculate_all_due_dates(args):
     verbose = args.VERBOSE
     noop = args.NOOP
 
+    if course_name == 'all':
+        calculate_due_dates_for_all_courses(args)
+        return
+
     print(f"Calculating due dates for {course_name}")
     if noop:
         print(f"\tNo-op mode: this will NOT make any changes in Canvas (but will still print out the calculated dates)")
@@ -1723,26 +1877,243 @@ def fn_canvas_calculate_all_due_dates(args):
         print(f"\tIs \"{course_name}\"  an alias (like 2a4, or 3i11, etc)?")
         return
 
+    quarter_dates = get_quarter_dates(args.FIRST_DAY_OF_QUARTER)
+    if quarter_dates is None:
+        return
+    general_due_date_info, start_of_quarter, end_of_quarter = quarter_dates
+
+    calculated = calculate_course_due_dates(course_name, hw_name, general_due_date_info, start_of_quarter, end_of_quarter, noop, verbose)
+    if calculated is None:
+        return
+    course, due_date_changes = calculated
+
+    # Only send the assignments whose dates are actually different, and only once the user has seen them all
+    print(f"\n{len(due_date_changes)} of the assignments' dates are different from what's in Canvas")
+    if not noop and len(due_date_changes) > 0:
+        if confirm_choice(f"Do you want to change the due dates for these {len(due_date_changes)} assignments?", None, course.name, \
+                       "Updating due dates now", \
+                       "Operation canceled - NO CHANGES MADE"):
+            failed = update_due_dates(course, due_date_changes, getattr(args, 'JOBS', None), verbose)
+            print_due_date_update_results(course, due_date_changes, failed)
+
+    if noop:
+        print()
+        print(Style.BRIGHT + Fore.RED + "Don't forget to update holidays, etc!!"+ Style.RESET_ALL)
+
+    print() # spacer line, so it's easier to see where output ends & prompt begins :)
+
+# The term-wide version of calculate_all_due_dates (when COURSE is 'all'):
+# every course in gradingTool.json that has due_date_info gets its due dates calculated in the same run.
+#
+# The quarter's dates (and each distinct class schedule's CourseCalendar) are worked out once and shared by all
+# the courses, and all the courses are fetched from Canvas at the same time, over the same connection.
+# Each course's due dates are then listed (one course after another), followed by a summary of what would change,
+# and (after a single confirmation) the courses are all updated at the same time
+def calculate_due_dates_for_all_courses(args):
+    verbose = args.VERBOSE
+    noop = args.NOOP
+
+    if args.HOMEWORK_NAME != "":
+        printError(f"HOMEWORK_NAME ({args.HOMEWORK_NAME}) can't be used when calculating the due dates for all courses")
+        return
+
+    config = get_app_config()
+    course_names = [course_name for course_name, course_info in config.getKey("courses", {}).items()
+                    if hasattr(course_info, 'keys') and 'due_date_info' in course_info]
+    if len(course_names) == 0:
+        printError("Could not find any courses with due_date_info in gradingTool.json")
+        return
+
+    print(f"Calculating due dates for all courses: {', '.join(course_names)}")
+    if noop:
+        print(f"\tNo-op mode: this will NOT make any changes in Canvas (but will still print out the calculated dates)")
+
+    quarter_dates = get_quarter_dates(args.FIRST_DAY_OF_QUARTER)
+    if quarter_dates is None:
+        return
+    general_due_date_info, start_of_quarter, end_of_quarter = quarter_dates
+
+    # Find each course (and get its assignments) in Canvas, all at the same time
+    def fetch_course(course_name):
+        course, canvas = get_canvas_course(course_name, verbose)
+        if course is None:
+            return None, None
+        return course, list(course.get_assignments(per_page=CANVAS_PAGE_SIZE))
+
+    print("Getting the assignments from Canvas")
+    get_canvas_session()  # connect once, up front, instead of in every thread at the same time
+    with ThreadPoolExecutor(max_workers=len(course_names), thread_name_prefix="due_date_course") as pool:
+        fetched = list(pool.map(fetch_course, course_names))
+
+    # course_name -> (Canvas course, list of due_date_change)
+    calculated_courses = dict()
+    for course_name, (course, capi_assignments) in zip(course_names, fetched):
+        print(f"\n{Style.BRIGHT}{course_name}{Style.RESET_ALL} ".ljust(120, "#"))
+        if course is None:
+            continue  # get_canvas_course already explained why
+        calculated = calculate_course_due_dates(course_name, "", general_due_date_info, start_of_quarter, end_of_quarter,
+                                                noop, verbose, course, capi_assignments)
+        if calculated is not None:
+            calculated_courses[course_name] = calculated
+
+    print("\nAssignments whose dates are different from what's in Canvas: ".ljust(120, "="))
+    for course_name in course_names:
+        if course_name in calculated_courses:
+            course, due_date_changes = calculated_courses[course_name]
+            print(f"\t{course.name.ljust(40)}: {len(due_date_changes)}")
+        else:
+            print(f"\t{course_name.ljust(40)}: " + Fore.RED + "(couldn't calculate due dates)" + Style.RESET_ALL)
+
+    to_update = {course_name: calculated for course_name, calculated in calculated_courses.items() if len(calculated[1]) > 0}
+    how_many = sum(len(due_date_changes) for course, due_date_changes in to_update.values())
+    if not noop and how_many > 0:
+        if confirm_choice(f"Do you want to change the due dates for these {how_many} assignments, in {len(to_update)} courses?", None, "all", \
+                          "Updating due dates now", \
+                          "Operation canceled - NO CHANGES MADE"):
+            with ThreadPoolExecutor(max_workers=len(to_update), thread_name_prefix="due_date_course") as pool:
+                futures = {course_name: pool.submit(update_due_dates, course, due_date_changes, getattr(args, 'JOBS', None), verbose)
+                           for course_name, (course, due_date_changes) in to_update.items()}
+            for course_name, (course, due_date_changes) in to_update.items():
+                print_due_date_update_results(course, due_date_changes, futures[course_name].result())
+
+    if noop:
+        print()
+        print(Style.BRIGHT + Fore.RED + "Don't forget to update holidays, etc!!"+ Style.RESET_ALL)
+
+    print() # spacer line, so it's easier to see where output ends & prompt begins :)
+
+def print_due_date_update_results(course, due_date_changes, failed):
+    for change, error in failed:
+        printError(f"Couldn't update {change.assign.name}: " + str(type( error )) + " : " + str(error))
+    print(f"Updated {len(due_date_changes) - len(failed)} of {len(due_date_changes)} assignments in \"{course.name}\"")
+
+# Works out the due dates for one or all courses (exactly the way calculate_all_due_dates would) from gradingTool.json
+# alone - WITHOUT connecting to Canvas - and writes them to a .json and a .ics file.
+# The schedule is first compared against the one that was exported last time, so that the effect of changing
+# the due_date_info in gradingTool.json can be seen right away
+def fn_canvas_export_schedule(args):
+    course_name = args.COURSE
+    verbose = args.VERBOSE
+
+    config = get_app_config()
+    if course_name == 'all':
+        course_names = [name for name, course_info in config.getKey("courses", {}).items()
+                        if hasattr(course_info, 'keys') and 'due_date_info' in course_info]
+        if len(course_names) == 0:
+            printError("Could not find any courses with due_date_info in gradingTool.json")
+            return
+    else:
+        if config.getKey(f"courses/{course_name}", "") == "":
+            printError(f"Could not find course info in JSON config file for \"{course_name}\"")
+            print(f"\tIs \"{course_name}\"  an alias (like 2a4, or 3i11, etc)?")
+            return
+        course_names = [course_name]
+
+    quarter_dates = get_quarter_dates(args.FIRST_DAY_OF_QUARTER)
+    if quarter_dates is None:
+        return
+    general_due_date_info, start_of_quarter, end_of_quarter = quarter_dates
+    time_zone = general_due_date_info['time_zone']
+
+    start = time.perf_counter()
+    schedule = {'time_zone': str(time_zone),
+                'first_day_of_quarter': start_of_quarter.astimezone(time_zone).strftime(FMT_DATE_WITHOUT_TIME),
+                'last_day_of_quarter': end_of_quarter.astimezone(time_zone).strftime(FMT_DATE_WITHOUT_TIME),
+                'courses': dict()}
+    for name in course_names:
+        course_schedule = calculate_course_schedule(name, general_due_date_info, start_of_quarter)
+        if course_schedule is not None:
+            schedule['courses'][name] = course_schedule
+    elapsed = time.perf_counter() - start
+    if len(schedule['courses']) == 0:
+        return
+
+    how_many = sum(len(course_schedule['assignments']) for course_schedule in schedule['courses'].values())
+    print(f"Calculated {how_many} due dates for {len(schedule['courses'])} course(s) in {elapsed * 1000:.1f} ms")
+
+    if verbose:
+        for name, course_schedule in schedule['courses'].items():
+            print(f"\n{Style.BRIGHT}{name}{Style.RESET_ALL}")
+            for entry in course_schedule['assignments'].values():
+                print(f"\t{entry['name'].ljust(40)}: {ScheduleExport.describe_entry(entry, time_zone)}")
+
+    dir_output = args.OUTPUT_DIR
+    if dir_output is None:
+        dir_output = config.getKey("canvas/due_dates/schedule_export_dir", os.getcwd())
+    dir_output = os.path.expanduser(dir_output)
+    fp_json = os.path.join(dir_output, f"schedule_{course_name}.json")
+    fp_ics = os.path.join(dir_output, f"schedule_{course_name}.ics")
+
+    previous = ScheduleExport.load_schedule_json(fp_json)
+    if previous is None:
+        print(f"\nNo previously exported schedule at {fp_json}, so there's nothing to compare against")
+    else:
+        print(f"\nChanges since the last export ({fp_json}): ".ljust(120, "="))
+        differences = ScheduleExport.diff_schedules(previous, schedule)
+        ScheduleExport.print_schedule_differences(previous, schedule, differences, time_zone)
+
+    if args.DIFF_ONLY:
+        print("\nDiff only: the exported schedule files have NOT been changed")
+    else:
+        os.makedirs(dir_output, exist_ok=True)
+        ScheduleExport.write_schedule_json(fp_json, schedule)
+        ScheduleExport.write_schedule_ics(fp_ics, schedule)
+        print(f"\nWrote {fp_json}")
+        print(f"Wrote {fp_ics}")
+
+    print() # spacer line, so it's easier to see where output ends & prompt begins :)
+
+# Returns the course's part of the exported schedule (see ScheduleExport), or None if its due dates can't be worked out
+def calculate_course_schedule(course_name, general_due_date_info, start_of_quarter):
+    due_date_info_for_course = get_course_due_date_info(course_name)
+    if due_date_info_for_course is None:
+        return None
+
+    assignments = get_app_config().getKey(f"courses/{course_name}/assignments", {})
+    due_date_resolver = DueDateResolver(assignments,
+                                        lambda assign_info, base_due_date: calculateDueDate(assign_info, base_due_date, start_of_quarter,
+                                                                                            due_date_info_for_course, general_due_date_info))
+
+    course_schedule = {'assignments': dict(), 'noninstructional_days': list()}
+    for assign_name, assign_info in assignments.items():
+        # (the same assignments that calculate_all_due_dates would set in Canvas)
+        if 'due_date' not in assign_info or 'canvas_api' not in assign_info:
+            continue
+        due_date = due_date_resolver.due_date(assign_name)
+        if isinstance(due_date, str) and due_date.endswith(NO_DUE_DATE_MARKER_STRING):
+            due_date = None
+        canvas_name = " ".join(assign_info['canvas_api']['canvas_name'].split())
+        course_schedule['assignments'][assign_name] = ScheduleExport.assignment_entry(canvas_name, due_date)
+
+    noninst_days_list = list(due_date_info_for_course['noninstructional_days_that_prevented_classes_dict'])
+    noninst_days_list.sort(key=functools.cmp_to_key(cmp_AssignmentForDisplay))
+    course_schedule['noninstructional_days'] = [{'date': noninst_day.due_at, 'title': noninst_day.title}
+                                                for noninst_day in noninst_days_list]
+    return course_schedule
+
+# Returns (general_due_date_info, start_of_quarter, end_of_quarter), or None if something's missing
+# sz_first_day_of_quarter is from the command line ('' to use the date in gradingTool.json)
+def get_quarter_dates(sz_first_day_of_quarter: str):
     general_due_date_info = get_general_due_date_info_defaults()
     if general_due_date_info == None:
-        return
+        return None
 
-    if args.FIRST_DAY_OF_QUARTER == '':
+    if sz_first_day_of_quarter == '':
         if 'date_of_first_day_of_the_quarter' in general_due_date_info \
                 and general_due_date_info['date_of_first_day_of_the_quarter'] is not None:
             # this is already a datetime in UTC
             start_of_quarter = general_due_date_info['date_of_first_day_of_the_quarter']
         else:
             printError("First day of class not found in json file, and not specified on the command line")
-            return
+            return None
     else:
         # first day of the quarter was specified as a string on the CLI - convert it here
         try:
-            start_of_quarter = datetime.datetime.strptime(args.FIRST_DAY_OF_QUARTER, "%Y-%m-%d")
+            start_of_quarter = datetime.datetime.strptime(sz_first_day_of_quarter, "%Y-%m-%d")
             start_of_quarter = date_time_from_local_to_utc(start_of_quarter, general_due_date_info['time_zone'])
         except ValueError as ve:
-            printError(f'FIRST_DAY_OF_QUARTER parameter needs to be a date in YYYY-MM-DD format.  This is not in that format: {args.FIRST_DAY_OF_QUARTER}')
-            return
+            printError(f'FIRST_DAY_OF_QUARTER parameter needs to be a date in YYYY-MM-DD format.  This is not in that format: {sz_first_day_of_quarter}')
+            return None
 
     # at this point start_of_quarter is a datetime, in UTC
 
@@ -1752,12 +2123,16 @@ def fn_canvas_calculate_all_due_dates(args):
         end_of_quarter = general_due_date_info['date_of_last_day_of_the_quarter']
     else:
         printError("Last day of class not found in json file")
-        return
+        return None
+
+    return general_due_date_info, start_of_quarter, end_of_quarter
 
-    due_date_info_for_course = config.getKey(f"courses/{course_name}/due_date_info", "")
+# Returns the course's due_date_info from gradingTool.json (with the defaults filled in), or None if it's missing
+def get_course_due_date_info(course_name):
+    due_date_info_for_course = get_app_config().getKey(f"courses/{course_name}/due_date_info", "")
     if due_date_info_for_course == "":
         printError(f"Could not find course-wide due date info for {course_name}")
-        return
+        return None
     due_date_info_for_course = set_course_due_date_info_defaults(due_date_info_for_course)
 
     valid_day_abbrevs = list(calendar.day_abbr)
@@ -1773,6 +2148,19 @@ def fn_canvas_calculate_all_due_dates(args):
         print("Valid day abberviations are: " + str(valid_day_abbrevs))
         sys.exit(-1)
 
+    return due_date_info_for_course
+
+# Works out (and prints) the due dates for one course, and which of them are different from what's in Canvas
+# course & capi_assignments are the Canvas course and its assignments, if they've already been fetched
+# Returns (Canvas course, list of due_date_change), or None if the due dates couldn't be calculated
+def calculate_course_due_dates(course_name, hw_name, general_due_date_info, start_of_quarter, end_of_quarter, noop, verbose,
+                               course=None, capi_assignments=None):
+    config = get_app_config()
+
+    due_date_info_for_course = get_course_due_date_info(course_name)
+    if due_date_info_for_course is None:
+        return
+
     course_info = config.getKey(f"courses/{course_name}", "")
     if course_info == "":
         printError(f"Could not find {course_name}")
@@ -1783,43 +2171,47 @@ def fn_canvas_calculate_all_due_dates(args):
         if hw_info == "":
             printError(f"Could not find the assignment {hw_name} within the course {course_name}")
             return
-        course_info["assignments"] = {
+        # Only this assignment gets updated, but the due dates it's relative to are still worked out
+        assignments_to_update = {
             hw_name : hw_info
         }
+    else:
+        assignments_to_update = course_info["assignments"]
 
     # For the entries in the JSON file:
     # Normalize spaces for Canvas names (no leading or trailing spaces, exactly 1 space between tokens)
-    for assign_name, assign_info in course_info["assignments"].items():
+    for assign_name, assign_info in assignments_to_update.items():
         tokens = assign_info['canvas_api']['canvas_name'].split()
         assign_info['canvas_api']['canvas_name'] = " ".join(tokens)
 
-    # dict: Canvas name -> assignment info from JSON file
+    # dict: Canvas name -> JSON name of the assignment
     json_assignments_lookup = dict()
-    for assign_name, assign_info in course_info["assignments"].items():
+    for assign_name, assign_info in assignments_to_update.items():
         if assign_info['canvas_api']['canvas_name'] in json_assignments_lookup:
             printError(f"\t\tERROR: {json_assignments_lookup} is already in the json_assignments_lookup table.  Make sure that every item has a unique CanvasAPI name!")
         else:
-            json_assignments_lookup[assign_info['canvas_api']['canvas_name']] = assign_info
+            json_assignments_lookup[assign_info['canvas_api']['canvas_name']] = assign_name
+
+    # Every due date is worked out (at most) once, in dependency order
+    due_date_resolver = DueDateResolver(course_info["assignments"],
+                                        lambda assign_info, base_due_date: calculateDueDate(assign_info, base_due_date, start_of_quarter,
+                                                                                            due_date_info_for_course, general_due_date_info))
 
-    # Go through all the assignments in Canvas, via the CanvasAPI:
-    print("Getting the assignment from Canvas")
-    course, canvas = get_canvas_course(course_name, verbose)
     if course is None:
-        return
+        # Go through all the assignments in Canvas, via the CanvasAPI:
+        print("Getting the assignment from Canvas")
+        course, canvas = get_canvas_course(course_name, verbose)
+        if course is None:
+            return None
 
     # if verbose:
     print(f"\tQuarter start date: {start_of_quarter.strftime('%a, %B %d, %Y')}")
     print(f"\tQuarter end date:   {general_due_date_info['date_of_last_day_of_the_quarter'].strftime('%a, %B %d, %Y')}")
     print(f"Getting Assignments for \"{Style.BRIGHT + Fore.RED + course.name+ Style.RESET_ALL}\"")
 
-    if not noop:
-        if not confirm_choice("Do you want to change the due dates for this course?", None, course.name, \
-                       "Updating due dates now", \
-                       "Operation canceled - NO CHANGES MADE"):
-            return
-
-    # Get all assignments:
-    capi_assignments = course.get_assignments()
+    if capi_assignments is None:
+        # Get all assignments:
+        capi_assignments = list(course.get_assignments(per_page=CANVAS_PAGE_SIZE))
 
     # For the assignments in Canvas:
     # Normalize spaces for Canvas names (no leading or trailing spaces, exactly 1 space between tokens)
@@ -1861,17 +2253,20 @@ def fn_canvas_calculate_all_due_dates(args):
     canvas_assignments_prior_to_quarter_start_dict = {}
     canvas_assignments_after_quarter_end_dict = {}
 
-    # Next, actually go through and adjust the due dates:
+    # Next, work out what the due dates should be (and which of them are different from what's in Canvas now):
     if not noop:
-        print("\nChanging the due dates in Canvas: ".ljust(120, "="))
+        print("\nCalculating due dates (nothing has been changed in Canvas yet): ".ljust(120, "="))
     else:
         print("\nCalculating due dates (but NOT changing anything in Canvas): ".ljust(120, "="))
 
+    # due_date_change for each assignment that needs to be updated in Canvas
+    due_date_changes = []
+
     for assign in capi_assignments:
-        if assign.name in json_assignments_lookup and 'due_date' in json_assignments_lookup[assign.name]:
+        if assign.name in json_assignments_lookup and 'due_date' in assignments_to_update[json_assignments_lookup[assign.name]]:
 
-            the_assignment = json_assignments_lookup[assign.name] # this switches from looking up by Canvas name to JSON ID/key/name
-            due_date = calculateDueDate(the_assignment, start_of_quarter, due_date_info_for_course, general_due_date_info, course_info["assignments"])
+            the_assignment_name = json_assignments_lookup[assign.name] # this switches from looking up by Canvas name to JSON ID/key/name
+            due_date = due_date_resolver.due_date(the_assignment_name)
 
             if isinstance(due_date, datetime.datetime) \
                     or (isinstance(due_date, str) \
@@ -1915,20 +2310,12 @@ def fn_canvas_calculate_all_due_dates(args):
 
                         canvas_assignments_with_lock_or_unlock_set[assign.name] = all_capi_assignments_dict[assign.name]
 
-                    # restore the name that Canvas is expecting:
-                    assign.name = assign.name_original
-
-                    if not noop:
-                        updated_assignment = assign.edit(
-                            assignment={
-                                'due_at': due_date,
-                                'lock_at': lock_at,
-                                'unlock_at':unlock_at
-                            }
-                        )
-                        print(" : Updated!")
+                    change = due_date_change(assign, due_date, lock_at, unlock_at)
+                    if needs_update(change):
+                        due_date_changes.append(change)
+                        print(" : Needs updating")
                     else:
-                        print() # each result is printed out on it's own line
+                        print(" : (already set in Canvas)")
 
                     # Copy the assignment into the 'updated assignments' map:
                     updated_capi_assignments_dict[assign.name_normalized] = all_capi_assignments_dict[assign.name_normalized]
@@ -1944,9 +2331,6 @@ def fn_canvas_calculate_all_due_dates(args):
 
                 except Exception as e:
                     printError("Error: " + str(type( e )) + " : " + str(e))
-                finally:
-                    # Guarantee that we restore the name without any goofy whitespacing:
-                    assign.name = assign.name_normalized
             else:
                 #  due_date is an error message (str)
                 due_date_str = due_date
@@ -1960,16 +2344,11 @@ def fn_canvas_calculate_all_due_dates(args):
     all_json_assignments_dict = {}
 
     # Any unused entries in the JSON file?
-    for assign_name, assign_info in course_info["assignments"].items():
-
-        if 'resolved_due_date' not in assign_info:
-            # This will ensure that we've calculated the due date
-            # Anything we saw in the CAPI part should already have a due date
-            # Anything we didn't see in the CAPI part should lack a due date until we call this:
-            date_obj = calculateDueDate(assign_info, start_of_quarter, due_date_info_for_course, \
-                             general_due_date_info, course_info["assignments"])
-        else:
-            date_obj = assign_info['resolved_due_date']
+    for assign_name, assign_info in assignments_to_update.items():
+
+        # Anything we saw in the CAPI part already has a due date (which the resolver remembers)
+        # Anything we didn't see in the CAPI part gets calculated now:
+        date_obj = due_date_resolver.due_date(assign_name)
 
         date_str = ""
         if  isinstance(date_obj, datetime.datetime):
@@ -2015,11 +2394,7 @@ def fn_canvas_calculate_all_due_dates(args):
         for noninst_day in noninst_days_list:
             noninst_day.print()
 
-    if noop:
-        print()
-        print(Style.BRIGHT + Fore.RED + "Don't forget to update holidays, etc!!"+ Style.RESET_ALL)
-
-    print() # spacer line, so it's easier to see where output ends & prompt begins :)
+    return course, due_date_changes
 
 
 def print_pre_post_quarter_list(before_start_of_quarter, all_json_assignments_dict, canvas_assignments_after_quarter_end_dict, noop):
@@ -2054,15 +2429,12 @@ def print_pre_post_quarter_list(before_start_of_quarter, all_json_assignments_di
 #   One of the following:
 #       1) a DateTime for the due date
 #       2) a string containing an error message, describing why we can't calculate a DateTime
-def calculateDueDate(assign, start_of_quarter, due_date_info_for_course, general_due_date_info, assignments_from_json):
-    # Once we start this method we'll look up all the assignments using their JSON ID/name field
-    # Instead of their CanvasAPI names
-
-    # If we previously memoized it, return that value:
-    if 'resolved_due_date' in assign:
-        # print(f"Returning previously calculated answer for {assign['name']}")
-        return assign['resolved_due_date']
-
+#
+# base_due_date is the due date of the assignment that this one is relative to (for 'relative_to': 'ASSIGNMENT')
+# DueDateResolver works those out (in the right order) and passes them in
+def calculateDueDate(assign, base_due_date, start_of_quarter, due_date_info_for_course, general_due_date_info):
+    if 'due_date' not in assign:
+        return f"Assignment {assign['name']} doesn't have a 'due_date' object"
     due_date_info = assign['due_date']
     if 'relative_to' not in due_date_info:
         return f"Assignment {assign['name']} doesn't have a 'relative_to' field in the 'due_date' object"
@@ -2072,7 +2444,8 @@ def calculateDueDate(assign, start_of_quarter, due_date_info_for_course, general
         return f"Assignment {assign['name']} doesn't have a 'offsets' field in the 'due_date' object"
 
     relative_to = due_date_info['relative_to']['type']
-    offsets = due_date_info['offsets']
+    # (copied, so that the offsets in gradingTool.json are left alone)
+    offsets = list(due_date_info['offsets'])
 
     # This will be replaced (or else it will be true :)  )
     due_date = f"Internal error when trying to calculate {assign['name']}"
@@ -2081,22 +2454,13 @@ def calculateDueDate(assign, start_of_quarter, due_date_info_for_course, general
         due_date = start_of_quarter
     elif relative_to == "FIRST_CLASS_OF_QUARTER":
         due_date = start_of_quarter
-        offsets.insert(0, "-1 CALENDAR_DAY")
-        offsets.insert(1, "+1 CLASS_DAY")
+        offsets = ["-1 CALENDAR_DAY", "+1 CLASS_DAY"] + offsets
     elif relative_to == "NO_DUE_DATE":
         due_date = NO_DUE_DATE_MARKER_STRING
     elif relative_to == "ASSIGNMENT":
         if 'assignment_name' not in due_date_info['relative_to']:
             return f"Assignment {assign['name']} doesn't have a 'assignment_name' field in the 'due_date/relative_to' object"
-        base_due_date_assign_name = due_date_info['relative_to']['assignment_name']
-        # TODO: Recursively calculate (and cache) relative due date here
-
-        if base_due_date_assign_name not in assignments_from_json:
-            due_date = f"Couldn't determine due date of {assign['name']} because we could not find \"{base_due_date_assign_name}\" in gradingTool.json"
-        else:
-            due_date = calculateDueDate(assignments_from_json[base_due_date_assign_name], start_of_quarter, due_date_info_for_course, general_due_date_info, assignments_from_json)
-            if isinstance(due_date, str):
-                due_date = f"Couldn't determine due date of {assign['name']} because of a problem with {base_due_date_assign_name}:\n" + due_date
+        due_date = base_due_date
     else:
         due_date += f": Did not recognize relative_to['type'] of {relative_to}"
 
@@ -2106,15 +2470,27 @@ def calculateDueDate(assign, start_of_quarter, due_date_info_for_course, general
 
         due_date = apply_offsets_to_due_date(due_date, offsets, due_date_info_for_course, general_due_date_info)
 
-
-    # Memoize it, so we don't have to repeat all this work
-    assign['resolved_due_date'] = due_date
-
     return due_date
 
+# A CourseCalendar is built the first time a class schedule (days of the week + whether there's class on
+# noninstructional days) is needed, and then kept with the general due date info, so that every assignment
+# in this run (in every course with the same schedule) re-uses it
+def get_course_calendar(due_date_info_for_course, general_due_date_info) -> CourseCalendar:
+    course_calendars = general_due_date_info.setdefault('course_calendars', dict())
+    schedule = (tuple(due_date_info_for_course["days_of_week"]), due_date_info_for_course['class_on_noninstructional_days'])
+    if schedule not in course_calendars:
+        course_calendars[schedule] = CourseCalendar(due_date_info_for_course["days_of_week"],
+                                                    general_due_date_info['noninstructional_days'],
+                                                    general_due_date_info['time_zone'],
+                                                    general_due_date_info.get('date_of_first_day_of_the_quarter'),
+                                                    general_due_date_info.get('date_of_last_day_of_the_quarter'),
+                                                    due_date_info_for_course['class_on_noninstructional_days'])
+    return course_calendars[schedule]
+
 # Returns
 #   A DateTime
 def apply_offsets_to_due_date(due_date:datetime.datetime, offsets, due_date_info_for_course, general_due_date_info):
+    course_calendar = get_course_calendar(due_date_info_for_course, general_due_date_info)
 
     for szOffset in offsets:
         parts = szOffset.split(' ')
@@ -2126,100 +2502,34 @@ def apply_offsets_to_due_date(due_date:datetime.datetime, offsets, due_date_info
                 due_time = datetime.datetime.strptime(sz_time, FMT_TIME_WITHOUT_DATE).time()
             except ValueError as ve:
                 printError(f"Could not parse {sz_time} as time using format string of {FMT_TIME_WITHOUT_DATE} - IGNORING THIS OFFSET")
-            due_date = due_date.combine(due_date, due_time, tzinfo=due_date.tzinfo)
+                continue
+            local_due_date = course_calendar.to_local(due_date)
+            due_date = course_calendar.from_local(datetime.datetime.combine(local_due_date.date(), due_time))
 
         elif op == "CALENDAR_DAY":
             how_many = int(parts[0])
             # print(f"Moving forwards {how_many} calendar days")
-            if how_many > 0:
-                move_by = 1
-            else:
-                move_by = -1
-
-            while how_many != 0:
-                due_date = due_date + datetime.timedelta(days=move_by)
-                how_many = how_many - move_by
+            due_date = course_calendar.add_calendar_days(due_date, how_many)
 
         elif op == "CLASS_DAY":
             how_many = int(parts[0])
             # print(f"Moving forwards {how_many} class days")
-            if how_many > 0:
-                move_by = 1
-            else:
-                move_by = -1
+            due_date, skipped_noninst_days = course_calendar.add_class_days(due_date, how_many)
 
-            while how_many != 0:
-                idx_cur_day = None
-                idx_next_class = None
-                moved_off_starting_day = False
-
-                try:
-                    idx_cur_day = idx_starting_day = due_date_info_for_course["days_of_week"].index(due_date.astimezone(general_due_date_info['time_zone']).strftime("%a"))
-                    # If we're at the last day of class this week then wrap around to next week's first day:
-                    idx_next_class = (idx_starting_day + 1) % len(due_date_info_for_course["days_of_week"])
-                except ValueError as ve:
-                    # We're here because we couldn't find due_date's day-of-week in the list of class days for the course
-                    pass
-                    # print(str(ve))
-
-                while moved_off_starting_day == False \
-                        or idx_cur_day is None \
-                        or idx_cur_day != idx_next_class:
-                    # Move due date by 1 day and see if we're on the next class day:
-                    due_date = due_date + datetime.timedelta(days = move_by)
-
-                    moved_off_starting_day = True
-
-                    try:
-                        idx_cur_day = due_date_info_for_course["days_of_week"].index(due_date.astimezone(general_due_date_info['time_zone']).strftime("%a"))
-
-                        if idx_next_class is None:
-                            # must have started between class days, so the first one we find is the 'next' one
-                            # this will cause the loop to stop
-                            idx_next_class = idx_cur_day
-
-                        # If the current due_date is a non-instructional day,
-                        # AND we're avoiding due dates on non-instructional days,
-                        # then skip this date
-
-                        if not due_date_info_for_course['class_on_noninstructional_days']:
-                            result = list(filter(lambda noninst_day: noninst_day['date'].date() == due_date.astimezone(general_due_date_info['time_zone']).date(), \
-                                                     general_due_date_info['noninstructional_days']))
-                            is_noninst_day = len(result) > 0
-
-                            if is_noninst_day:
-                                # This day isn't usable, so keep looking for the next class day
-                                idx_next_class = (idx_next_class + 1) % len(due_date_info_for_course["days_of_week"])
-
-                                noninst_date_str = result[0]['date'].strftime("%Y-%m-%d")
-                                noninst = AssignmentForDisplay(noninst_date_str, result[0]['title'])
-                                due_date_info_for_course['noninstructional_days_that_prevented_classes_dict'].add(noninst)
-
-                    except ValueError as ve:
-                        # print(str(ve))
-                        idx_cur_day = None # This will cause us to skip any non-class days
-
-                how_many = how_many - move_by
+            # Remind the user about the non-instructional days that would have been class days
+            for noninst_day in skipped_noninst_days:
+                noninst_date_str = noninst_day['date'].strftime("%Y-%m-%d")
+                noninst = AssignmentForDisplay(noninst_date_str, noninst_day['title'])
+                due_date_info_for_course['noninstructional_days_that_prevented_classes_dict'].add(noninst)
 
         elif op == "NEAREST_CALENDAR_DAY":
-            which_day = parts[0].casefold() # 'Mon', 'Sun', etc
-
-            day_ahead = due_date # We will move this forward from the starting day to check for the day we're looking for
-            day_behind = due_date # Ditto, but backwards (earlier) in time
-            while day_ahead.strftime("%a").casefold() != which_day \
-                    and day_behind.strftime("%a").casefold() != which_day:
-
-                # Move candidates by 1 day and see if we're on the next class day:
-                day_ahead = day_ahead + datetime.timedelta(days = 1)
-                day_behind = day_behind + datetime.timedelta(days = -1)
-
-            # which day matched the target?
-            if day_ahead.strftime("%a").casefold() == which_day:
-                due_date = day_ahead
-            elif day_behind.strftime("%a").casefold() == which_day:
-                due_date = day_behind
-            else:
+            which_day = parts[0] # 'Mon', 'Sun', etc
+
+            nearest = course_calendar.nearest_day_of_week(due_date, which_day)
+            if nearest is None:
                 printError("Did not find a day for " + which_day + " - IGNORING THIS OFFSET")
+            else:
+                due_date = nearest
 
     return due_date
 
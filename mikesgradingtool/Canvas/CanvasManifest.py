@@ -0,0 +1,189 @@
+import csv
+import datetime
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from mikesgradingtool.utils.print_utils import printError
+
+# One of these lives at the top of each assignment's folder (next to the student folders)
+MANIFEST_FILE_NAME = "CANVAS_MANIFEST.sqlite3"
+
+# Older versions of the tool kept one of these in each student's folder.
+# They're moved into the manifest (and then removed) the first time the manifest doesn't know about a student
+LEGACY_VERSIONS_FILE_NAME = "CANVAS_FILE_VERSIONS.csv"
+
+# What we know about the copy of a file that's on disk
+manifest_entry = namedtuple('manifest_entry', 'attempt_num file_name fp_dest modified_at size sha256 attachment_id')
+
+# student_dir & local_name are stored relative to the assignment folder, so the whole folder can be moved around
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS attachments (
+    user_id         INTEGER NOT NULL,
+    attachment_id   INTEGER NOT NULL,
+    student_dir     TEXT NOT NULL,
+    file_name       TEXT NOT NULL,
+    local_name      TEXT NOT NULL,
+    attempt         INTEGER NOT NULL,
+    modified_at     TEXT,
+    size            INTEGER,
+    sha256          TEXT,
+    downloaded_at   TEXT NOT NULL,
+    PRIMARY KEY (user_id, attachment_id)
+);
+CREATE INDEX IF NOT EXISTS attachments_by_dir ON attachments (student_dir, file_name, attempt);
+
+-- The rows of the old CANVAS_FILE_VERSIONS.csv files, which don't know which Canvas attachment they were
+CREATE TABLE IF NOT EXISTS legacy_files (
+    user_id         INTEGER NOT NULL,
+    student_dir     TEXT NOT NULL,
+    file_name       TEXT NOT NULL,
+    local_name      TEXT NOT NULL,
+    attempt         INTEGER NOT NULL,
+    modified_at     TEXT,
+    migrated_at     TEXT NOT NULL,
+    PRIMARY KEY (student_dir, file_name)
+);
+"""
+
+
+# An assignment-wide record of every attachment that we've downloaded from Canvas.
+#
+# The whole thing is read in with a single query when it's opened, so deciding whether
+# a student's files have changed doesn't need to touch anything in the student's folder.
+# Rows are written as downloads finish (from the downloader's worker threads), and everything is
+# committed when the manifest is closed
+class CanvasManifest:
+
+    def __init__(self, fp_assignment_dir: str):
+        self.fp_assignment_dir = fp_assignment_dir
+        self.fp_manifest = os.path.join(fp_assignment_dir, MANIFEST_FILE_NAME)
+
+        os.makedirs(fp_assignment_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.fp_manifest, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+        # student_dir => { file_name => newest manifest_entry }
+        # (if a downloaded attachment and a legacy file are the same attempt then the attachment wins)
+        self._latest = dict()
+        rows = self._db.execute("SELECT student_dir, file_name, attempt, local_name, modified_at, size, sha256, "
+                                "attachment_id, 1 AS source FROM attachments "
+                                "UNION ALL "
+                                "SELECT student_dir, file_name, attempt, local_name, modified_at, NULL, NULL, "
+                                "NULL, 0 AS source FROM legacy_files "
+                                "ORDER BY attempt, source")
+        for student_dir, file_name, attempt, local_name, modified_at, size, sha256, attachment_id, source in rows:
+            fp_dest = os.path.join(fp_assignment_dir, student_dir, local_name)
+            self._latest.setdefault(student_dir, dict())[file_name] = \
+                manifest_entry(attempt, file_name, fp_dest, modified_at, size, sha256, attachment_id)
+
+    # make the manifest a context manager, so it's always committed & closed
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _student_dir_key(self, fp_student_dir: str) -> str:
+        return os.path.relpath(fp_student_dir, self.fp_assignment_dir)
+
+    # Returns { file_name => manifest_entry } for the newest version of each file we've downloaded
+    # into fp_student_dir.  Students that were downloaded by an older version of the tool have their
+    # CANVAS_FILE_VERSIONS.csv file moved into the manifest (every row of it, as-is)
+    def files_for_student(self, fp_student_dir: str, user_id: int) -> dict:
+        with self._lock:
+            files = self._latest.get(self._student_dir_key(fp_student_dir))
+        if files is not None:
+            return dict(files)
+
+        # (the CSV has the full path from when it was written, but the folder may have been moved since then)
+        legacy_files = {file_name: entry._replace(fp_dest=os.path.join(fp_student_dir, os.path.basename(entry.fp_dest)))
+                        for file_name, entry in self._read_legacy_versions_file(fp_student_dir).items()}
+        if legacy_files:
+            self._migrate_legacy_files(user_id, fp_student_dir, legacy_files)
+        return legacy_files
+
+    # Returns the newest version of every file we've downloaded that isn't on disk any more
+    # (including the files of students whose folders have been deleted)
+    def missing_files(self) -> list:
+        with self._lock:
+            entries = [entry for files in self._latest.values() for entry in files.values()]
+        return [entry for entry in entries if not os.path.exists(entry.fp_dest)]
+
+    @staticmethod
+    def _read_legacy_versions_file(fp_student_dir: str) -> dict:
+        fp_versions_file = os.path.join(fp_student_dir, LEGACY_VERSIONS_FILE_NAME)
+        if not os.path.isfile(fp_versions_file):
+            return dict()
+
+        try:
+            with open(fp_versions_file, mode='r', encoding="utf-8") as inp:
+                return {row[1]: manifest_entry(int(row[0]), row[1], row[2], row[3], None, None, None)
+                        for row in csv.reader(inp)}
+        except (OSError, ValueError, IndexError) as e:
+            printError(f"Unable to read {fp_versions_file} (all files will be re-downloaded): {e}")
+            return dict()
+
+    # Remember that file_name (attempt #attempt_num, attachment attach) is on disk at fp_dest.
+    # Safe to call from any thread
+    def record(self, user_id: int, attach: dict, file_name: str, attempt_num: int, fp_dest: str,
+               size: int = None, sha256: str = None):
+        fp_student_dir = os.path.dirname(fp_dest)
+        student_dir = self._student_dir_key(fp_student_dir)
+        local_name = os.path.basename(fp_dest)
+        if size is None:
+            size = attach.get('size')
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO attachments (user_id, attachment_id, student_dir, file_name, "
+                             "local_name, attempt, modified_at, size, sha256, downloaded_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (user_id, attach['id'], student_dir, file_name, local_name, attempt_num,
+                              attach.get('modified_at'), size, sha256,
+                              datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')))
+
+            files = self._latest.setdefault(student_dir, dict())
+            if file_name not in files or files[file_name].attempt_num <= attempt_num:
+                files[file_name] = manifest_entry(attempt_num, file_name, fp_dest, attach.get('modified_at'),
+                                                  size, sha256, attach['id'])
+
+    # The CSV file is only removed once its rows have been committed to the manifest
+    # (a savepoint is used so that a failure doesn't roll back other students' downloads)
+    def _migrate_legacy_files(self, user_id: int, fp_student_dir: str, legacy_files: dict):
+        student_dir = self._student_dir_key(fp_student_dir)
+        migrated_at = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+        rows = [(user_id, student_dir, entry.file_name, os.path.basename(entry.fp_dest), entry.attempt_num,
+                 entry.modified_at, migrated_at)
+                for entry in legacy_files.values()]
+
+        with self._lock:
+            try:
+                self._db.execute("SAVEPOINT legacy_files")
+                self._db.executemany("INSERT OR REPLACE INTO legacy_files (user_id, student_dir, file_name, "
+                                     "local_name, attempt, modified_at, migrated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                     rows)
+                self._db.execute("RELEASE SAVEPOINT legacy_files")
+                self._db.commit()
+            except sqlite3.Error as e:
+                self._db.execute("ROLLBACK TO SAVEPOINT legacy_files")
+                self._db.execute("RELEASE SAVEPOINT legacy_files")
+                printError(f"Unable to move {LEGACY_VERSIONS_FILE_NAME} into the manifest for {student_dir} (will try again next time): {e}")
+                return
+
+            files = self._latest.setdefault(student_dir, dict())
+            for entry in legacy_files.values():
+                if entry.file_name not in files or files[entry.file_name].attempt_num < entry.attempt_num:
+                    files[entry.file_name] = entry
+
+        os.remove(os.path.join(fp_student_dir, LEGACY_VERSIONS_FILE_NAME))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
@@ -0,0 +1,165 @@
+import functools
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+from canvasapi.exceptions import Forbidden, RateLimitExceeded
+
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.misc_utils import print_threadsafe
+
+# Used when gradingTool.json doesn't have canvas/api/max_concurrent_requests
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+
+# Used when gradingTool.json doesn't have canvas/api/max_tries
+DEFAULT_MAX_TRIES = 6
+
+# Canvas gives each user a 'bucket' of (about) 700 units, which refills over time; each request's
+# cost comes out of it.  When X-Rate-Limit-Remaining drops below LOW_WATER_MARK we back off,
+# and when it's above HIGH_WATER_MARK we let more requests run at once
+# https://canvas.instructure.com/doc/api/file.throttling.html
+LOW_WATER_MARK = 200
+HIGH_WATER_MARK = 500
+
+# Retry delays (in seconds) are picked randomly from [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**try)]
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+
+@dataclass
+class CanvasRequestStats:
+    requests: int = 0
+    throttled: int = 0
+    retries: int = 0
+    network_errors: int = 0
+    peak_concurrency: int = 0
+    lowest_rate_limit_remaining: float = None
+    seconds_waiting: float = 0.0
+
+    def __str__(self):
+        remaining = "unknown" if self.lowest_rate_limit_remaining is None else f"{self.lowest_rate_limit_remaining:.0f}"
+        return f"{self.requests} Canvas API requests | {self.throttled} throttled | {self.retries} retried | " \
+               f"up to {self.peak_concurrency} at once | lowest X-Rate-Limit-Remaining: {remaining} | " \
+               f"{self.seconds_waiting:.1f}s spent backing off"
+
+
+def _is_throttled(e: Exception) -> bool:
+    # Canvas throttles with a '403 Forbidden (Rate Limit Exceeded)', which canvasapi
+    # reports as a plain Forbidden.  (RateLimitExceeded is a Forbidden, for 429s)
+    return isinstance(e, RateLimitExceeded) \
+        or (isinstance(e, Forbidden) and "rate limit exceeded" in str(e).lower())
+
+
+# Every Canvas API call goes through here (once install() has been called on the canvasapi Requester)
+#
+# The number of requests that can be in flight at once adapts to what Canvas tells us:
+#   * It goes up a bit after each response showing plenty of X-Rate-Limit-Remaining
+#   * It's cut in half when X-Rate-Limit-Remaining gets low, or when Canvas throttles us
+# Throttled requests are retried after a random ('jittered') exponential backoff, so that
+# the threads that were throttled together don't all retry at the same moment
+class CanvasRequestScheduler:
+
+    def __init__(self, max_concurrency: int, max_tries: int, verbose: bool = False):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_tries = max(1, max_tries)
+        self.verbose = verbose
+        self.stats = CanvasRequestStats()
+
+        # start in the middle, and let the responses push it up or down
+        self._limit = max(1.0, self.max_concurrency / 2)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return int(self._limit)
+
+    # Route all of a canvasapi Requester's requests through this scheduler
+    def install(self, requester):
+        if getattr(requester, "_grading_tool_scheduler", None) is self:
+            return
+        requester._grading_tool_scheduler = self
+        requester.request = functools.partial(self.request, requester.request)
+
+    def request(self, send_request, method, endpoint=None, *args, **kwargs):
+        # Uploads stream a file object, which can't be re-sent
+        can_retry = "file" not in kwargs
+
+        # canvasapi adds onto _kwargs in place, so each try gets its own copy of what the caller passed in
+        original_kwargs = kwargs.get("_kwargs")
+        if original_kwargs is not None:
+            original_kwargs = list(original_kwargs)
+
+        for attempt in range(1, self.max_tries + 1):
+            if original_kwargs is not None:
+                kwargs["_kwargs"] = list(original_kwargs)
+
+            self._acquire()
+            try:
+                response = send_request(method, endpoint, *args, **kwargs)
+            except Exception as e:
+                throttled = _is_throttled(e)
+                network_error = method == "GET" and isinstance(e, (requests.ConnectionError, requests.Timeout))
+                if not (throttled or network_error) or not can_retry or attempt == self.max_tries:
+                    raise
+
+                with self._cond:
+                    if throttled:
+                        self.stats.throttled += 1
+                        self._limit = max(1.0, self._limit / 2)
+                    else:
+                        self.stats.network_errors += 1
+                    self.stats.retries += 1
+            else:
+                self._update_limit(response)
+                return response
+            finally:
+                self._release()
+
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            if self.verbose:
+                reason = "Canvas asked us to slow down" if throttled else "couldn't reach Canvas"
+                print_threadsafe(f"\t({reason}; retrying {method} {endpoint or ''} in {delay:.1f} seconds)")
+            time.sleep(delay)
+            with self._cond:
+                self.stats.seconds_waiting += delay
+
+    def _acquire(self):
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                self._cond.wait()
+            self._in_flight += 1
+            self.stats.requests += 1
+            self.stats.peak_concurrency = max(self.stats.peak_concurrency, self._in_flight)
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _update_limit(self, response):
+        try:
+            remaining = float(response.headers.get("X-Rate-Limit-Remaining"))
+        except (TypeError, ValueError):
+            return  # not every Canvas server sends the header
+
+        with self._cond:
+            if self.stats.lowest_rate_limit_remaining is None or remaining < self.stats.lowest_rate_limit_remaining:
+                self.stats.lowest_rate_limit_remaining = remaining
+
+            if remaining < LOW_WATER_MARK:
+                self._limit = max(1.0, self._limit / 2)
+            elif remaining > HIGH_WATER_MARK:
+                # about +1 per 'round' of requests at the current limit
+                self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+
+@functools.lru_cache(1)
+def get_canvas_request_scheduler(verbose: bool = False) -> CanvasRequestScheduler:
+    config = get_app_config()
+    max_concurrency = int(config.getKey("canvas/api/max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS))
+    max_tries = int(config.getKey("canvas/api/max_tries", DEFAULT_MAX_TRIES))
+    return CanvasRequestScheduler(max_concurrency, max_tries, verbose)
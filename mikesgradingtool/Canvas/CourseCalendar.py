@@ -0,0 +1,119 @@
+import bisect
+import calendar
+import datetime
+
+from mikesgradingtool.utils.print_utils import GradingToolError
+
+# How many days before the start (and after the end) of the quarter the index covers when it's built.
+# If a due date ends up outside of that then the index is rebuilt to cover (at least) this much more
+INDEX_MARGIN_DAYS = 366
+
+
+# The class days for one course, worked out once per run, so that the due date offsets don't need to
+# walk through the calendar one day at a time.
+#
+# The index is a sorted list of the dates (as ordinals - see date.toordinal) that the course meets on, with the
+# noninstructional days already removed.  Moving a due date by N class days is then a bisect to find
+# where the due date is in that list, followed by moving N places along it.
+#
+# All the date math is done on the local (time zone) date & time, and the result is then localized again,
+# so that moving across a daylight saving time change doesn't shift the due time by an hour
+# (or, for due dates just before midnight, onto the next day)
+class CourseCalendar:
+
+    # days_of_week:    day abbreviations ('Mon', 'Wed', etc) that the course meets on
+    # noninstructional_days:   list of {'title': ..., 'date': datetime}, from get_general_due_date_info_defaults()
+    # first_day / last_day:    datetimes for the start & end of the quarter (or None, if they aren't known)
+    def __init__(self, days_of_week, noninstructional_days, time_zone, first_day=None, last_day=None,
+                 class_on_noninstructional_days=False):
+        day_abbrevs = list(calendar.day_abbr)  # 'Mon' is 0, the same as date.weekday()
+        self.class_weekdays = frozenset(day_abbrevs.index(day) for day in days_of_week if day in day_abbrevs)
+        if not self.class_weekdays:
+            raise GradingToolError(f"Couldn't find any class days in days_of_week: {days_of_week}")
+
+        self.time_zone = time_zone
+        self.class_on_noninstructional_days = class_on_noninstructional_days
+
+        # date ordinal -> the noninstructional day's info
+        # (if the same date is listed more than once then the first one wins)
+        self.noninstructional_days = dict()
+        for noninst_day in noninstructional_days:
+            self.noninstructional_days.setdefault(noninst_day['date'].toordinal(), noninst_day)
+
+        self._first_day = self.to_local(first_day).toordinal() if first_day is not None else None
+        self._last_day = self.to_local(last_day).toordinal() if last_day is not None else None
+        self._lo = self._hi = None
+        # the sorted ordinals of the days the course meets on
+        self._class_days = list()
+        # the sorted ordinals of noninstructional days that would otherwise have been class days
+        self._prevented_days = list()
+
+    def to_local(self, dt: datetime.datetime) -> datetime.datetime:
+        return dt.astimezone(self.time_zone).replace(tzinfo=None)
+
+    def from_local(self, dt: datetime.datetime) -> datetime.datetime:
+        return self.time_zone.localize(dt)
+
+    # Build (or re-build) the index so that it covers the dates from lo to hi (ordinals)
+    def _cover(self, lo: int, hi: int):
+        if self._lo is not None and self._lo <= lo and hi <= self._hi:
+            return
+
+        lo = min(x for x in (lo, self._lo, self._first_day) if x is not None) - INDEX_MARGIN_DAYS
+        hi = max(x for x in (hi, self._hi, self._last_day) if x is not None) + INDEX_MARGIN_DAYS
+
+        self._class_days = list()
+        self._prevented_days = list()
+        for ordinal in range(lo, hi + 1):
+            if datetime.date.fromordinal(ordinal).weekday() not in self.class_weekdays:
+                continue
+            if not self.class_on_noninstructional_days and ordinal in self.noninstructional_days:
+                self._prevented_days.append(ordinal)
+            else:
+                self._class_days.append(ordinal)
+        self._lo, self._hi = lo, hi
+
+    def add_calendar_days(self, due_date: datetime.datetime, how_many: int) -> datetime.datetime:
+        return self.from_local(self.to_local(due_date) + datetime.timedelta(days=how_many))
+
+    # Moves due_date forwards (or backwards, if how_many is negative) by how_many class days, keeping the time of day.
+    # Starting on a class day doesn't count as moving; starting between class days, +1 is the next class day.
+    # Returns (new due date, list of the noninstructional days that were skipped over on the way)
+    def add_class_days(self, due_date: datetime.datetime, how_many: int):
+        if how_many == 0:
+            return due_date, []
+
+        local = self.to_local(due_date)
+        start = local.toordinal()
+
+        while True:
+            self._cover(start, start)
+            if how_many > 0:
+                idx = bisect.bisect_right(self._class_days, start) + how_many - 1
+            else:
+                idx = bisect.bisect_left(self._class_days, start) + how_many
+            if 0 <= idx < len(self._class_days):
+                break
+            # Went past the end of the index, so make it bigger
+            self._cover(self._lo - abs(how_many) * 7, self._hi + abs(how_many) * 7)
+
+        end = self._class_days[idx]
+        lo, hi = min(start, end), max(start, end)
+        skipped = self._prevented_days[bisect.bisect_right(self._prevented_days, lo):
+                                       bisect.bisect_left(self._prevented_days, hi)]
+
+        local = local + datetime.timedelta(days=end - start)
+        return self.from_local(local), [self.noninstructional_days[ordinal] for ordinal in skipped]
+
+    # Moves due_date to the closest day_abbrev ('Mon', 'Fri', etc - in any case), keeping the time of day.
+    # If the previous and next ones are equally close then the later one is used.
+    # Returns None if day_abbrev isn't a day of the week
+    def nearest_day_of_week(self, due_date: datetime.datetime, day_abbrev: str):
+        day_abbrevs = [day.casefold() for day in calendar.day_abbr]
+        if day_abbrev.casefold() not in day_abbrevs:
+            return None
+
+        local = self.to_local(due_date)
+        days_ahead = (day_abbrevs.index(day_abbrev.casefold()) - local.weekday()) % 7
+        move_by = days_ahead if days_ahead <= 7 - days_ahead else days_ahead - 7
+        return self.from_local(local + datetime.timedelta(days=move_by))
@@ -0,0 +1,123 @@
+from collections import deque
+from typing import Callable
+
+from mikesgradingtool.utils.print_utils import printError
+
+
+# Works out the due dates for all of a course's assignments (from gradingTool.json), each one exactly once.
+#
+# An assignment's due date can be relative to another assignment's due date ('relative_to': {'type': 'ASSIGNMENT'}),
+# so the assignments are first put into a dependency graph (each assignment points to the one it's relative to),
+# which is then sorted (Kahn's algorithm) so that every assignment comes after the one it depends on.
+# Anything left over after sorting is part of (or depends on) a loop, and gets an error message instead of a due date.
+#
+# The results are kept here, NOT in the gradingTool.json info, so that the config is never changed and
+# re-calculating (in the same process) always gives the same answer
+class DueDateResolver:
+
+    # assignments:  JSON name -> assignment info (i.e., courses/<course>/assignments in gradingTool.json)
+    # calculate_one(assign_info, base_due_date) -> datetime, or a str error message
+    #   base_due_date is the (already resolved) due date of the assignment that this one is relative to,
+    #   or None if it isn't relative to another assignment
+    def __init__(self, assignments: dict, calculate_one: Callable):
+        self.assignments = assignments
+        self._calculate_one = calculate_one
+
+        # gradingTool.json's names are case-insensitive (and the config hands them back lower-cased),
+        # so everything here uses the name exactly as it comes out of assignments
+        self._names = {name.casefold(): name for name in assignments}
+
+        # JSON name -> JSON name of the assignment it's relative to (only for the ones that are)
+        self.depends_on = dict()
+        # JSON name -> due date (or error message)
+        self._resolved = dict()
+
+        for name, assign_info in assignments.items():
+            base = self._base_assignment_name(assign_info)
+            if base is None:
+                continue
+            if base.casefold() not in self._names:
+                self._resolved[name] = f"Couldn't determine due date of {self._display_name(name)} because we could not find \"{base}\" in gradingTool.json"
+            else:
+                self.depends_on[name] = self._names[base.casefold()]
+
+        self.order = self._sort()
+        self._report_cycles()
+
+    @staticmethod
+    def _base_assignment_name(assign_info):
+        relative_to = assign_info.get('due_date', {}).get('relative_to', {})
+        if relative_to.get('type') != "ASSIGNMENT":
+            return None
+        return relative_to.get('assignment_name')
+
+    def _display_name(self, name):
+        return self.assignments[name].get('name', name)
+
+    # Kahn's algorithm: start with the assignments that don't depend on anything (that can be resolved),
+    # then add each assignment once the one it depends on has been added
+    def _sort(self) -> list:
+        dependents = dict()
+        for name, base in self.depends_on.items():
+            dependents.setdefault(base, list()).append(name)
+
+        ready = deque(name for name in self.assignments if name not in self.depends_on)
+        order = list()
+        while ready:
+            name = ready.popleft()
+            order.append(name)
+            ready.extend(dependents.get(name, ()))
+        return order
+
+    # Every assignment that didn't make it into the sorted order is in a loop, or depends on one
+    def _report_cycles(self):
+        unsorted = set(self.assignments) - set(self.order)
+        for start in sorted(unsorted):
+            # Follow the chain until it comes back around to something we've already seen
+            # (or reaches a loop that's already been reported)
+            path = list()
+            name = start
+            while name not in path and name not in self._resolved:
+                path.append(name)
+                name = self.depends_on[name]
+            if name not in path:
+                continue
+
+            loop = path[path.index(name):] + [name]
+            sz_loop = " -> ".join(loop)
+            printError(f"The due dates in gradingTool.json depend on each other in a loop: {sz_loop}")
+            for name in loop[:-1]:
+                self._resolved[name] = f"Couldn't determine due date of {self._display_name(name)} because it's part of a loop: {sz_loop}"
+        # Whatever leads into a loop will be resolved (to an error message) the same way as everything else
+
+    # Returns the due date (datetime) for the assignment, or a str error message.
+    # Anything it depends on gets resolved first (and remembered)
+    def due_date(self, name: str):
+        name = self._names.get(name.casefold(), name)
+        chain = list()
+        next_name = name
+        while next_name not in self._resolved:
+            chain.append(next_name)
+            if next_name not in self.depends_on:
+                break
+            next_name = self.depends_on[next_name]
+
+        for unresolved in reversed(chain):
+            self._resolved[unresolved] = self._resolve_one(unresolved)
+        return self._resolved[name]
+
+    def _resolve_one(self, name: str):
+        base = self.depends_on.get(name)
+        if base is None:
+            return self._calculate_one(self.assignments[name], None)
+
+        base_due_date = self._resolved[base]
+        if isinstance(base_due_date, str):
+            return f"Couldn't determine due date of {self._display_name(name)} because of a problem with {base}:\n" + base_due_date
+        return self._calculate_one(self.assignments[name], base_due_date)
+
+    # JSON name -> due date (or error message), for every assignment, worked out in dependency order
+    def resolve_all(self) -> dict:
+        for name in list(self.order) + sorted(set(self.assignments) - set(self.order)):
+            self.due_date(name)
+        return {name: self._resolved[name] for name in self.assignments}
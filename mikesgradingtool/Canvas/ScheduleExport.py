@@ -0,0 +1,229 @@
+import datetime
+import json
+import os
+import uuid
+from collections import namedtuple
+
+from colorama import Fore, Style
+
+from mikesgradingtool.utils.print_utils import printError
+
+# The schedule that calculate_all_due_dates works out, written out WITHOUT talking to Canvas:
+#   .json - for comparing against the next export (and for anything else that wants the due dates)
+#   .ics  - for importing into a calendar
+#
+# A schedule is a plain dict, so that it can go straight into (and come back out of) the .json file:
+#   {'time_zone': 'America/Los_Angeles',
+#    'first_day_of_quarter': '2025-01-06',
+#    'last_day_of_quarter': '2025-03-21',
+#    'courses': {'142': {'assignments': {<JSON name>: {'name': <Canvas name>,
+#                                                      'due_at': '2025-01-13T23:59:00-08:00' (or None),
+#                                                      'error': None (or the reason there's no due date)}},
+#                        'noninstructional_days': [{'date': '2025-01-20', 'title': 'MLK Day'}]}}}
+# An assignment with neither a due_at nor an error is one that gradingTool.json says has NO_DUE_DATE.
+#
+# Nothing in the schedule depends on when it was exported, so exporting the same due dates twice
+# gives exactly the same .json file
+
+# One assignment whose due date is different from the last export.
+# old/new are the assignment's entries in the schedule (old is None if it's new, new is None if it's gone)
+schedule_difference = namedtuple('schedule_difference', 'course assignment old new')
+# One noninstructional day (that the course would otherwise have met on) that was added, removed, or renamed.
+# old/new are the day's entries in the schedule (None if it wasn't / isn't there any more)
+noninstructional_difference = namedtuple('noninstructional_difference', 'course date old new')
+
+ICS_PRODID = "-//mikesgradingtool//Due dates//EN"
+# RFC 5545 lines can't be longer than this (in bytes, not counting the CRLF)
+ICS_MAX_LINE_LENGTH = 75
+
+
+def assignment_entry(canvas_name: str, due_date) -> dict:
+    if isinstance(due_date, datetime.datetime):
+        return {'name': canvas_name, 'due_at': due_date.isoformat(), 'error': None}
+    return {'name': canvas_name, 'due_at': None, 'error': due_date}
+
+
+# Returns the schedule from the last export, or None if there isn't one (or it can't be read)
+def load_schedule_json(fp_json: str):
+    if not os.path.exists(fp_json):
+        return None
+    try:
+        with open(fp_json, encoding='utf-8') as inp:
+            schedule = json.load(inp)
+    except (OSError, ValueError) as e:
+        printError(f"Couldn't read the previously exported schedule ({fp_json}): {e}")
+        return None
+    if not isinstance(schedule, dict) or not isinstance(schedule.get('courses'), dict):
+        printError(f"{fp_json} doesn't look like an exported schedule - ignoring it")
+        return None
+    return schedule
+
+
+# Written next to the old file, and then put in its place, so that a half-written file never replaces the last export
+def _write_file(fp: str, text: str, newline: str = None):
+    fp_tmp = f"{fp}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(fp_tmp, mode='w', encoding='utf-8', newline=newline) as out:
+            out.write(text)
+        os.replace(fp_tmp, fp)
+    finally:
+        if os.path.exists(fp_tmp):
+            os.remove(fp_tmp)
+
+
+def write_schedule_json(fp_json: str, schedule: dict):
+    _write_file(fp_json, json.dumps(schedule, indent=4) + "\n")
+
+
+def _ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+# Long lines are split up, with each continuation line starting with a space
+def _ics_fold(line: str) -> list:
+    folded = list()
+    current, current_len = "", 0
+    for ch in line:
+        ch_len = len(ch.encode('utf-8'))
+        # continuation lines lose one byte to the leading space
+        limit = ICS_MAX_LINE_LENGTH - (1 if folded else 0)
+        if current_len + ch_len > limit:
+            folded.append(current)
+            current, current_len = "", 0
+        current += ch
+        current_len += ch_len
+    folded.append(current)
+    return [folded[0]] + [" " + part for part in folded[1:]]
+
+
+def _ics_utc(dt: datetime.datetime) -> str:
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+# One event for each assignment that has a due date (starting & ending at the due date),
+# and an all-day event for each noninstructional day that a course would otherwise have met on.
+# Times are in UTC, so the file doesn't need to describe the time zone
+def write_schedule_ics(fp_ics: str, schedule: dict):
+    dtstamp = _ics_utc(datetime.datetime.now(datetime.timezone.utc))
+    lines = ["BEGIN:VCALENDAR",
+             "VERSION:2.0",
+             f"PRODID:{ICS_PRODID}",
+             "CALSCALE:GREGORIAN",
+             "METHOD:PUBLISH",
+             f"X-WR-CALNAME:{_ics_escape('Due dates: ' + ', '.join(schedule['courses']))}"]
+
+    for course_name, course_schedule in schedule['courses'].items():
+        for assign_name, entry in course_schedule['assignments'].items():
+            if entry['due_at'] is None:
+                continue
+            lines += ["BEGIN:VEVENT",
+                      f"UID:{_ics_escape(f'{course_name}-{assign_name}')}@mikesgradingtool",
+                      f"DTSTAMP:{dtstamp}",
+                      f"DTSTART:{_ics_utc(datetime.datetime.fromisoformat(entry['due_at']))}",
+                      "SUMMARY:" + _ics_escape(f"{course_name}: {entry['name']} due"),
+                      "END:VEVENT"]
+
+        for noninst_day in course_schedule['noninstructional_days']:
+            day = datetime.date.fromisoformat(noninst_day['date'])
+            lines += ["BEGIN:VEVENT",
+                      f"UID:{_ics_escape(f'{course_name}-noninstructional-{day.isoformat()}')}@mikesgradingtool",
+                      f"DTSTAMP:{dtstamp}",
+                      f"DTSTART;VALUE=DATE:{day.strftime('%Y%m%d')}",
+                      f"DTEND;VALUE=DATE:{(day + datetime.timedelta(days=1)).strftime('%Y%m%d')}",
+                      f"SUMMARY:{_ics_escape(f'{course_name}: No class - ' + noninst_day['title'])}",
+                      "TRANSP:TRANSPARENT",
+                      "END:VEVENT"]
+
+    lines.append("END:VCALENDAR")
+    folded = [part for line in lines for part in _ics_fold(line)]
+    _write_file(fp_ics, "\r\n".join(folded) + "\r\n", newline='')
+
+
+def _noninstructional_days_by_date(course_schedule: dict) -> dict:
+    days = dict()
+    for noninst_day in course_schedule.get('noninstructional_days', []):
+        days.setdefault(noninst_day['date'], noninst_day)
+    return days
+
+
+# Compares two schedules, assignment by assignment and then noninstructional day by noninstructional day
+# (courses that are exactly the same are skipped over entirely).
+# Returns a list of schedule_difference & noninstructional_difference, in the order the courses, assignments,
+# and days are in the schedules
+def diff_schedules(old: dict, new: dict) -> list:
+    differences = list()
+    old_courses, new_courses = old['courses'], new['courses']
+
+    for course_name in list(new_courses) + [name for name in old_courses if name not in new_courses]:
+        old_course, new_course = old_courses.get(course_name, {}), new_courses.get(course_name, {})
+        if old_course == new_course:
+            continue
+
+        old_assignments = old_course.get('assignments', {})
+        new_assignments = new_course.get('assignments', {})
+        for assign_name in list(new_assignments) + [name for name in old_assignments if name not in new_assignments]:
+            old_entry = old_assignments.get(assign_name)
+            new_entry = new_assignments.get(assign_name)
+            if old_entry != new_entry:
+                differences.append(schedule_difference(course_name, assign_name, old_entry, new_entry))
+
+        old_days = _noninstructional_days_by_date(old_course)
+        new_days = _noninstructional_days_by_date(new_course)
+        for date in list(new_days) + [date for date in old_days if date not in new_days]:
+            old_day, new_day = old_days.get(date), new_days.get(date)
+            if old_day != new_day:
+                differences.append(noninstructional_difference(course_name, date, old_day, new_day))
+
+    return differences
+
+
+def describe_entry(entry: dict, time_zone) -> str:
+    if entry['due_at'] is not None:
+        due_date = datetime.datetime.fromisoformat(entry['due_at']).astimezone(time_zone)
+        return due_date.strftime("%a, %b %d, %Y at %I:%M %p")
+    if entry['error'] is not None:
+        return "ERROR: " + entry['error'].splitlines()[0]
+    return "NO_DUE_DATE"
+
+
+def print_schedule_differences(old: dict, new: dict, differences: list, time_zone):
+    for key in ('first_day_of_quarter', 'last_day_of_quarter', 'time_zone'):
+        if old.get(key) != new.get(key):
+            print(f"\t{key} changed: {old.get(key)} -> {new.get(key)}")
+
+    if len(differences) == 0:
+        print("\tNo due dates or noninstructional days have changed since the last export")
+        return
+
+    for diff in differences:
+        if isinstance(diff, noninstructional_difference):
+            _print_noninstructional_difference(diff)
+            continue
+
+        label = f"{diff.course}: {(diff.new or diff.old)['name']}".ljust(50)
+        if diff.old is None:
+            print(Fore.GREEN + f"\t+ {label}" + Style.RESET_ALL + f" {describe_entry(diff.new, time_zone)}")
+        elif diff.new is None:
+            print(Fore.RED + f"\t- {label}" + Style.RESET_ALL + f" {describe_entry(diff.old, time_zone)}")
+        else:
+            change = f"{describe_entry(diff.old, time_zone)} -> {describe_entry(diff.new, time_zone)}"
+            if diff.old['due_at'] is not None and diff.new['due_at'] is not None:
+                old_day = datetime.datetime.fromisoformat(diff.old['due_at']).astimezone(time_zone).date()
+                new_day = datetime.datetime.fromisoformat(diff.new['due_at']).astimezone(time_zone).date()
+                change += f" ({(new_day - old_day).days:+d} days)"
+            print(Fore.YELLOW + f"\t~ {label}" + Style.RESET_ALL + f" {change}")
+
+    num_due_dates = sum(1 for diff in differences if isinstance(diff, schedule_difference))
+    num_days = len(differences) - num_due_dates
+    print(f"\t{num_due_dates} due dates and {num_days} noninstructional days changed since the last export")
+
+
+def _print_noninstructional_difference(diff: noninstructional_difference):
+    day = datetime.date.fromisoformat(diff.date).strftime("%a, %b %d, %Y")
+    label = f"{diff.course}: No class on {day}".ljust(50)
+    if diff.old is None:
+        print(Fore.GREEN + f"\t+ {label}" + Style.RESET_ALL + f" {diff.new['title']}")
+    elif diff.new is None:
+        print(Fore.RED + f"\t- {label}" + Style.RESET_ALL + f" {diff.old['title']}")
+    else:
+        print(Fore.YELLOW + f"\t~ {label}" + Style.RESET_ALL + f" {diff.old['title']} -> {diff.new['title']}")
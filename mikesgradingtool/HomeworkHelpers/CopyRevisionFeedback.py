@@ -35,56 +35,15 @@ def CopyRevisionFeedback(src, dest):
     # Get a list of the revised submissions
     #    (DO rearrange them nicely)
     newSubs = ConsolidateSubmissions(dest)
-    logger.debug("New Submissions: " + originalSubs.strShort())
+    logger.debug("New Submissions: " + newSubs.strShort())
 
-    print("\nCopying original to revision directory for:")
-    for (name, newSubList) in list(newSubs.subLists.items()):
-        origSubmissions = []
-        logger.debug("NEW SUBMISSION from: " + name +
-                     " sublist: " + str(newSubList))
-
-        for (name, origSubList) in list(originalSubs.subLists.items()):
-            logger.debug("Original submission from " + name +
-                         ": origSubList: " + str(origSubList))
-            if origSubList.mostRecent.feedbackFilePath is not None:
-                # if orig submission contains the same last name as the new, revised submission,
-                # then add all the feedback files to the list
-                tempAllSubs = list(origSubList.previousSubmissions)
-                tempAllSubs.append(origSubList.mostRecent)
-                # logger.debug("tempAllSubs: " + str(tempAllSubs) )
-
-                logger.debug("comparing " + origSubList.mostRecent.getLastName_c() + " to " + newSubList.mostRecent.getLastName_c(
-                ) + " and " + origSubList.mostRecent.getFirstName_c() + " to " + newSubList.mostRecent.getFirstName_c())
-
-                if newSubList.mostRecent.getLastName_c() == origSubList.mostRecent.getLastName_c() \
-                        and newSubList.mostRecent.getFirstName_c() == origSubList.mostRecent.getFirstName_c():
-
-                    logger.debug("copying from\n" + str(origSubList.mostRecent.feedbackFilePath) +
-                                 "\nto\n" + newSubList.mostRecent.path)
-
-                    filtered_older = (olderSubmission.feedbackFilePath
-                                      for olderSubmission
-                                      in tempAllSubs
-                                      if olderSubmission.feedbackFilePath is not None)
-
-                    check_for_multiple_feedback_files = []
-                    check_for_multiple_feedback_files.extend(filtered_older)
-
-                    if isinstance(check_for_multiple_feedback_files, list) \
-                            and isinstance(check_for_multiple_feedback_files[0], list):
-                        print(("Found nested feedback files for " + name))
-                        check_for_multiple_feedback_files = \
-                            check_for_multiple_feedback_files[0]
-                        
-                    logger.debug("check_for_multiple_feedback_files: " +
-                                 "\n\t".join(check_for_multiple_feedback_files))
-
-                    logger.debug("BEFORE ADDING: " + str(origSubmissions))
-
-                    origSubmissions.extend(check_for_multiple_feedback_files)
-
-                    logger.debug("AFTER ADDING: " + str(origSubmissions))
+    matches = _join_revisions_to_originals(originalSubs, newSubs)
+    logger.debug(f"{sum(1 for _, orig in matches if len(orig) == 1)} matched, "
+                 f"{sum(1 for _, orig in matches if len(orig) > 1)} matched multiple originals, "
+                 f"{sum(1 for _, orig in matches if not orig)} without an original")
 
+    print("\nCopying original to revision directory for:")
+    for (newSubList, origSubmissions) in matches:
         if not origSubmissions:
             print((Fore.RED + Style.BRIGHT + "=>" + Style.RESET_ALL + Style.BRIGHT +
                    "  {0:<20} did not have an original version!".format(newSubList.mostRecent.getFullName()) + Style.RESET_ALL))
@@ -105,6 +64,40 @@ def CopyRevisionFeedback(src, dest):
     print(("(" + str(len(newSubs.subLists)) + " directories)"))
 
 
+# Index the original feedback files by (last, first) name, once
+# Returns { (last, first): [feedback file paths] }
+def _index_original_feedback(originalSubs):
+    feedback_by_name = dict()
+
+    for (name, origSubList) in list(originalSubs.subLists.items()):
+        if origSubList.mostRecent.feedbackFilePath is None:
+            continue
+
+        feedback_files = feedback_by_name.setdefault(origSubList.mostRecent.getNameKey_c(), list())
+        for olderSubmission in origSubList.previousSubmissions + [origSubList.mostRecent]:
+            if olderSubmission.feedbackFilePath is None:
+                continue
+            # feedbackFilePath is a list if there was more than one feedback file in the folder
+            if isinstance(olderSubmission.feedbackFilePath, list):
+                print(("Found nested feedback files for " + name))
+                feedback_files.extend(olderSubmission.feedbackFilePath)
+            else:
+                feedback_files.append(olderSubmission.feedbackFilePath)
+
+    return feedback_by_name
+
+
+# Pair each revised submission up with the original feedback files for the same student
+# Returns a list of (newSubList, [original feedback files]), in the same order as newSubs.
+# The list of feedback files is empty if the student didn't have an original version,
+# and has more than one file if they matched multiple originals
+def _join_revisions_to_originals(originalSubs, newSubs):
+    feedback_by_name = _index_original_feedback(originalSubs)
+
+    return [(newSubList, feedback_by_name.get(newSubList.mostRecent.getNameKey_c(), []))
+            for newSubList in newSubs.subLists.values()]
+
+
 def MoveFeedbackTo(origFeedback, newSub, renameOrSubdir):
     if isinstance(renameOrSubdir, str):
         rename = False
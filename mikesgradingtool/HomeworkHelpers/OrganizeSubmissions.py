@@ -1,5 +1,6 @@
 from mikesgradingtool.SubmissionHelpers.StudentSubmissionListCollection import \
     StudentSubmissionListCollection
+from mikesgradingtool.SubmissionHelpers.SubmissionMovePlan import SubmissionMovePlan
 
 from mikesgradingtool.utils.my_logging import get_logger
 logger = get_logger(__name__)
@@ -76,17 +77,21 @@ TODO: Use genexps/listcomprehensions to walk through collections easily?  This w
 '''
 
 
-def OrganizeSubmissions(dirToOrg):
-    newSubs = ConsolidateSubmissions(dirToOrg)
+def OrganizeSubmissions(dirToOrg, dry_run=False, max_workers=None):
+    newSubs = ConsolidateSubmissions(dirToOrg, dry_run, max_workers)
     logger.info("Organized submissions: " + str(newSubs))
 
+    if dry_run:
+        return
+
     print('\nOrganized submissions into the following directories:')
     for (name, newSubList) in list(newSubs.subLists.items()):
         print("\t" + name)
     print("(" + str(len(newSubs.subLists)) + " directories)")
 
 
-def ConsolidateSubmissions(srcPath):
+# If dry_run is True then the moves are printed out, but nothing is moved
+def ConsolidateSubmissions(srcPath, dry_run=False, max_workers=None):
     logger.info(f"Told to consolidate {srcPath}")
     # OS.WALK through basedir & all subdirs
     #    If *dir* appears to be a student submission
@@ -97,42 +102,17 @@ def ConsolidateSubmissions(srcPath):
     logger.info("Starting directories:" + str(allSubs))
 # Move all the most recent submissions to the base directory
 #    (then fix up anything else that happened to be in one of the moved dirs)
-# Iterate through StudentSubmissionListCollection:
-#    Iterate through each StudentSubmissionList:
-#        move the most recent dir to the basedir directory w/
-#                           StudentSubmissionList.MoveTo(SS, dir)
-#            StudentSubmissionList.MoveTo will update the most recent dir to
-#                  the new location
-#            StudentSubmissionList.MoveTo will fixup all other SS's, as needed
 # III: At this point, all the 'most recent submission' dirs are in-place
 #
-#    allSubs.Rebase(srcPath)
-    logger.info(f"Moving most recent subs to srcPath ({srcPath})")
-    for studentName, aList in list(allSubs.subLists.items()):
-        oldLoc = aList.mostRecent.path
-        logger.info(f"for {studentName}, moving most recent sub ({oldLoc})" +
-                    f" to srcPath ({srcPath})")
-        if aList.mostRecent.moveTo(srcPath):
-            allSubs.fixup(oldLoc, aList.mostRecent.path)
-#
 #    iterate through the list of submitted dirs:
 #        if submitted dir is not already inside the most recent dir
 #            Move that dir into the most recent dir
 #
-# Iterate through StudentSubmissionList:
-    logger.info(
-        "For each student: Moving older subs to the most recent sub's dir")
-    for studentName, aList in list(allSubs.subLists.items()):
-        logger.info(f"Adjusting {studentName}")
-        for prevSub in aList.previousSubmissions:
-            oldLoc = prevSub.path
-            logger.info(f"Moving from oldLoc ({oldLoc}) to most recent sub " +
-                        f"({aList.mostRecent.path})")
-            if prevSub.moveTo(aList.mostRecent.path):
-                allSubs.fixup(oldLoc, prevSub.path)
-            # moveTo will print out the error message
-            # else:
-            #    print "Found a duplicate for ",studentName, " at ", oldLoc
-            #    print "\t *********** couldn't move! "
+# All of the moves are planned out first (see SubmissionMovePlan), and then carried out
+    plan = SubmissionMovePlan(allSubs, srcPath)
+    if dry_run:
+        plan.print_plan()
+        return allSubs
 
+    plan.execute(allSubs, max_workers)
     return allSubs
@@ -1,8 +1,6 @@
 #
 #
 import datetime
-import difflib
-import functools
 import os
 import re
 import shutil
@@ -11,13 +9,19 @@ import typing
 from pathlib import Path
 
 import keyboard
+from colorama import Fore, Style
 
+from mikesgradingtool.HomeworkHelpers.OrganizeSubmissions import OrganizeSubmissions
+from mikesgradingtool.MiscFiles.NameMatcher import NameMatcher
+from mikesgradingtool.MiscFiles.TemplateCopier import TemplateCopier
 from mikesgradingtool.SubmissionHelpers.StudentSubmission import StudentSubmission
 from mikesgradingtool.SubmissionHelpers.StudentSubmissionListCollection import StudentSubmissionListCollection
 from mikesgradingtool.utils.config_json import get_app_config
-from mikesgradingtool.utils.misc_utils import cd, UniqueFileName, is_file_locked, lock_file
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot
+from mikesgradingtool.utils.misc_utils import cd, get_lock_status
 from mikesgradingtool.utils.my_logging import get_logger
-from mikesgradingtool.utils.print_utils import GradingToolError
+from mikesgradingtool.utils.naming_rules import get_naming_rules
+from mikesgradingtool.utils.print_utils import GradingToolError, print_color, printError
 
 logger = get_logger(__name__)
 
@@ -47,7 +51,7 @@ def fn_misc_files_copy_to_subdir(args):
 
     c_student_included, c_copied_included = 0, 0
     if len(sub_dirs) > 0:
-        c_student_included, c_copied_included = copy_template_to_path_list(fpTemplate, sub_dirs)
+        c_student_included, c_copied_included = copy_template_to_path_list(fpTemplate, sub_dirs, args.JOBS)
     else:
         print(Fore.YELLOW + "Couldn't find any subdirs to copy the template into" + Style.RESET_ALL)
 
@@ -66,35 +70,20 @@ def fn_misc_files_copy_template(args):
         "canvas/InstructorFeedbackFileNameRegex"])
     print("Template file:\n\t" + fpTemplate)
     print("\nCopying template for:")
-    c_students, c_copied = copy_template_to_regex_matches(fp_CopyTemplateToHere, fpTemplate, sz_re_feedback_file)
+    c_students, c_copied = copy_template_to_regex_matches(fp_CopyTemplateToHere, fpTemplate, sz_re_feedback_file, args.JOBS)
     print(f"\nFound a total of {c_students} feedback files\n\tCopied the template into {c_copied} of those files")
 
 
 def ignore_this_file(fp_file):
-    config = get_app_config()
-    fnBackups, alreadyCopiedSuffix = config.verify_keys([
-        "misc_files/BackupDirName",
-        "misc_files/FileAlreadyProcessedMarker",
-    ])
-
-    if fnBackups in fp_file \
-        or alreadyCopiedSuffix in fp_file:
-        return True
-    else:
-        return False
+    return get_naming_rules().is_backup_or_lock_file(fp_file)
 
 
-def copy_template_to_path_list(fpTemplate, rg_fp_target_files: typing.List[str]):
+def copy_template_to_path_list(fpTemplate, rg_fp_target_files: typing.List[str], max_workers: int = None):
     # ""
     #
     # Note: the files listed in the target list may or may not already exist
     # ""
 
-    config = get_app_config()
-    fnBackups = config.verify_keys([
-        "misc_files/BackupDirName"
-    ])
-
     fpTemplate = os.path.abspath(fpTemplate)
     if not os.path.exists(fpTemplate):
         raise GradingToolError("Template file to copy doesn't exist:\n\t"+fpTemplate)
@@ -102,52 +91,44 @@ def copy_template_to_path_list(fpTemplate, rg_fp_target_files: typing.List[str])
     if not os.path.isfile(fpTemplate):
         raise GradingToolError("Template 'file' to copy is not actually a file:\n\t" + fpTemplate)
 
+    already_locked = get_lock_status(rg_fp_target_files)
+
+    # Put this in when I was worried about overwriting a graded assignment.
+    # Keeping it in case I ever want it back:
+    #   pass fp_backup_dir=os.path.join(os.path.dirname(destFile), fnBackups) to copier.submit
+    with TemplateCopier(fpTemplate, max_workers) as copier:
+        for destFile in rg_fp_target_files:
+            if not already_locked[destFile]:
+                copier.submit(destFile)
+
+        return _print_template_copy_outcomes(rg_fp_target_files, already_locked, copier.outcomes())
+
+
+# Print what happened to each file, in the same order as the files were given to us
+# Returns (# of files, # of files that the template was copied into)
+def _print_template_copy_outcomes(rg_fp_target_files, already_locked, outcomes):
     c_copied = 0
     c_students = 0
 
-    # files now contains exactly and only the files we want to process:
     for destFile in rg_fp_target_files:
-
-        # The philosophy here is that
-        # it's worse to change the file and NOT create the lock file
-        # instead of
-        # creating the lock file and then being unable to change the file and unable to remove the lock file
-
         c_students = c_students + 1
-        if is_file_locked(destFile):
-            print("Already copied: " + os.path.basename(destFile))
+        file = os.path.basename(destFile)
+
+        if already_locked[destFile]:
+            print("Already copied: " + file)
             continue
+
+        outcome = next(outcomes)
+        print(("                {0:<20}".format(file)))
+        if outcome.copied:
+            c_copied = c_copied + 1
         else:
-            # Create the 'lock' file:
-            fp_lock_file = lock_file(destFile)
-
-            try:
-                file = os.path.basename(destFile)
-
-                # Put this in when I was worried about overwriting a graded assignment.
-                # Keeping it in case I ever want it back
-                # if os.path.exists(destFile):
-                #     # Create the backup copy:
-                #     fpBackups = os.path.join(os.path.dirname(destFile), fnBackups)
-                #     Path(fpBackups).mkdir(parents=True, exist_ok=True)
-                #     fpBackupFile = os.path.join(fpBackups, file)
-                #     fpBackupFile = UniqueFileName(fpBackupFile, startWithSuffix=True)
-                #     shutil.copy2(destFile, fpBackupFile)
-
-                # replace the feedback file  with the grading rubric/template:
-                print(("                {0:<20}".format(file)))
-                shutil.copy2(fpTemplate, destFile)
-
-                c_copied = c_copied + 1
-            except BaseException as e:
-                # If anything went wrong then remove the 'lock' file, so we'll try again later
-                os.remove(fp_lock_file)
-                print(e.args)
+            print(outcome.error.args)
 
     return (c_students, c_copied)
 
 
-def copy_template_to_regex_matches(fp_CopyTemplateToHere, fpTemplate, sz_re_files_to_replace):
+def copy_template_to_regex_matches(fp_CopyTemplateToHere, fpTemplate, sz_re_files_to_replace, max_workers: int = None):
 
     config = get_app_config()
     fnBackups, alreadyCopiedSuffix = config.verify_keys([
@@ -169,53 +150,28 @@ def copy_template_to_regex_matches(fp_CopyTemplateToHere, fpTemplate, sz_re_file
         print("Directory to copy the templates to:\n\t" + fp_CopyTemplateToHere)
 
         print("\nCopying template for:")
-        c_copied = 0
-        c_students = 0
 
-        for root, dirs, raw_file_list in os.walk(fp_CopyTemplateToHere):
+        rg_fp_target_files = list()
+        for root, dirs, raw_file_list in get_dir_snapshot().walk(fp_CopyTemplateToHere):
             # Don't traverse our own backup dirs :)
             if fnBackups in dirs:
                 dirs.remove(fnBackups)
 
             # Only process the files that contain INSTRUCTORFEEDBACK,
             # But don't process our lock files
-            files = [file for file in raw_file_list if re_files_to_replace.search(file)
-                                                       and alreadyCopiedSuffix not in file]
-
-            # files now contains exactly and only the files we want to process:
-            for file in files:
-                destFile = os.path.join(root, file)
-
-                # The philosophy here is that
-                # it's worse to change the file and NOT create the lock file
-                # instead of
-                # creating the lock file and then being unable to change the file and unable to remove the lock file
-
-                c_students = c_students + 1
-                if is_file_locked(destFile):
-                    print("Already copied: " + file)
-                    continue
-                else:
-                    # Create the 'lock' file:
-                    fp_lock_file = lock_file(destFile)
-
-                    try:
-                        # Create the backup copy:
-                        fpBackups = os.path.join(root, fnBackups)
-                        Path(fpBackups).mkdir(parents=True, exist_ok=True)
-                        fpBackupFile = os.path.join(fpBackups, file)
-                        fpBackupFile = UniqueFileName(fpBackupFile, startWithSuffix=True)
-                        shutil.copy2(destFile, fpBackupFile)
-
-                        # replace the feedback file  with the grading rubric/template:
-                        print(("                {0:<20}".format(file)))
-                        shutil.copy2(fpTemplate, destFile)
-
-                        c_copied = c_copied + 1
-                    except BaseException as e:
-                        # If anything went wrong then remove the 'lock' file, so we'll try again later
-                        os.remove(fp_lock_file)
-                        print(e.args)
+            rg_fp_target_files.extend(os.path.join(root, file) for file in raw_file_list
+                                      if re_files_to_replace.search(file) and alreadyCopiedSuffix not in file)
+
+        already_locked = get_lock_status(rg_fp_target_files)
+
+        # rg_fp_target_files now contains exactly and only the files we want to process:
+        with TemplateCopier(fpTemplate, max_workers) as copier:
+            for destFile in rg_fp_target_files:
+                if not already_locked[destFile]:
+                    # Back up the existing file, then replace it with the grading rubric/template:
+                    copier.submit(destFile, fp_backup_dir=os.path.join(os.path.dirname(destFile), fnBackups))
+
+            c_students, c_copied = _print_template_copy_outcomes(rg_fp_target_files, already_locked, copier.outcomes())
 
     # wordapp.Visible = wasVisible
     return (c_students, c_copied)
@@ -403,72 +359,16 @@ def autograder_common_actions(args, sz_glob_student_submission_dir, fn_organize_
           TotalDuration + "\n")
 
 
-# From https://www.geeksforgeeks.org/print-longest-common-substring/
-def LCSubStr(X: str, Y: str):
-    return getLCSSubStr(X, Y, len(X), len(Y))
-
-def getLCSSubStr(X: str, Y: str,
-                   m: int, n: int):
-    # Create a table to store lengths of
-    # longest common suffixes of substrings.
-    # Note that LCSuff[i][j] contains length
-    # of longest common suffix of X[0..i-1] and
-    # Y[0..j-1]. The first row and first
-    # column entries have no logical meaning,
-    # they are used only for simplicity of program
-    LCSuff = [[0 for i in range(n + 1)]
-              for j in range(m + 1)]
-
-    # To store length of the
-    # longest common substring
-    length = 0
-
-    # To store the index of the cell
-    # which contains the maximum value.
-    # This cell's index helps in building
-    # up the longest common substring
-    # from right to left.
-    row, col = 0, 0
-
-    # Following steps build LCSuff[m+1][n+1]
-    # in bottom up fashion.
-    for i in range(m + 1):
-        for j in range(n + 1):
-            if i == 0 or j == 0:
-                LCSuff[i][j] = 0
-            elif X[i - 1] == Y[j - 1]:
-                LCSuff[i][j] = LCSuff[i - 1][j - 1] + 1
-                if length < LCSuff[i][j]:
-                    length = LCSuff[i][j]
-                    row = i
-                    col = j
-            else:
-                LCSuff[i][j] = 0
-
-    # if true, then no common substring exists
-    if length == 0:
-        print("No Common Substring")
-        return
-
-    # allocate space for the longest
-    # common substring
-    resultStr = ['0'] * length
+def fn_misc_files_organize_submissions(args):
+    fp_src = args.SRC
+    if not os.path.isdir(fp_src):
+        raise GradingToolError(F"SRC argument is not a dir ({fp_src})")
 
-    # traverse up diagonally form the
-    # (row, col) cell until LCSuff[row][col] != 0
-    while LCSuff[row][col] != 0:
-        length -= 1
-        resultStr[length] = X[row - 1]  # or Y[col-1]
+    if args.DRY_RUN:
+        print(f"Dry run: listing the folders that would be moved in {fp_src} (nothing will be moved)\n")
+    OrganizeSubmissions(fp_src, args.DRY_RUN, getattr(args, 'JOBS', None))
 
-        # move diagonally up to previous cell
-        row -= 1
-        col -= 1
 
-    # required longest common substring
-    return ''.join(resultStr)
-
-
-# end of function lcs
 def fn_misc_files_move_feedback_to_student_dirs(args):
     fp_from: str = args.SRC
     fp_to = args.DEST
@@ -490,10 +390,9 @@ def fn_misc_files_move_feedback_to_student_dirs(args):
     if not os.path.isdir(fp_to):
         raise GradingToolError(F"DEST argument is not a dir ({fp_to})")
 
-    _, _, rg_fn_feedback = next(os.walk(fp_from))
-    _, student_dirs, _ = next(os.walk(fp_to))
-
-    d_feedback = dict()
+    snapshot = get_dir_snapshot()
+    rg_fn_feedback = [e.name for e in snapshot.listing(fp_from).files]
+    matcher = NameMatcher(e.name for e in snapshot.listing(fp_to).dirs)
 
     print() # blank line
     if not move_with_confirmation:
@@ -501,38 +400,28 @@ def fn_misc_files_move_feedback_to_student_dirs(args):
         print(f"\t{dest_col}<File To Move>")
 
     for fn_feedback in rg_fn_feedback:
-#        print("Matching: " + fn_feedback)
-        # returns a 2-tuple: (student_dir_best_match, levenshtein_distance from fn_feedback)
-        def min_diff(min, next):
-            # print(f"min is: {str(min).ljust(50)}next is: {next}")
-
-            if isinstance(min, str):
-            #     seq = difflib.SequenceMatcher(None, min.lower(), fn_feedback.lower())
-            #     min = (min, seq.ratio())
-                subst = LCSubStr(min.lower(), fn_feedback.lower())
-                min = (min, len(subst))
-
-            # seq = difflib.SequenceMatcher(None, next.lower(), fn_feedback.lower())
-            # next = (next, seq.ratio())
-            subst = LCSubStr(next.lower(), fn_feedback.lower())
-            next = (next, len(subst))
-
-            if min[1] > next[1]:
-                return min
-            else:
-                return next
-
-        best_match = functools.reduce(min_diff, student_dirs)
- #       print("Best match: " + str(best_match))
+        best_match = matcher.best_match(fn_feedback)
 
         fn_feedbackd_quoted = '"' + fn_feedback + '"'
 
+        if best_match is None:
+            print_color(Fore.YELLOW, f"\tSkipping {fn_feedbackd_quoted}: it doesn't look like any of the student dirs")
+            continue
+
         if not move_with_confirmation:
-            print(f"\t{best_match[0].ljust(20)}{fn_feedbackd_quoted}")
+            # Don't guess: leave the file where it is, and let the instructor sort it out
+            if best_match.ambiguous:
+                print_color(Fore.YELLOW, f"\tSkipping {fn_feedbackd_quoted}: not sure if it's for "
+                                         f"{best_match.candidate} ({best_match.confidence:.0%} match) or "
+                                         f"{best_match.runner_up} ({best_match.runner_up_confidence:.0%} match)")
+                continue
+
+            print(f"\t{best_match.candidate.ljust(20)}{fn_feedbackd_quoted}")
             shutil.move(os.path.join(fp_from, fn_feedback), \
-                        os.path.join(fp_to, best_match[0]))
+                        os.path.join(fp_to, best_match.candidate))
         else:
-            print( f"Should I move: {fn_feedbackd_quoted} to: {best_match[0]}? (y/n)" )
+            print( f"Should I move: {fn_feedbackd_quoted} to: {best_match.candidate}? "
+                   f"({best_match.confidence:.0%} match{', AMBIGUOUS' if best_match.ambiguous else ''}) (y/n)" )
 
             e: keyboard.KeyboardEvent = keyboard.read_event()
             while( e.event_type != 'down'):
@@ -541,4 +430,4 @@ def fn_misc_files_move_feedback_to_student_dirs(args):
             # print(e.name)
             if e.name.lower() == 'y':
                 shutil.move(os.path.join(fp_from, fn_feedback), \
-                            os.path.join(fp_to, best_match[0]))
\ No newline at end of file
+                            os.path.join(fp_to, best_match.candidate))
@@ -0,0 +1,100 @@
+import re
+from collections import namedtuple
+
+# A match is only used without asking if at least this much of the student's name (0.0 - 1.0)
+# shows up in the file name...
+MIN_CONFIDENCE = 0.6
+
+# ... and it's at least this much better than the next-best student
+MIN_MARGIN = 0.1
+
+# Only the first this-many words of a file name get paired up (see _file_name_trigrams)
+MAX_WORDS_TO_PAIR = 12
+
+# What best_match returns.
+#   confidence is how much of the student's name is in the file name (0.0 - 1.0)
+#   runner_up / runner_up_confidence are the next-best student (None / 0.0 if there's only one student)
+#   ambiguous is True when the match isn't good enough (or isn't clear enough) to use without asking
+name_match = namedtuple('name_match', 'candidate confidence runner_up runner_up_confidence ambiguous')
+
+
+# Student folder names are often just the name run together ('smithjohn'), while file names have
+# spaces, underscores, commas, etc, so everything except the letters & digits is dropped before comparing
+def _normalize(name: str) -> str:
+    return re.sub(r'[^0-9a-z]+', '', name.casefold())
+
+
+# Just the student's name from a student folder name: the folders that download makes are named
+# <last>_<first>_<Canvas id>_FROM_CANVAS, and neither the id nor the suffix will be in a feedback file's name
+# (so counting them would keep even a perfect match well below MIN_CONFIDENCE).
+# Everything from the first all-digits word onwards is dropped
+def _folder_name_part(name: str) -> str:
+    words = re.split(r'[^0-9a-z]+', name.casefold())
+    name_words = list()
+    for word in words:
+        if word.isdigit():
+            break
+        name_words.append(word)
+    name_part = "".join(name_words)
+    return name_part if name_part else _normalize(name)
+
+
+def _trigrams(normalized: str) -> set:
+    if len(normalized) < 3:
+        return {normalized} if normalized else set()
+    return {normalized[i:i + 3] for i in range(len(normalized) - 2)}
+
+
+# The file name's trigrams, plus the trigrams of each pair of its words run together (in both orders),
+# so that 'John Smith.docx' and 'Smith, John.docx' both match the 'smithjohn' folder
+def _file_name_trigrams(name: str) -> set:
+    grams = _trigrams(_normalize(name))
+    words = [w for w in re.split(r'[^0-9a-z]+', name.casefold()) if w][:MAX_WORDS_TO_PAIR]
+    for first in words:
+        for second in words:
+            if first != second:
+                grams.update(_trigrams(first + second))
+    return grams
+
+
+# Matches file names (e.g., instructor feedback files) to the student (folder) names that they're for.
+#
+# The student names are split into trigrams (3-letter pieces) once, and put into an inverted index
+# (trigram -> students that contain it).  Matching a file name then only looks at the students who share at
+# least one trigram with it, instead of comparing the file name against every student one by one.
+#
+# A student's score is the fraction of their name's trigrams that show up in the file name, so the extra stuff
+# in a file name (assignment name, 'feedback', file extension, etc) doesn't count against anyone
+class NameMatcher:
+
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        self._trigram_counts = list()
+        self._index = dict()
+
+        for i, candidate in enumerate(self.candidates):
+            grams = _trigrams(_folder_name_part(candidate))
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._index.setdefault(gram, list()).append(i)
+
+    # Returns a name_match, or None if there's nothing at all in common with any of the candidates
+    def best_match(self, name: str):
+        shared = dict()
+        for gram in _file_name_trigrams(name):
+            for i in self._index.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        if not shared:
+            return None
+
+        scored = sorted(((count / self._trigram_counts[i], i) for i, count in shared.items()), reverse=True)
+
+        best_score, best = scored[0]
+        if len(scored) > 1:
+            runner_up_score, runner_up = scored[1]
+            runner_up_name = self.candidates[runner_up]
+        else:
+            runner_up_score, runner_up_name = 0.0, None
+
+        ambiguous = best_score < MIN_CONFIDENCE or best_score - runner_up_score < MIN_MARGIN
+        return name_match(self.candidates[best], best_score, runner_up_name, runner_up_score, ambiguous)
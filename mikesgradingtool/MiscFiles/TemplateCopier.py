@@ -0,0 +1,89 @@
+import os
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+from mikesgradingtool.utils.dir_snapshot import invalidate_dir_snapshot
+from mikesgradingtool.utils.misc_utils import UniqueFileName, lock_file
+from mikesgradingtool.utils.ordered_executor import OrderedExecutor, max_workers_from_config
+
+# Used when neither the command line nor gradingTool.json (misc_files/max_concurrent_copies)
+# say how many files to copy the template into at once
+DEFAULT_MAX_CONCURRENT_COPIES = 8
+
+# What happened to one target file.  error is None if the template was copied in
+copy_outcome = namedtuple('copy_outcome', 'fp_dest copied error')
+
+
+# Copies one template file into lots of target files, several at a time.
+#
+# The template is read into memory once, and then each target is written from that (instead of
+# re-opening and re-reading the template for each student).  When the student folders are in a synced
+# folder (Dropbox, OneDrive, etc) each write is slow, so most of the time is spent waiting on the file system.
+#
+# Each target still goes through the same steps as before:
+#   create the lock file, (optionally) back up the existing file, copy the template in,
+#   and if anything goes wrong then remove the lock file so we'll try again next time.
+class TemplateCopier:
+
+    def __init__(self, fpTemplate: str, max_workers: int = None):
+        self.max_workers = max_workers_from_config(max_workers, "misc_files/max_concurrent_copies",
+                                                   DEFAULT_MAX_CONCURRENT_COPIES)
+
+        self.fpTemplate = fpTemplate
+        with open(fpTemplate, mode='rb') as inp:
+            self._template_bytes = inp.read()
+
+        self._work = OrderedExecutor(self.max_workers, "template_copy")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Queue up a copy of the template into fp_dest.  If fp_backup_dir is given then whatever is
+    # currently in fp_dest gets backed up into that directory first
+    def submit(self, fp_dest: str, fp_backup_dir: str = None):
+        return self._work.submit(self._copy_one, fp_dest, fp_backup_dir)
+
+    def _copy_one(self, fp_dest: str, fp_backup_dir: str) -> copy_outcome:
+        # The philosophy here is that
+        # it's worse to change the file and NOT create the lock file
+        # instead of
+        # creating the lock file and then being unable to change the file and unable to remove the lock file
+        fp_lock_file = lock_file(fp_dest)
+
+        try:
+            if fp_backup_dir is not None:
+                Path(fp_backup_dir).mkdir(parents=True, exist_ok=True)
+                fpBackupFile = UniqueFileName(os.path.join(fp_backup_dir, os.path.basename(fp_dest)),
+                                              startWithSuffix=True)
+                shutil.copy2(fp_dest, fpBackupFile)
+
+            # replace the feedback file with the grading rubric/template
+            # (copystat does what copy2 would, for the timestamps & permissions)
+            with open(fp_dest, mode='wb') as out:
+                out.write(self._template_bytes)
+            shutil.copystat(self.fpTemplate, fp_dest)
+
+            return copy_outcome(fp_dest, True, None)
+        except Exception as e:
+            # If anything went wrong then remove the 'lock' file, so we'll try again later
+            # (if even that doesn't work then the copy is still reported as failed, and the lock file stays)
+            try:
+                os.remove(fp_lock_file)
+            except OSError:
+                pass
+            invalidate_dir_snapshot(fp_lock_file)
+            return copy_outcome(fp_dest, False, e)
+
+    # Yields a copy_outcome for each copy, as soon as it (and everything queued before it) is done.
+    # This lets the caller print its progress in the same order as before, while the copies run in the background
+    def outcomes(self):
+        for _, future in self._work.drain():
+            yield future.result()
+
+    def close(self):
+        self._work.close()
@@ -4,17 +4,21 @@ Created on Jun 18, 2012
 @author: MikePanitz
 '''
 import datetime
-import glob
+import fnmatch
 import os
 import pprint
 import re
 import shutil
 
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot
 from mikesgradingtool.utils.my_logging import get_logger
 from mikesgradingtool.utils.print_utils import printError
 
 logger = get_logger(__name__)
 
+# feedbackFilePath hasn't been looked for yet (see the feedbackFilePath property)
+_NOT_LOOKED_UP_YET = object()
+
 
 class StudentSubmission:
     # class static variables:
@@ -64,13 +68,49 @@ class StudentSubmission:
         pass
 
     def __str__(self):
-        return str(pprint.pformat(self.__dict__, width=200))
+        details = {k: v for k, v in self.__dict__.items() if k != '_feedbackFilePath'}
+        details['feedbackFilePath'] = self.feedbackFilePath
+        return str(pprint.pformat(details, width=200))
 
     def __eq__(self, other):
         if type(self) != type(other):
             return False
         return self.__dict__ == other.__dict__
 
+    # The feedback file(s) in the submission's folder are only looked for the first time that someone asks,
+    # (using the folder's listing from the shared directory snapshot), instead of globbing every
+    # submission folder while the submissions are being collected
+    @property
+    def feedbackFilePath(self):
+        if self._feedbackFilePath is _NOT_LOOKED_UP_YET:
+            self._feedbackFilePath = self._findFeedbackFiles()
+        return self._feedbackFilePath
+
+    @feedbackFilePath.setter
+    def feedbackFilePath(self, value):
+        self._feedbackFilePath = value
+
+    # Same as globbing for *lastname*.doc* in the submission's folder
+    def _findFeedbackFiles(self):
+        the_listing = get_dir_snapshot().listing(self.path)
+        if the_listing is None:
+            return None
+
+        pattern = "*" + self.lastName.lower() + "*.doc*"
+        fbFiles = [os.path.join(self.path, name) for name in sorted(the_listing.names)
+                   if not name.startswith('.') and fnmatch.fnmatch(name, pattern)]
+
+        if len(fbFiles) == 1:
+            return fbFiles[0]
+        elif len(fbFiles) > 1:
+            err = self.getFullName() + " had multiple feedback files\n\t" + \
+                "\n\t".join(fbFiles)
+            print(err)
+            return fbFiles
+        # else there are zero feedback files, which is fine -
+        # leave feedbackFilePath as None
+        return None
+
     def getTimestampString(self):
         return datetime.datetime.strftime(
             self.timestamp, StudentSubmission.DATE_TIME_FORMAT)
@@ -85,6 +125,10 @@ class StudentSubmission:
     def getFirstName_c(self):
         return self.firstName.lower()
 
+    # (last, first), for looking students up in a dict
+    def getNameKey_c(self):
+        return (self.getLastName_c(), self.getFirstName_c())
+
     def moveTo(self, newDir):
         #        if newDir IS the same as the current dir:
         #            return false
@@ -122,7 +166,8 @@ class StudentSubmission:
 
         # if the feedback path is in a subdir of newPath,
         # then fixup the feedback path
-        if self.feedbackFilePath is not None:
+        # (if we haven't looked for it yet then it'll be looked for in the new location, when it's needed)
+        if self._feedbackFilePath is not _NOT_LOOKED_UP_YET and self.feedbackFilePath is not None:
             # feedbackFilePath may be a single file, or a list of files
             # we'll push it all into a list in order to deal with it consistently
             # (then unpack it later, if needed)
@@ -150,6 +195,19 @@ class StudentSubmission:
             else:
                 self.feedbackFilePath = transformedFiles
 
+    # Like fixup, for when lots of folders were moved at once:
+    # new_path_for(path) says where path is now
+    def relocate(self, new_path_for):
+        self.path = new_path_for(self.path)
+
+        # (if we haven't looked for the feedback file yet then it'll be looked for in the new location)
+        if self._feedbackFilePath is _NOT_LOOKED_UP_YET or self._feedbackFilePath is None:
+            return
+        if type(self._feedbackFilePath) is list:
+            self._feedbackFilePath = [new_path_for(feedbackFile) for feedbackFile in self._feedbackFilePath]
+        else:
+            self._feedbackFilePath = new_path_for(self._feedbackFilePath)
+
     @staticmethod
     def isValidString(sz):
         if StudentSubmission.prog.search(sz.strip()) is not None:
@@ -165,7 +223,8 @@ class StudentSubmission:
     @staticmethod
     def parseString(sz):
         # print "parseString: " + sz
-        if not os.path.exists(sz):
+        # (this is answered from the parent folder's listing, which was already read if we're walking the folders)
+        if not get_dir_snapshot().exists(sz):
             return None
 
         (head, tail) = os.path.split(sz)
@@ -201,21 +260,7 @@ class StudentSubmission:
 
         sub.path = sz.strip()
 
-        # feedbackFilePath = os.path.join(sz, tail+".doc*")
-        feedbackFilePath = os.path.join(
-            sz, "*" + sub.lastName.lower() + "*.doc*")
-        # logger.debug("feedbackFilePath: " + str(feedbackFilePath) )
-        fbFiles = glob.glob(feedbackFilePath)
-        # logger.debug("fbFiles: " + str(fbFiles) )
-
-        if len(fbFiles) == 1:
-            sub.feedbackFilePath = fbFiles[0]
-        elif len(fbFiles) > 1:
-            err = sub.getFullName() + " had multiple feedback files\n\t" + \
-                "\n\t".join(fbFiles)
-            sub.feedbackFilePath = fbFiles
-            print(err)
-        # else there are zero feedback files, which is fine -
-        # leave feedbackFilePath as None
+        # Look for the feedback file(s) later, if & when they're needed
+        sub.feedbackFilePath = _NOT_LOOKED_UP_YET
 
         return sub
@@ -17,6 +17,7 @@ from collections import OrderedDict
 from mikesgradingtool.SubmissionHelpers.StudentSubmission import StudentSubmission
 from mikesgradingtool.SubmissionHelpers.StudentSubmissionList import \
     StudentSubmissionList
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot
 from mikesgradingtool.utils.my_logging import get_logger
 from colorama import Fore, Style
 
@@ -31,7 +32,10 @@ class StudentSubmissionListCollection:
         if srcPath is None:
             return
 
-        rootDirContents = os.listdir(srcPath)
+        # The folders are read through the shared snapshot, so anything else looking
+        # at this same folder (during this same command) won't need to re-read it
+        snapshot = get_dir_snapshot()
+        rootDirContents = snapshot.listdir(srcPath)
         # OS.WALK through basedir & all subdirs
         #    If *dir* appears to be a student submission
         #        Make an StudentSub out of it
@@ -41,19 +45,17 @@ class StudentSubmissionListCollection:
         # Older, unused code:
         # dirs = os.listdir(srcPath)
         # for theDir in dirs:
-        for (fullPath, dirs, files) in os.walk(srcPath):
+        for (fullPath, dirs, files) in snapshot.walk(srcPath):
             # fullPath = os.path.join(srcPath, theDir)
             logger.info(f"Full path to next dir: {fullPath}")
-            if not os.path.isdir(fullPath):
-                continue
 
             (base, filename) = os.path.split(fullPath)
             if StudentSubmission.isValidString(filename):
                 studentSub = StudentSubmission.parseString(fullPath)
-                logger.info("This is a student submission: " +
-                            studentSub.getFullName() +
-                            " " + str(studentSub.timestamp))
                 if studentSub:
+                    logger.info("This is a student submission: " +
+                                studentSub.getFullName() +
+                                " " + str(studentSub.timestamp))
                     self.Add(studentSub)
                 else:
                     print(Style.BRIGHT + Fore.RED +
@@ -0,0 +1,230 @@
+'''
+Plans out (and then carries out) all the folder moves that ConsolidateSubmissions needs:
+    1) Move each student's most recent submission into the base directory
+    2) Move each student's older submissions into their most recent submission
+'''
+import os
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from colorama import Fore, Style
+
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot, invalidate_dir_snapshot
+from mikesgradingtool.utils.my_logging import get_logger
+from mikesgradingtool.utils.print_utils import GradingToolError, printError
+
+logger = get_logger(__name__)
+
+# Used when neither the caller nor gradingTool.json (misc_files/max_concurrent_moves)
+# say how many folders to move at once
+DEFAULT_MAX_CONCURRENT_MOVES = 8
+
+# One folder move.  src and dest are where the folder is / will be at the time that the move happens
+planned_move = namedtuple('planned_move', 'sub src dest')
+
+
+# Is path the folder fp_dir, or inside of it?
+def _is_within(path: str, fp_dir: str) -> bool:
+    return path == fp_dir or path.startswith(fp_dir + os.sep)
+
+
+# Moves path along with whichever of its folders (itself, or the nearest folder that it's inside of) was moved
+# moves is { src: dest }, with normalized paths
+def _relocate(path: str, moves: dict) -> str:
+    p = path
+    while True:
+        if p in moves:
+            return moves[p] + path[len(p):]
+        parent = os.path.dirname(p)
+        if parent == p:
+            return path
+        p = parent
+
+
+# The moves are worked out up front, against where every folder will be once the earlier moves are done
+# (instead of moving one folder, then fixing up every other submission's path, then moving the next folder)
+#
+# Each step's moves are then put into 'waves': a folder is moved after any folders inside of it have been
+# moved out (and after anything that's being moved into a folder inside of it has been moved there).
+# Everything in the same wave is independent, so they're moved at the same time.
+# Once everything has been moved, each submission's path is updated just once.
+#
+# If a move fails then it's reported, and the moves that depend on it (the ones that would have waited for it,
+# or that expected to find things where it would have put them) are skipped.  Everything else still happens,
+# and the submissions' paths are updated to match the moves that actually happened
+class SubmissionMovePlan:
+
+    def __init__(self, allSubs, srcPath: str):
+        self.srcPath = os.path.normpath(srcPath)
+        snapshot = get_dir_snapshot()
+
+        # Step 1: most recent submissions go into srcPath
+        self.to_base_dir_moves = list()
+        self.to_base_dir_conflicts = list()
+        moves_1 = dict()
+        for studentName, aList in allSubs.subLists.items():
+            src = os.path.normpath(aList.mostRecent.path)
+            if os.path.dirname(src) == self.srcPath:
+                continue  # already there
+            dest = os.path.join(self.srcPath, os.path.basename(src))
+            if dest in moves_1.values() or snapshot.exists(dest):
+                self.to_base_dir_conflicts.append(planned_move(aList.mostRecent, src, dest))
+                continue
+            moves_1[src] = dest
+            self.to_base_dir_moves.append(planned_move(aList.mostRecent, src, dest))
+
+        # Step 2: older submissions go into the student's most recent submission
+        # (these paths are where things will be after step 1)
+        moved_in_1 = {dest: src for src, dest in moves_1.items()}
+        self.into_most_recent_moves = list()
+        self.into_most_recent_conflicts = list()
+        moves_2 = dict()
+        for studentName, aList in allSubs.subLists.items():
+            fp_most_recent = _relocate(os.path.normpath(aList.mostRecent.path), moves_1)
+            for prevSub in aList.previousSubmissions:
+                src = _relocate(os.path.normpath(prevSub.path), moves_1)
+                if os.path.dirname(src) == fp_most_recent:
+                    continue  # already there
+                dest = os.path.join(fp_most_recent, os.path.basename(src))
+                if dest in moves_2.values() or self._exists_after(dest, moves_1, moved_in_1):
+                    self.into_most_recent_conflicts.append(planned_move(prevSub, src, dest))
+                    continue
+                moves_2[src] = dest
+                self.into_most_recent_moves.append(planned_move(prevSub, src, dest))
+
+        self.to_base_dir_waves, self._to_base_dir_waits = self._waves(self.to_base_dir_moves, moves_1)
+        self.into_most_recent_waves, self._into_most_recent_waits = self._waves(self.into_most_recent_moves, moves_2)
+
+        self._moves_1 = moves_1
+        self._moves_2 = moves_2
+
+    # Will fp (a path after the step 1 moves) exist once the step 1 moves are done?
+    @staticmethod
+    def _exists_after(fp: str, moves_1: dict, moved_in_1: dict) -> bool:
+        if fp in moved_in_1:
+            return True
+        # Where it is now, and whether it'll still be at fp after step 1
+        fp_before = _relocate(fp, moved_in_1)
+        return _relocate(fp_before, moves_1) == fp and get_dir_snapshot().exists(fp_before)
+
+    # Group the moves so that each one comes after the moves it depends on
+    # Returns (list of waves, { src: the srcs of the moves it has to wait for })
+    @staticmethod
+    def _waves(moves: list, moves_by_src: dict) -> tuple:
+        move_for_src = {move.src: move for move in moves}
+        must_wait_for = {move.src: set() for move in moves}
+
+        for move in moves:
+            # A folder that this folder is inside of (or that it's being moved into) needs to wait for this one
+            for fp in (os.path.dirname(move.src), os.path.dirname(move.dest)):
+                while True:
+                    if fp in moves_by_src and fp != move.src:
+                        must_wait_for[fp].add(move.src)
+                    parent = os.path.dirname(fp)
+                    if parent == fp:
+                        break
+                    fp = parent
+
+        waves = list()
+        remaining = {src: set(waiting_for) for src, waiting_for in must_wait_for.items()}
+        while remaining:
+            ready = [src for src, waiting_for in remaining.items() if not waiting_for]
+            if not ready:
+                raise GradingToolError("Couldn't figure out what order to move these folders in:\n\t" +
+                                       "\n\t".join(remaining.keys()))
+            waves.append([move_for_src[src] for src in ready])
+            for src in ready:
+                del remaining[src]
+            for waiting_for in remaining.values():
+                waiting_for.difference_update(ready)
+        return waves, must_wait_for
+
+    def print_plan(self):
+        for title, conflicts, waves in (("Move most recent submissions into " + self.srcPath,
+                                         self.to_base_dir_conflicts, self.to_base_dir_waves),
+                                        ("Move older submissions into the most recent submission",
+                                         self.into_most_recent_conflicts, self.into_most_recent_waves)):
+            print(Style.BRIGHT + title + Style.RESET_ALL)
+            for move in conflicts:
+                print(Fore.RED + "\tCan't move (destination already exists): " + Style.RESET_ALL +
+                      move.src + "\n\t\tto: " + move.dest)
+            for i, wave in enumerate(waves):
+                print(f"\tWave {i + 1} ({len(wave)} folders):")
+                for move in wave:
+                    print(f"\t\t{move.sub.getFullName()}:\n\t\t\tfrom: {move.src}\n\t\t\tto:   {move.dest}")
+            if not conflicts and not waves:
+                print("\t(nothing to move)")
+
+    # Move everything, then update every submission's path (and feedback file paths) to match.
+    # Returns a list of the planned_moves that didn't happen (because they failed, or depended on one that did)
+    def execute(self, allSubs, max_workers: int = None) -> list:
+        if max_workers is None:
+            max_workers = get_app_config().getKey("misc_files/max_concurrent_moves", DEFAULT_MAX_CONCURRENT_MOVES)
+
+        # src -> dest, for the moves that actually happened
+        done_1 = dict()
+        done_2 = dict()
+        not_moved = list()
+
+        with ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="submission_move") as pool:
+            for conflicts, waves, must_wait_for, done in ((self.to_base_dir_conflicts, self.to_base_dir_waves,
+                                                           self._to_base_dir_waits, done_1),
+                                                          (self.into_most_recent_conflicts, self.into_most_recent_waves,
+                                                           self._into_most_recent_waits, done_2)):
+                for move in conflicts:
+                    printError(" Can't move duplicate folder because destination" +
+                               " already exists\n\t" + move.dest)
+
+                # The step 2 paths assume that all of step 1 happened, so anything that's in (or going into)
+                # a folder that wasn't moved in step 1 isn't where step 2 expects it to be
+                missing_dirs = [self._moves_1[move.src] for move in not_moved]
+                not_moved_srcs = set()
+
+                for wave in waves:
+                    to_move = list()
+                    for move in wave:
+                        if must_wait_for[move.src] & not_moved_srcs \
+                                or any(_is_within(move.src, fp) or _is_within(move.dest, fp) for fp in missing_dirs):
+                            printError(f" Didn't move {move.src} because a move that it depends on didn't happen")
+                            not_moved_srcs.add(move.src)
+                            not_moved.append(move)
+                        else:
+                            to_move.append(move)
+
+                    for move, error in zip(to_move, pool.map(self._move_one, to_move)):
+                        if error is not None:
+                            printError(f" Couldn't move a directory\n\tfrom: {move.src}\n\tto:   {move.dest}\n\t{error}")
+                            not_moved_srcs.add(move.src)
+                            not_moved.append(move)
+                            continue
+                        done[move.src] = move.dest
+                        print((move.sub.getFullName() +
+                               ": moved a directory\n\tfrom: " +
+                               move.src + "\n\tto:   " + move.dest + "\n"))
+
+        def moved_path(fp: str) -> str:
+            return _relocate(_relocate(os.path.normpath(fp), done_1), done_2)
+
+        for aList in allSubs.subLists.values():
+            for sub in [aList.mostRecent] + aList.previousSubmissions:
+                sub.relocate(moved_path)
+        return not_moved
+
+    # Returns None if it worked, otherwise the exception
+    @staticmethod
+    def _move_one(move: planned_move):
+        logger.info(f"moving {move.src} to {move.dest}")
+        try:
+            shutil.move(move.src, move.dest)
+            return None
+        except Exception as e:
+            return e
+        finally:
+            invalidate_dir_snapshot(move.src)
+            invalidate_dir_snapshot(move.dest)
+
+    # Where fp ends up once all the (planned) moves are done
+    def final_path(self, fp: str) -> str:
+        return _relocate(_relocate(os.path.normpath(fp), self._moves_1), self._moves_2)
@@ -151,6 +151,8 @@ def CLI():
                                                          help='Copy the given file to all the subdirs in DEST')
         parser_files_template_copy_to_subdir.add_argument('template_file', help='The file.  Will be renamed to include the subdir\'s name')
         parser_files_template_copy_to_subdir.add_argument('SRC', help='The directory that contains the subdirs.  File will be copied to ALL subdirs')
+        parser_files_template_copy_to_subdir.add_argument('-j', '--JOBS', type=int,
+                                                          help='How many files to copy the template into at once (default is misc_files/max_concurrent_copies in gradingtool.json, or 8)')
         parser_files_template_copy_to_subdir.set_defaults(func=MiscFilesHelper.fn_misc_files_copy_to_subdir)
 
         parser_files_template_copier = misc_files_subparsers.add_parser('template',
@@ -158,6 +160,8 @@ def CLI():
                                                          help='Copy all the files given by TEMPLATE into any feedback files in SRC')
         parser_files_template_copier.add_argument('template_file', help='The template file')
         parser_files_template_copier.add_argument('SRC', help='The directory that contains the files to copy the template into')
+        parser_files_template_copier.add_argument('-j', '--JOBS', type=int,
+                                                  help='How many files to copy the template into at once (default is misc_files/max_concurrent_copies in gradingtool.json, or 8)')
         parser_files_template_copier.set_defaults(func=MiscFilesHelper.fn_misc_files_copy_template)
 
         parser_files_feedback_copier = misc_files_subparsers.add_parser('move_feedback',
@@ -170,6 +174,16 @@ def CLI():
 
         parser_files_feedback_copier.set_defaults(func=MiscFilesHelper.fn_misc_files_move_feedback_to_student_dirs)
 
+        parser_files_organize = misc_files_subparsers.add_parser('organize',
+                                                         aliases=['o'],
+                                                         help='Move each student\'s most recent submission into SRC, and their older submissions into the most recent one')
+        parser_files_organize.add_argument('SRC', help='The directory that contains the student submissions')
+        parser_files_organize.add_argument('-n', '--DRY_RUN', action='store_true',
+                                           help='Dry run: list the folders that would be moved, but don\'t move anything')
+        parser_files_organize.add_argument('-j', '--JOBS', type=int,
+                                           help='How many folders to move at once (default is misc_files/max_concurrent_moves in gradingtool.json, or 8)')
+        parser_files_organize.set_defaults(func=MiscFilesHelper.fn_misc_files_organize_submissions)
+
     setup_misc_file_parsers(subparsers)
 
     ################################# LIST COURSES, ASSIGNMENTS AND GITHUB/CANVASAPI ACCESS ##################
@@ -239,6 +253,10 @@ def CLI():
         parser_download_homeworks.add_argument('-q', '--QUARTER',
                                                help='Quarter code to look for (e.g., "S20" for Spring 2020)')
         parser_download_homeworks.add_argument('-v', '--VERBOSE', action='store_true', help='Show extra info (verbose)')
+        parser_download_homeworks.add_argument('-j', '--JOBS', type=int,
+                                               help='How many files to download at once (default is canvas/download/max_concurrent_downloads in gradingtool.json, or 16)')
+        parser_download_homeworks.add_argument('-F', '--FULL', action='store_true',
+                                               help='Re-check every student\'s submission (default is to only look at work handed in since the last download)')
         parser_download_homeworks.set_defaults(func=CanvasHelper.fn_canvas_download_homework)
 
         parser_fix_accessibility = canvas_subparsers.add_parser('fix_accessibility',
@@ -268,21 +286,40 @@ def CLI():
                                                                    aliases=['h'],
                                                                    help=f'Set the due dates for all homeworks in a particular course')
         parser_canvas_set_due_dates.add_argument('COURSE',
-                                                 help='Name of the course (e.g., 142)')
+                                                 help='Name of the course (e.g., 142), or \'all\' for every course in gradingtool.json that has due_date_info')
         parser_canvas_set_due_dates.add_argument('HOMEWORK_NAME', nargs='?', default='',
                                                  help='The name of the homework assignment (to update only that assignment)')
         parser_canvas_set_due_dates.add_argument('-f', '--FIRST_DAY_OF_QUARTER', nargs='?', default='',
                                                  help='The first day of the quarter, in YYYY-MM-DD format (so Sept 27th, 2023 would be 2023-09-27)')
         parser_canvas_set_due_dates.add_argument('-n', '--NOOP', action='store_true', help='No-op: Calculate due dates but don\'t change anything')
         parser_canvas_set_due_dates.add_argument('-v', '--VERBOSE', action='store_true', help='Show extra info (verbose)')
+        parser_canvas_set_due_dates.add_argument('-j', '--JOBS', type=int,
+                                                 help='How many assignments to update at once, if Canvas\' bulk update can\'t be used (default is canvas/due_dates/max_concurrent_updates in gradingtool.json, or 8)')
 
         parser_canvas_set_due_dates.set_defaults(func=CanvasHelper.fn_canvas_calculate_all_due_dates)
 
+        parser_canvas_export_schedule = canvas_subparsers.add_parser('export_schedule',
+                                                                     aliases=['x'],
+                                                                     help=f'Calculate the due dates WITHOUT connecting to Canvas, save them as .json & .ics files, and show what changed since the last export')
+        parser_canvas_export_schedule.add_argument('COURSE',
+                                                   help='Name of the course (e.g., 142), or \'all\' for every course in gradingtool.json that has due_date_info')
+        parser_canvas_export_schedule.add_argument('-f', '--FIRST_DAY_OF_QUARTER', nargs='?', default='',
+                                                   help='The first day of the quarter, in YYYY-MM-DD format (so Sept 27th, 2023 would be 2023-09-27)')
+        parser_canvas_export_schedule.add_argument('-o', '--OUTPUT_DIR',
+                                                   help='Where to put schedule_<COURSE>.json and schedule_<COURSE>.ics (default is canvas/due_dates/schedule_export_dir in gradingtool.json, or the current directory)')
+        parser_canvas_export_schedule.add_argument('-d', '--DIFF_ONLY', action='store_true', help='Only show what changed since the last export (don\'t overwrite the exported files)')
+        parser_canvas_export_schedule.add_argument('-v', '--VERBOSE', action='store_true', help='Show extra info (verbose) - this lists every due date')
+        parser_canvas_export_schedule.set_defaults(func=CanvasHelper.fn_canvas_export_schedule)
+
         parser_canvas_package_ = canvas_subparsers.add_parser('package',
                                                                 aliases=['pu'],
                                                                 help=f'Package all feedback files to upload to Canvas.  All files from Canvas are put into a .ZIP (named {dir_for_new_feedbacks}), new feedback files are put into a new directory (named {zip_file_name})')
         parser_canvas_package_.add_argument('SRC',
                                             help='The directory that contains the feedback files to upload')
+        parser_canvas_package_.add_argument('-j', '--JOBS', type=int,
+                                            help='How many files to compress at once (default is misc_files/zip/max_workers in gradingtool.json, or the number of CPUs)')
+        parser_canvas_package_.add_argument('-F', '--FULL', action='store_true',
+                                            help='Re-compress every file (default is to re-use the files that haven\'t changed since the last .ZIP was made)')
         parser_canvas_package_.set_defaults(func=CanvasHelper.fn_canvas_package_feedback_for_upload)
 
         # Doesn't work, so I'm removing it from the UI.  Temporarily, hopefully
@@ -311,6 +348,8 @@ def CLI():
         parser_canvas_template_copier.add_argument('template_file', help='The template file OR ELSE the alias in gradingtool.json that lists the course and homework (in which case you don\'t need the second argument)')
         parser_canvas_template_copier.add_argument('SRC', nargs='?', default='',
                                                   help='The directory that contains the files to copy the template into (the "_NEW" dir will be created in here')
+        parser_canvas_template_copier.add_argument('-j', '--JOBS', type=int,
+                                                   help='How many files to copy the template into at once (default is misc_files/max_concurrent_copies in gradingtool.json, or 8)')
         parser_canvas_template_copier.set_defaults(func=CanvasHelper.fn_canvas_copy_template)
 
         parser_canvas_upload_feedback = canvas_subparsers.add_parser('upload_feedback',
@@ -321,6 +360,10 @@ def CLI():
         parser_canvas_upload_feedback.add_argument('DEST', nargs='?', default=None,
                                                help='(Optional) The name of a single homework directory (to upload only that assignment)')
         parser_canvas_upload_feedback.add_argument('-v', '--VERBOSE', action='store_true', help='Show verbose output')
+        parser_canvas_upload_feedback.add_argument('-j', '--JOBS', type=int,
+                                               help='How many feedback files to upload at once (default is canvas/upload/max_concurrent_uploads in gradingtool.json, or 8)')
+        parser_canvas_upload_feedback.add_argument('-F', '--FORCE', action='store_true',
+                                               help='Upload every feedback file, even the ones that were already uploaded and haven\'t changed since')
         parser_canvas_upload_feedback.set_defaults(func=CanvasHelper.fn_canvas_upload_feedback_via_CAPI)
 
         parser_canvas_d_r_l = canvas_subparsers.add_parser('downloadRevisionTemplate',
@@ -329,6 +372,10 @@ def CLI():
         parser_canvas_d_r_l.add_argument('alias',
                                             help='The alias (listed in gradingtool.json) that refers to the course and assignment')
         parser_canvas_d_r_l.add_argument('-v', '--VERBOSE', action='store_true', help='Show status of all repos (default is to show only those that have changed/need grading)')
+        parser_canvas_d_r_l.add_argument('-j', '--JOBS', type=int,
+                                         help='How many files to download (and copy the template into) at once (default is canvas/download/max_concurrent_downloads and misc_files/max_concurrent_copies in gradingtool.json)')
+        parser_canvas_d_r_l.add_argument('-F', '--FULL', action='store_true',
+                                         help='Re-check every student\'s submission (default is to only look at work handed in since the last download)')
         parser_canvas_d_r_l.set_defaults(func=CanvasHelper.fn_canvas_download_revision_template)
 
     setup_canvas_parsers(subparsers)
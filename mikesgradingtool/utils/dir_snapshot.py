@@ -0,0 +1,101 @@
+import functools
+import os
+import threading
+from collections import namedtuple
+
+# What's in a single directory.  dirs & files are lists of os.DirEntry, sorted by name
+#   names is the set of everything in the directory (dirs and files), for quick 'is this here?' checks
+dir_listing = namedtuple('dir_listing', 'mtime_ns dirs files names')
+
+
+# An in-memory snapshot of the directories that the current command is working with.
+#
+# Each directory is read (with os.scandir) the first time anything asks about it, and the listing is then
+# shared by everything that asks again (finding feedback files, finding student submission folders,
+# copying templates, checking for lock files, etc), instead of each of them walking the folders themselves.
+#
+# A cached listing is re-used only while the directory's modification time is unchanged (creating, deleting,
+# or renaming anything in a directory updates its mtime), so one os.stat() replaces re-reading the whole directory.
+# Code that knows it changed a directory can also call invalidate_dir_snapshot() directly
+class DirSnapshot:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._listings = dict()
+
+    @staticmethod
+    def _key(fp_dir: str) -> str:
+        return os.path.normcase(os.path.abspath(fp_dir))
+
+    # Returns the dir_listing for fp_dir, or None if it isn't a directory
+    def listing(self, fp_dir: str):
+        key = self._key(fp_dir)
+        try:
+            mtime_ns = os.stat(fp_dir).st_mtime_ns
+        except OSError:
+            self.invalidate(fp_dir)
+            return None
+
+        with self._lock:
+            cached = self._listings.get(key)
+        if cached is not None and cached.mtime_ns == mtime_ns:
+            return cached
+
+        dirs = list()
+        files = list()
+        try:
+            with os.scandir(fp_dir) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue  # e.g., a broken symlink
+                    (dirs if is_dir else files).append(entry)
+        except (NotADirectoryError, FileNotFoundError, PermissionError):
+            return None
+
+        dirs.sort(key=lambda e: e.name)
+        files.sort(key=lambda e: e.name)
+        fresh = dir_listing(mtime_ns, dirs, files, frozenset(e.name for e in dirs) | frozenset(e.name for e in files))
+
+        with self._lock:
+            self._listings[key] = fresh
+        return fresh
+
+    # Like os.listdir, but the names come back sorted
+    def listdir(self, fp_dir: str) -> list:
+        the_listing = self.listing(fp_dir)
+        if the_listing is None:
+            raise FileNotFoundError(fp_dir)
+        return sorted(the_listing.names)
+
+    def exists(self, fp_item: str) -> bool:
+        the_listing = self.listing(os.path.dirname(fp_item) or os.curdir)
+        return the_listing is not None and os.path.basename(fp_item) in the_listing.names
+
+    # Works like os.walk (top-down, and removing names from dirnames stops walk from going into them)
+    def walk(self, top: str):
+        the_listing = self.listing(top)
+        if the_listing is None:
+            return
+
+        dirnames = [e.name for e in the_listing.dirs]
+        yield top, dirnames, [e.name for e in the_listing.files]
+
+        for dirname in dirnames:
+            yield from self.walk(os.path.join(top, dirname))
+
+    # Forget what we know about fp (and the directory it's in), so it'll be re-read next time
+    def invalidate(self, fp: str):
+        with self._lock:
+            self._listings.pop(self._key(fp), None)
+            self._listings.pop(self._key(os.path.dirname(os.path.abspath(fp))), None)
+
+
+@functools.lru_cache(1)
+def get_dir_snapshot() -> DirSnapshot:
+    return DirSnapshot()
+
+
+def invalidate_dir_snapshot(fp: str):
+    get_dir_snapshot().invalidate(fp)
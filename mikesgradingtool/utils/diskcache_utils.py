@@ -3,6 +3,9 @@ import os
 
 import diskcache as dc
 
+# cache expiration in seconds - 11 weeks
+APP_CACHE_EXPIRATION = 60*60*24*7*11
+
 the_persistent_cache = None
 
 @functools.lru_cache(1)
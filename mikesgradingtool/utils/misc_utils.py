@@ -1,5 +1,6 @@
 
 
+import hashlib
 import os
 import os.path
 import platform
@@ -11,7 +12,8 @@ import string
 from contextlib import contextmanager
 from pathlib import Path
 
-from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.dir_snapshot import get_dir_snapshot, invalidate_dir_snapshot
+from mikesgradingtool.utils.naming_rules import get_naming_rules
 
 @contextmanager
 def cd(newdir):
@@ -23,6 +25,8 @@ def cd(newdir):
         os.chdir(prevdir)
 
 
+_VALID_FILENAME_CHARS = frozenset("-_() %s%s" % (string.ascii_letters, string.digits))
+
 # from https://gist.github.com/seanh/93666
 def format_filename(s):
 #     ""Take a string and return a valid filename constructed from the string.
@@ -35,8 +39,7 @@ def format_filename(s):
 # an invalid filename.
 #
 # ""
-    valid_chars = "-_() %s%s" % (string.ascii_letters, string.digits)
-    filename = ''.join(c for c in s if c in valid_chars)
+    filename = ''.join(c for c in s if c in _VALID_FILENAME_CHARS)
     filename = filename.replace(' ', '_')  # I don't like spaces in filenames.
     return filename
 
@@ -57,10 +60,7 @@ def UniqueFileName(fileNameOrig, startWithSuffix=False):
     return filename
 
 def get_lock_filename(fp_file):
-    config = get_app_config()
-    alreadyCopiedSuffix = config.verify_keys([
-        "misc_files/FileAlreadyProcessedMarker",
-    ])
+    alreadyCopiedSuffix = get_naming_rules().already_processed_marker
 
     file = os.path.basename(fp_file)
     fnAlreadyProcessed = format_filename(file + alreadyCopiedSuffix) + ".txt"
@@ -73,35 +73,37 @@ def get_lock_filename(fp_file):
     return fpProcessed
 
 def is_file_a_lock_file(fp_file: str):
-    config = get_app_config()
-    alreadyCopiedSuffix = config.verify_keys([
-        "misc_files/FileAlreadyProcessedMarker",
-    ])
-    alreadyCopiedSuffix= config.getKey("misc_files/FileAlreadyProcessedMarker")
-
-    file = os.path.basename(fp_file)
-    return fp_file.endswith(alreadyCopiedSuffix+".txt")
+    return fp_file.endswith(get_naming_rules().lock_file_suffix)
 
 def is_file_locked(fp_file):
-    config = get_app_config()
-    alreadyCopiedSuffix = config.verify_keys([
-        "misc_files/FileAlreadyProcessedMarker",
-    ])
-
     fpProcessed = get_lock_filename(fp_file)
 
     return os.path.exists(fpProcessed)
 
-def lock_file(fp_file):
-    config = get_app_config()
-    alreadyCopiedSuffix = config.verify_keys([
-        "misc_files/FileAlreadyProcessedMarker",
-    ])
+# Is each of fp_files locked?  Returns { fp_file: True/False }
+# Each folder is listed once (through the shared directory snapshot) and the lock files are looked up
+# in that listing, instead of checking for each lock file separately like is_file_locked does
+def get_lock_status(fp_files) -> dict:
+    snapshot = get_dir_snapshot()
 
+    files_by_dir = dict()
+    for fp_file in fp_files:
+        files_by_dir.setdefault(os.path.dirname(fp_file), list()).append(fp_file)
+
+    status = dict()
+    for fp_dir, files_in_dir in files_by_dir.items():
+        the_listing = snapshot.listing(fp_dir)
+        names = the_listing.names if the_listing is not None else frozenset()
+        for fp_file in files_in_dir:
+            status[fp_file] = os.path.basename(get_lock_filename(fp_file)) in names
+    return status
+
+def lock_file(fp_file):
     fpProcessed = get_lock_filename(fp_file)
 
     os.makedirs(os.path.dirname(fp_file), exist_ok=True)
     Path(fpProcessed).touch()
+    invalidate_dir_snapshot(fpProcessed)
 
     return fpProcessed
 
@@ -129,6 +131,15 @@ def rmtree_remove_readonly_files(func, path, exc_info):
         raise
 
 
+# Read the file in 1MB pieces, so that big files don't need to fit in memory
+def sha256_of_file(fp_file: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(fp_file, "rb") as inp:
+        for chunk in iter(lambda: inp.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 from threading import Lock
 
 mylock = Lock()
@@ -149,6 +160,7 @@ class grade_list_collector(object):
         self.ungraded = list()
         self.new_student_work_since_grading = list()
         self.graded = list()
+        self.already_uploaded = list()  # for CanvasAPI - feedback that's already in Canvas, unchanged
         self.verbose = True # print everything by default
 
     def generate_grading_list_collector(self, tag):
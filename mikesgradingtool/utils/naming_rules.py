@@ -0,0 +1,102 @@
+import functools
+import re
+from functools import cached_property
+
+from mikesgradingtool.utils.config_json import GradingToolConfig, get_app_config
+
+
+# The file & folder naming conventions from gradingTool.json (student names, feedback files,
+# lock files, backup folders, etc), looked up and compiled once per run.
+#
+# The helpers that run once per file in a directory walk use this, instead of going back to the config
+# (and re-compiling their regexes) for every single file.
+# Each setting is looked up the first time it's used, so a command that never needs (say) the Canvas
+# settings doesn't need them in gradingTool.json
+class NamingRules:
+
+    def __init__(self, config: GradingToolConfig):
+        self._config = config
+
+    # misc_files/ settings:
+    @cached_property
+    def backup_dir_name(self) -> str:
+        return self._config.verify_keys(["misc_files/BackupDirName"])
+
+    @cached_property
+    def already_processed_marker(self) -> str:
+        return self._config.verify_keys(["misc_files/FileAlreadyProcessedMarker"])
+
+    # lock files are named <the file being locked><already_processed_marker>.txt
+    @cached_property
+    def lock_file_suffix(self) -> str:
+        return self.already_processed_marker + ".txt"
+
+    # canvas/ settings:
+    @cached_property
+    def new_feedbacks_dir(self) -> str:
+        return self._config.verify_keys(["canvas/NewDirForMissingFeedbackFiles"])
+
+    @cached_property
+    def zip_to_reupload(self) -> str:
+        return self._config.verify_keys(["canvas/ZipFileToUploadToCanvas"])
+
+    @cached_property
+    def submission_dir_suffix(self) -> str:
+        return self._config.verify_keys(["canvas/StudentSubFolderMarker"])
+
+    @cached_property
+    def late_marker(self) -> str:
+        return self._config.verify_keys(["canvas/LateMarker"])
+
+    @cached_property
+    def missing_name(self) -> str:
+        return self._config.verify_keys(["canvas/MissingNameSubstituteForFileNames"])
+
+    @cached_property
+    def re_student_name_key(self) -> re.Pattern:
+        return re.compile("^" + self._config.verify_keys(["canvas/StudentName"]))
+
+    # Just the 'this is the feedback file' part of the name (e.g., INSTRUCTORFEEDBACK)
+    @cached_property
+    def re_feedback_file_name(self) -> re.Pattern:
+        return re.compile(self._config.verify_keys(["canvas/InstructorFeedbackFileNameRegex"]), re.IGNORECASE)
+
+    # The whole feedback file name, for any feedback file (see _getFeedbackFileRegex in CanvasHelper)
+    @cached_property
+    def re_feedback_file(self) -> re.Pattern:
+        return self._feedback_file_regex(canvas_only=False)
+
+    # The whole feedback file name, for feedback files named the way that Canvas names them
+    @cached_property
+    def re_canvas_feedback_file(self) -> re.Pattern:
+        return self._feedback_file_regex(canvas_only=True)
+
+    def _feedback_file_regex(self, canvas_only: bool) -> re.Pattern:
+        sz_re_studentName, \
+            sz_re_studentname_id_filenum, \
+            sz_re_feedback_file, \
+            sz_re_sub_num, \
+            sz_re_file_ext = self._config.verify_keys([
+            "canvas/StudentName",
+            "canvas/StudentNameIDFileNum",
+            "canvas/InstructorFeedbackFileNameRegex",
+            "canvas/OptionalFileSubmissionNumber",
+            "canvas/FileExtension"
+        ])
+
+        sz_re_student = sz_re_studentname_id_filenum if canvas_only else sz_re_studentName + ".*"
+
+        return re.compile(sz_re_student + sz_re_feedback_file + sz_re_sub_num + sz_re_file_ext, re.IGNORECASE)
+
+    # True for our own backup copies and lock files (which should be skipped over)
+    def is_backup_or_lock_file(self, fp_file: str) -> bool:
+        return self.backup_dir_name in fp_file or self.already_processed_marker in fp_file
+
+    # True for the things that package_feedback creates (which should be skipped over)
+    def is_canvas_upload_file(self, fp_file: str) -> bool:
+        return self.new_feedbacks_dir in fp_file or self.zip_to_reupload in fp_file
+
+
+@functools.lru_cache(1)
+def get_naming_rules() -> NamingRules:
+    return NamingRules(get_app_config())
@@ -0,0 +1,58 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from mikesgradingtool.utils.config_json import get_app_config
+
+
+# How many worker threads to use: max_workers if it was given (e.g., from -j/--JOBS), otherwise
+# config_key from gradingTool.json, otherwise default.  Always at least 1
+def max_workers_from_config(max_workers, config_key: str, default: int) -> int:
+    if max_workers is None:
+        max_workers = get_app_config().getKey(config_key, default)
+    return max(1, int(max_workers))
+
+
+# A thread pool that hands the work back in the order it was submitted, no matter which piece finishes first.
+#
+# Each piece of work can have a tag (e.g., the file it's for), which comes back with its future.
+# Leaving the 'with' block waits for the worker threads to finish
+class OrderedExecutor:
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        # (tag, future) pairs, oldest first
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # How many pieces of work haven't been handed back yet
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, fn, *args, tag=None) -> Future:
+        future = self._executor.submit(fn, *args)
+        self._pending.append((tag, future))
+        return future
+
+    # Waits for the oldest piece of work to finish, and returns its (tag, future)
+    def next_done(self) -> tuple:
+        tag, future = self._pending.popleft()
+        future.exception()  # i.e., wait for it (without raising its exception)
+        return tag, future
+
+    # Yields (tag, future) for everything submitted so far, oldest first, as each one finishes
+    def drain(self):
+        while self._pending:
+            yield self.next_done()
+
+    # If cancel_pending is True then anything that hasn't started yet is thrown away
+    def close(self, cancel_pending: bool = False):
+        if cancel_pending:
+            self._pending.clear()
+        self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
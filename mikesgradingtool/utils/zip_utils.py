@@ -0,0 +1,229 @@
+import os
+import struct
+import time
+import uuid
+import zipfile
+import zlib
+from dataclasses import dataclass
+
+from mikesgradingtool.utils.config_json import get_app_config
+from mikesgradingtool.utils.diskcache_utils import APP_CACHE_EXPIRATION, get_app_cache
+from mikesgradingtool.utils.ordered_executor import OrderedExecutor, max_workers_from_config
+
+# Files that are already compressed (.docx/.xlsx/.pptx are .zip files inside), so deflating them again
+# just burns CPU time for (almost) no savings.  These are stored in the .ZIP as-is.
+# gradingTool.json can replace this list with misc_files/zip/stored_extensions
+DEFAULT_STORED_EXTENSIONS = [".docx", ".xlsx", ".pptx", ".odt", ".ods", ".odp", ".zip", ".7z", ".gz", ".bz2",
+                             ".xz", ".rar", ".jar", ".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp",
+                             ".mp3", ".mp4", ".m4a", ".mov", ".avi"]
+
+
+@dataclass
+class ZipStats:
+    files: int = 0
+    stored: int = 0
+    reused: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        mb_in = self.bytes_in / (1024 * 1024)
+        mb_per_second = mb_in / self.seconds if self.seconds > 0 else 0.0
+        return f"{self.files} files ({self.stored} stored as-is, {self.reused} unchanged since last time) | {mb_in:.1f} MB -> " \
+               f"{self.bytes_out / (1024 * 1024):.1f} MB | {self.seconds:.1f}s ({mb_per_second:.1f} MB/s)"
+
+
+# Reads & (if needed) compresses one file.  Runs on a worker thread
+# (zlib lets go of the GIL while it works, so several of these really do run at once)
+def _prepare_member(fp_file: str, arcname: str, store: bool):
+    zinfo = zipfile.ZipInfo.from_file(fp_file, arcname)
+    with open(fp_file, mode='rb') as inp:
+        data = inp.read()
+
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    if store:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        # raw deflate (no zlib header), which is what ZIP_DEFLATED means inside a .ZIP file
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.compress_size = len(data)
+    return zinfo, data
+
+
+# The zip file's local header is 30 bytes, followed by the file name and the 'extra' field
+_LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+
+
+# Copies one member's (already compressed) data out of the previous .ZIP file.  Runs on a worker thread
+def _reuse_member(fp_file: str, arcname: str, fp_previous_zip: str, previous: dict):
+    zinfo = zipfile.ZipInfo.from_file(fp_file, arcname)
+    zinfo.compress_type = previous['compress_type']
+    zinfo.CRC = previous['CRC']
+    zinfo.file_size = previous['file_size']
+    zinfo.compress_size = previous['compress_size']
+
+    with open(fp_previous_zip, mode='rb') as inp:
+        inp.seek(previous['header_offset'])
+        header = _LOCAL_HEADER.unpack(inp.read(_LOCAL_HEADER.size))
+        if header[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Couldn't find {arcname} in {fp_previous_zip}")
+        inp.seek(header[-2] + header[-1], os.SEEK_CUR)  # skip the name & 'extra' field
+        data = inp.read(zinfo.compress_size)
+
+    if len(data) != zinfo.compress_size:
+        raise zipfile.BadZipFile(f"{arcname} is cut short in {fp_previous_zip}")
+    return zinfo, data
+
+
+# Writes a .ZIP file, compressing the files on several threads at once.
+#
+# Files are read & compressed on the worker threads, and then written into the .ZIP file (by whoever calls add()
+# or close()) in the same order that they were added.  Only a few files' worth of compressed data is held
+# in memory at a time.
+#
+# Files whose extension is listed in misc_files/zip/stored_extensions are stored without compressing them
+#
+# When incremental is True (the default) the previous run's .ZIP file is re-used:  a manifest of each member's
+# source file (size, modification time, CRC, and where it is in the .ZIP) is kept in the app's diskcache,
+# and members whose source file hasn't changed since then are copied over as-is (already compressed)
+# instead of being read & compressed again.
+# The new .ZIP is written next to the old one, and then replaces it once it's finished
+class ParallelZipWriter:
+
+    def __init__(self, fp_zip: str, max_workers: int = None, incremental: bool = True):
+        self.max_workers = max_workers_from_config(max_workers, "misc_files/zip/max_workers", os.cpu_count() or 1)
+        self.stored_extensions = {ext.lower() for ext in
+                                  get_app_config().getKey("misc_files/zip/stored_extensions", DEFAULT_STORED_EXTENSIONS)}
+        self.stats = ZipStats()
+
+        self.fp_zip = fp_zip
+        self._cache_key = f"zip_manifest:{os.path.normcase(os.path.abspath(fp_zip))}"
+        self._previous = self._load_previous_manifest() if incremental else dict()
+        self._manifest = dict()
+
+        self._start = time.perf_counter()
+        self._fp_zip_tmp = f"{fp_zip}.{uuid.uuid4().hex}.tmp"
+        self._zip = zipfile.ZipFile(self._fp_zip_tmp, mode='w', compression=zipfile.ZIP_DEFLATED)
+        # The members are compressed on the worker threads, but written into the .ZIP in the order they were added
+        self._work = OrderedExecutor(self.max_workers, "zip")
+        self._closed = False
+
+    # make the writer a context manager, so the .ZIP always gets finished (or, if something went wrong,
+    # thrown away) & the worker threads cleaned up
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif not self._closed:
+            self._discard()
+        return False
+
+    # The members of the previous .ZIP file, if it's still exactly what we wrote last time
+    def _load_previous_manifest(self) -> dict:
+        saved = get_app_cache().get(self._cache_key)
+        if saved is None:
+            return dict()
+        try:
+            stat = os.stat(self.fp_zip)
+        except OSError:
+            return dict()
+        if (stat.st_size, stat.st_mtime_ns) != (saved['zip_size'], saved['zip_mtime_ns']):
+            return dict()
+        return saved['members']
+
+    def add(self, fp_file: str, arcname: str = None):
+        if arcname is None:
+            arcname = os.path.basename(fp_file)
+        fp_file = os.path.abspath(fp_file)
+
+        stat = os.stat(fp_file)
+        previous = self._previous.get(arcname)
+        reused = previous is not None and previous['fp_file'] == fp_file \
+            and (previous['size'], previous['mtime_ns']) == (stat.st_size, stat.st_mtime_ns)
+        if reused:
+            self._work.submit(_reuse_member, fp_file, arcname, self.fp_zip, previous, tag=(fp_file, stat, reused))
+        else:
+            store = os.path.splitext(fp_file)[1].lower() in self.stored_extensions
+            self._work.submit(_prepare_member, fp_file, arcname, store, tag=(fp_file, stat, reused))
+
+        # Don't let the compressed data pile up in memory
+        while len(self._work) > 2 * self.max_workers:
+            self._write_next()
+
+    def _write_next(self):
+        (fp_file, stat, reused), future = self._work.next_done()
+        zinfo, data = future.result()
+        self._write_compressed(zinfo, data)
+
+        self._manifest[zinfo.filename] = {'fp_file': fp_file,
+                                          'size': stat.st_size,
+                                          'mtime_ns': stat.st_mtime_ns,
+                                          'compress_type': zinfo.compress_type,
+                                          'CRC': zinfo.CRC,
+                                          'file_size': zinfo.file_size,
+                                          'compress_size': zinfo.compress_size,
+                                          'header_offset': zinfo.header_offset}
+
+        self.stats.files += 1
+        self.stats.stored += zinfo.compress_type == zipfile.ZIP_STORED
+        self.stats.reused += reused
+        self.stats.bytes_in += zinfo.file_size
+        self.stats.bytes_out += zinfo.compress_size
+
+    # zipfile doesn't have a public way to add data that's already been compressed, so this does what
+    # ZipFile.write does, minus the compressing
+    # (the size & CRC are already known, so the header is right the first time & never needs to be re-written)
+    def _write_compressed(self, zinfo: zipfile.ZipInfo, data: bytes):
+        zf = self._zip
+        zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+        with zf._lock:
+            zf.fp.seek(zf.start_dir)
+            zinfo.header_offset = zf.fp.tell()
+            zf._writecheck(zinfo)
+            zf._didModify = True
+
+            zf.fp.write(zinfo.FileHeader(zip64))
+            zf.fp.write(data)
+            zf.start_dir = zf.fp.tell()
+
+            zf.filelist.append(zinfo)
+            zf.NameToInfo[zinfo.filename] = zinfo
+
+    # Wait for everything that's been added, finish the .ZIP file, and put it in place of the old one.
+    # Returns the ZipStats
+    def close(self) -> ZipStats:
+        if self._closed:
+            return self.stats
+        self._closed = True
+
+        try:
+            while len(self._work) > 0:
+                self._write_next()
+            self._work.close()
+            self._zip.close()
+            os.replace(self._fp_zip_tmp, self.fp_zip)
+        except BaseException:
+            self._discard()
+            raise
+
+        stat = os.stat(self.fp_zip)
+        get_app_cache().set(self._cache_key,
+                            {'zip_size': stat.st_size, 'zip_mtime_ns': stat.st_mtime_ns, 'members': self._manifest},
+                            expire=APP_CACHE_EXPIRATION)
+
+        self.stats.seconds = time.perf_counter() - self._start
+        return self.stats
+
+    # Something went wrong, so leave the previous .ZIP file (and its manifest) alone
+    def _discard(self):
+        self._closed = True
+        self._work.close(cancel_pending=True)
+        self._zip.close()
+        if os.path.exists(self._fp_zip_tmp):
+            os.remove(self._fp_zip_tmp)